@@ -1,20 +1,51 @@
 import streamlit as st
 import pymongo
-from datetime import datetime, timezone
+from pymongo import ReturnDocument
+from datetime import datetime, timezone, timedelta
 from authlib.integrations.requests_client import OAuth2Session
+from authlib.jose import JsonWebKey, jwt
 import urllib.parse
 import pandas as pd
+import numpy as np
+import bson
 from bson import ObjectId
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
 import plotly.express as px
 import plotly.graph_objects as go
 import os
+import socket
+import functools
+import contextvars
 import hashlib
+import json
 import secrets
 import smtplib, ssl
+from contextlib import ExitStack, contextmanager
+from email import policy as email_policy
 from email.message import EmailMessage
 
 
 import threading, requests, time
+import asyncio
+import httpx
+import ipaddress
+import atexit
+import bisect
+import heapq
+import itertools
+import re
+import zlib
+import random
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import Counter, deque
+import cProfile, pstats, tracemalloc
+from pymongo import monitoring
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as pa_ds
+import pyarrow.parquet as pq
+import duckdb
 
 def keep_alive():
     while True:
@@ -39,15 +70,322 @@ st.set_page_config(
 MONGO_URI = os.getenv("MONGO_URI")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "Cluster0")
 
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zlib")          # e.g. "zstd,zlib" if zstandard is installed
+MONGO_MAX_STALENESS = max(90, int(os.getenv("MONGO_MAX_STALENESS", "120")))  # server minimum is 90s
+
+# Named connection profiles: each gets its own MongoClient (pool, timeouts, read routing).
+# "interactive" serves grading, sessions and other writes on the primary;
+# "analytics" serves dashboards, analytics and exports from secondaries with bounded staleness.
+# On a single-host replica set (mongod --replSet rs0) secondaryPreferred simply reads the primary.
+CONNECTION_PROFILES = {
+    "interactive": {
+        "maxPoolSize": int(os.getenv("MONGO_INTERACTIVE_POOL", "50")),
+        "connectTimeoutMS": 5000,
+        "serverSelectionTimeoutMS": 5000,
+        "socketTimeoutMS": 20000,
+        "compressors": MONGO_COMPRESSORS,
+        "readPreference": "primary",
+        "readConcernLevel": "local",
+        "w": "majority",
+        "retryWrites": True,
+    },
+    "analytics": {
+        "maxPoolSize": int(os.getenv("MONGO_ANALYTICS_POOL", "10")),
+        "connectTimeoutMS": 10000,
+        "serverSelectionTimeoutMS": 10000,
+        "socketTimeoutMS": 120000,
+        "compressors": MONGO_COMPRESSORS,
+        "readPreference": "secondaryPreferred",
+        "maxStalenessSeconds": MONGO_MAX_STALENESS,
+        "readConcernLevel": "majority",
+        "appname": "innoverse-admin-analytics",
+    },
+}
+DEFAULT_PROFILE = "interactive"
+_active_profile = contextvars.ContextVar("mongo_profile", default=DEFAULT_PROFILE)
+
+
+# --- Metrics ---
+# Process-wide counters and latency histograms, exported in Prometheus text format on a
+# side port and sampled into metrics_snapshots for the superadmin view.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))            # 0 disables the exporter
+METRICS_SNAPSHOT_SECONDS = int(os.getenv("METRICS_SNAPSHOT_SECONDS", "60"))
+METRICS_RETENTION_DAYS = 7
+# seconds; wide enough for a 1 ms index hit and a 10 s analytics page
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_HELP = {
+    "portal_page_render_seconds": ("histogram", "Wall time of one page function run"),
+    "portal_mongo_command_seconds": ("histogram", "MongoDB command round-trip time"),
+    "portal_mongo_command_failures_total": ("counter", "MongoDB commands that failed"),
+    "portal_emails_total": ("counter", "Email recipients by outcome"),
+    "portal_smtp_retries_total": ("counter", "SMTP sends retried after a transient failure"),
+    "portal_sender_emails_total": ("counter", "Email recipients handed to each sending account"),
+    "portal_sender_benched_total": ("counter", "Sending accounts taken out of rotation, by reason"),
+    "portal_sender_failovers_total": ("counter", "Sends moved to another account, by reason"),
+    "portal_session_validations_total": ("counter", "Session token validations by result"),
+    "portal_cache_lookups_total": ("counter", "Cached query lookups"),
+    "portal_cache_misses_total": ("counter", "Cached query lookups that went to MongoDB"),
+    "portal_link_checks_total": ("counter", "Submission URL checks by result"),
+    "portal_snapshot_syncs_total": ("counter", "Analytics snapshot sync runs"),
+}
+
+
+class Metrics:
+    """Counters and fixed-bucket histograms keyed by (name, labels); one short lock per record."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}   # key → [per-bucket counts (+Inf last), sum, count]
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(labels.items()))
+        idx = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            h[0][idx] += 1
+            h[1] += seconds
+            h[2] += 1
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def value(self, name: str, **labels) -> float:
+        """Counter total; with no labels, summed over every label set."""
+        with self._lock:
+            if labels:
+                return self._counters.get((name, tuple(labels.items())), 0)
+            return sum(v for (n, _), v in self._counters.items() if n == name)
+
+    def _copy(self):
+        with self._lock:
+            return dict(self._counters), {k: ([*h[0]], h[1], h[2]) for k, h in self._histograms.items()}
+
+    def quantile(self, counts: list[int], q: float) -> float:
+        """Estimate from bucket counts by linear interpolation (as histogram_quantile does)."""
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank, seen = q * total, 0
+        for i, c in enumerate(counts):
+            if seen + c >= rank:
+                lo = self.buckets[i - 1] if i else 0.0
+                hi = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lo + (hi - lo) * ((rank - seen) / c if c else 0)
+            seen += c
+        return self.buckets[-1]
+
+    def render_prometheus(self) -> str:
+        counters, histograms = self._copy()
+        esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        fmt = lambda labels: "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels) + "}" if labels else ""
+        lines, typed = [], set()
+        for (name, labels), v in sorted(counters.items()):
+            if name not in typed:
+                kind, help_ = METRIC_HELP.get(name, ("counter", name))
+                lines += [f"# HELP {name} {help_}", f"# TYPE {name} {kind}"]
+                typed.add(name)
+            lines.append(f"{name}{fmt(labels)} {v}")
+        for (name, labels), (counts, total, n) in sorted(histograms.items()):
+            if name not in typed:
+                kind, help_ = METRIC_HELP.get(name, ("histogram", name))
+                lines += [f"# HELP {name} {help_}", f"# TYPE {name} {kind}"]
+                typed.add(name)
+            cum = 0
+            for le, c in zip([*self.buckets, "+Inf"], counts):
+                cum += c
+                lines.append(f"{name}_bucket{fmt((*labels, ('le', le)))} {cum}")
+            lines.append(f"{name}_sum{fmt(labels)} {total}")
+            lines.append(f"{name}_count{fmt(labels)} {n}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """Flat, Mongo-friendly view: counters plus count/sum/p50/p95/p99 per histogram."""
+        counters, histograms = self._copy()
+        return {
+            "counters": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in counters.items()],
+            "histograms": [{
+                "name": n, "labels": dict(l), "count": cnt, "sum": round(total, 6),
+                "buckets": counts,
+                "p50": round(self.quantile(counts, 0.50), 6),
+                "p95": round(self.quantile(counts, 0.95), 6),
+                "p99": round(self.quantile(counts, 0.99), 6),
+            } for (n, l), (counts, total, cnt) in histograms.items()],
+        }
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Command latency by collection; started events only stash the collection name."""
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+        self._inflight = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        self._inflight[(event.request_id, event.connection_id)] = target if isinstance(target, str) else "-"
+
+    def succeeded(self, event):
+        coll = self._inflight.pop((event.request_id, event.connection_id), "-")
+        self.metrics.observe("portal_mongo_command_seconds", event.duration_micros / 1e6,
+                             collection=coll, command=event.command_name)
+
+    def failed(self, event):
+        coll = self._inflight.pop((event.request_id, event.connection_id), "-")
+        self.metrics.observe("portal_mongo_command_seconds", event.duration_micros / 1e6,
+                             collection=coll, command=event.command_name)
+        self.metrics.inc("portal_mongo_command_failures_total", collection=coll, command=event.command_name)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    metrics: Metrics = None
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.metrics.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@st.cache_resource
+def get_metrics() -> Metrics:
+    return Metrics()
+
+
+# One registry per process; resolved once per script run so hot paths skip the cache_resource lookup
+METRICS = get_metrics()
+
+
+@st.cache_resource
+def start_metrics_exporter() -> ThreadingHTTPServer | None:
+    """Serve /metrics on METRICS_HOST:METRICS_PORT (once per process)."""
+    if not METRICS_PORT:
+        return None
+    handler = type("MetricsHandler", (_MetricsHandler,), {"metrics": METRICS})
+    try:
+        server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), handler)
+    except OSError as e:
+        print(f"[Metrics] Exporter not started on {METRICS_HOST}:{METRICS_PORT}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-exporter").start()
+    return server
+
+
+def _metrics_sample_loop(metrics: Metrics):
+    host = f"{socket.gethostname()}:{os.getpid()}"
+    while True:
+        time.sleep(METRICS_SNAPSHOT_SECONDS)
+        try:
+            db.metrics_snapshots.insert_one({"ts": datetime.now(timezone.utc), "host": host, **metrics.snapshot()})
+        except pymongo.errors.PyMongoError as e:
+            print(f"[Metrics] Snapshot failed: {e}")
+
+
+@st.cache_resource
+def start_metrics_sampler() -> bool:
+    """Store a snapshot in metrics_snapshots every METRICS_SNAPSHOT_SECONDS (once per process)."""
+    threading.Thread(target=_metrics_sample_loop, args=(METRICS,), daemon=True,
+                     name="metrics-sampler").start()
+    return True
+
+
 @st.cache_resource
 def init_connection():
+    """One MongoClient per connection profile, shared by every session in the process."""
     if not MONGO_URI:
         st.error("Missing MONGO_URI. Set it in Render → Environment.")
         st.stop()
-    return pymongo.MongoClient(MONGO_URI)
+    listeners = [MongoCommandMetrics(METRICS)]
+    return {name: pymongo.MongoClient(MONGO_URI, event_listeners=listeners, **opts)
+            for name, opts in CONNECTION_PROFILES.items()}
+
+def uses_profile(profile: str):
+    """Page decorator: Mongo reads inside the page go through the named connection profile."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            token = _active_profile.set(profile)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _active_profile.reset(token)
+        wrapper.mongo_profile = profile
+        return wrapper
+    return deco
+
+def current_profile() -> str:
+    return _active_profile.get()
+
+
+class ProfiledCollection:
+    """Collection handle resolved against the active connection profile on each use."""
+    __slots__ = ("_name",)
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, item):
+        return getattr(mongo_clients[_active_profile.get()][DATABASE_NAME][self._name], item)
+
+    def __repr__(self):
+        return f"ProfiledCollection({self._name!r})"
+
+
+class ProfiledDatabase:
+    """Database handle: `db.users` / `db["users"]` give profile-aware collections."""
+    __slots__ = ()
+
+    def database(self) -> pymongo.database.Database:
+        """The pymongo Database of the active connection profile."""
+        return mongo_clients[_active_profile.get()][DATABASE_NAME]
+
+    def command(self, *args, **kwargs):
+        return self.database().command(*args, **kwargs)
+
+    def list_collection_names(self, *args, **kwargs):
+        return self.database().list_collection_names(*args, **kwargs)
+
+    def create_collection(self, *args, **kwargs):
+        return self.database().create_collection(*args, **kwargs)
+
+    def watch(self, *args, **kwargs):
+        return self.database().watch(*args, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return ProfiledCollection(name)
+
+    def __getitem__(self, name):
+        return ProfiledCollection(name)
 
-client = init_connection()
-db = client[DATABASE_NAME]
+
+mongo_clients = init_connection()
+client = mongo_clients[DEFAULT_PROFILE]
+db = ProfiledDatabase()
 
 
 # Collections
@@ -60,6 +398,557 @@ forum_comments_col = db.forum_comments
 sessions_col = db.admin_sessions
 
 
+# --- Change-stream cache invalidation ---
+# Collections the portal reads; writes from any replica (or the student app)
+# bump version counters so cached reads invalidate precisely.
+CACHE_WATCH_COLLECTIONS = ["users", "submissions", "tasks", "task_assignments",
+                           "forums", "forum_comments", "admins", "submission_signatures"]
+CACHE_FALLBACK_TTL = int(os.getenv("CACHE_FALLBACK_TTL", "30"))       # seconds, TTL-only mode
+CACHE_MAX_TTL = int(os.getenv("CACHE_MAX_TTL", "3600"))               # hard ceiling in stream mode
+CACHE_HASH_FUNCS = {ObjectId: str}     # st.cache_data can't hash ObjectId arguments on its own
+CACHE_WATCHER_ID = os.getenv("CACHE_WATCHER_ID", socket.gethostname())
+cache_state_col = db.cache_state
+
+# Server errors meaning "change streams will never work here" (standalone mongod, no privileges)
+_CHANGE_STREAM_UNSUPPORTED = {40573, 40324, 13, 115}
+# Resume token fell off the oplog / stream can't be resumed → restart from "now"
+_CHANGE_STREAM_HISTORY_LOST = {286, 280}
+
+
+class CacheVersions:
+    """
+    Version counters for cached reads.
+    Keys: "users" (any change), "users/*" (insert/delete/replace),
+          "users.stats.points" (field updates), ("users", _id) (one document).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+        self.mode = "ttl"            # "stream" while the watcher is tailing
+        self.last_event_at = None
+        self.events_seen = 0
+
+    def bump(self, coll, doc_id=None, fields=None):
+        keys = [coll]
+        if fields is None:
+            keys.append(f"{coll}/*")
+        else:
+            for path in fields:
+                parts = path.split(".")
+                keys.extend(f"{coll}." + ".".join(parts[:i]) for i in range(1, len(parts) + 1))
+        if doc_id is not None:
+            keys.append((coll, doc_id))
+        with self._lock:
+            for k in keys:
+                self._versions[k] = self._versions.get(k, 0) + 1
+
+    def bump_all(self):
+        """Something may have been missed (stream restart): invalidate everything."""
+        with self._lock:
+            for k in self._versions:
+                self._versions[k] += 1
+            for coll in CACHE_WATCH_COLLECTIONS:
+                self._versions[coll] = self._versions.get(coll, 0) + 1
+                self._versions[f"{coll}/*"] = self._versions.get(f"{coll}/*", 0) + 1
+
+    def token(self, *keys):
+        """Hashable cache key for the given collection / field / (collection, _id) keys."""
+        parts = []
+        with self._lock:
+            for key in keys:
+                if isinstance(key, tuple):
+                    parts.append(self._versions.get(key, 0))
+                    continue
+                coll, _, path = key.partition(".")
+                if not path:
+                    parts.append(self._versions.get(coll, 0))
+                    continue
+                parts.append(self._versions.get(f"{coll}/*", 0))
+                segs = path.split(".")
+                parts.extend(self._versions.get(f"{coll}." + ".".join(segs[:i]), 0)
+                             for i in range(1, len(segs) + 1))
+        if self.mode != "stream":
+            # TTL-only mode: rotate the key every CACHE_FALLBACK_TTL seconds
+            parts.append(int(time.time() // CACHE_FALLBACK_TTL))
+        return tuple(parts)
+
+
+class ChangeStreamWatcher:
+    """Tails a database change stream and bumps CacheVersions; resumes from a stored token."""
+
+    def __init__(self, database, versions: CacheVersions, state_col, watcher_id: str):
+        self._db = database
+        self._versions = versions
+        self._state_col = state_col
+        self._id = watcher_id
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_error = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="cache-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _pipeline(self):
+        changed = {
+            "$concatArrays": [
+                {"$map": {"input": {"$objectToArray": {"$ifNull": ["$updateDescription.updatedFields", {}]}},
+                          "as": "f", "in": "$$f.k"}},
+                {"$ifNull": ["$updateDescription.removedFields", []]},
+            ]
+        }
+        return [
+            {"$match": {"$or": [
+                {"ns.coll": {"$in": CACHE_WATCH_COLLECTIONS}},
+                {"operationType": {"$in": ["dropDatabase", "invalidate"]}},
+            ]}},
+            # only field names travel over the wire, never document bodies
+            {"$set": {"changed_fields": changed}},
+            {"$project": {"operationType": 1, "ns": 1, "documentKey": 1, "changed_fields": 1}},
+        ]
+
+    def _load_token(self):
+        state = self._state_col.find_one({"_id": self._id})
+        return state.get("resume_token") if state else None
+
+    def _save_token(self, token):
+        if token is None:
+            self._state_col.delete_one({"_id": self._id})
+            return
+        self._state_col.update_one(
+            {"_id": self._id},
+            {"$set": {"resume_token": token, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+
+    def _apply(self, change):
+        op = change.get("operationType")
+        coll = (change.get("ns") or {}).get("coll")
+        if op in ("dropDatabase", "invalidate") or not coll:
+            self._versions.bump_all()
+            return
+        doc_id = (change.get("documentKey") or {}).get("_id")
+        if op == "update":
+            self._versions.bump(coll, doc_id, fields=change.get("changed_fields") or [])
+        else:  # insert / replace / delete / drop / rename
+            self._versions.bump(coll, doc_id)
+        self._versions.events_seen += 1
+        self._versions.last_event_at = datetime.now(timezone.utc)
+
+    def _run(self):
+        backoff = 1
+        while not self._stop.is_set():
+            token = self._load_token()
+            saved = token
+            try:
+                with self._db.watch(self._pipeline(), resume_after=token, max_await_time_ms=1000) as stream:
+                    self._versions.mode = "stream"
+                    self.last_error = None
+                    backoff = 1
+                    last_flush = time.monotonic()
+                    while stream.alive and not self._stop.is_set():
+                        change = stream.try_next()
+                        if change is not None:
+                            self._apply(change)
+                            if change.get("operationType") == "invalidate":
+                                # an invalidated stream can't be resumed; start fresh
+                                self._save_token(None)
+                                break
+                        if time.monotonic() - last_flush >= 5 and stream.resume_token != saved:
+                            saved = stream.resume_token
+                            self._save_token(saved)
+                            last_flush = time.monotonic()
+                    else:
+                        if stream.resume_token != saved:
+                            self._save_token(stream.resume_token)
+            except pymongo.errors.OperationFailure as e:
+                self._versions.mode = "ttl"
+                self.last_error = str(e)
+                if e.code in _CHANGE_STREAM_UNSUPPORTED:
+                    print(f"[CacheWatcher] Change streams unavailable, TTL-only mode: {e}")
+                    return
+                self._versions.bump_all()
+                if e.code in _CHANGE_STREAM_HISTORY_LOST:
+                    self._save_token(None)
+                    continue
+                print(f"[CacheWatcher] Stream failed, retrying in {backoff}s: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60)
+            except pymongo.errors.PyMongoError as e:
+                self._versions.mode = "ttl"
+                self.last_error = str(e)
+                self._versions.bump_all()
+                print(f"[CacheWatcher] Stream error, retrying in {backoff}s: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60)
+
+
+@st.cache_resource
+def get_cache_versions() -> CacheVersions:
+    return CacheVersions()
+
+@st.cache_resource
+def start_cache_watcher() -> ChangeStreamWatcher:
+    """One watcher per process (cache_resource survives reruns)."""
+    return ChangeStreamWatcher(db, get_cache_versions(), cache_state_col, CACHE_WATCHER_ID).start()
+
+def cache_token(*keys):
+    # profile is part of the key so a lagging secondary's answer never serves a primary read
+    return get_cache_versions().token(*keys) + (_active_profile.get(),)
+
+def note_write(coll, doc_id=None, fields=None):
+    """Bump versions right after a local write so this replica doesn't wait for the stream echo."""
+    get_cache_versions().bump(coll, doc_id, fields)
+
+@st.cache_data(ttl=CACHE_MAX_TTL, max_entries=512, show_spinner=False, hash_funcs=CACHE_HASH_FUNCS)
+def _cached_count(coll: str, query: dict, version: tuple) -> int:
+    METRICS.inc("portal_cache_misses_total", fn="count")
+    if not query:
+        return db[coll].estimated_document_count()   # metadata count, no scan
+    return db[coll].count_documents(query)
+
+@st.cache_data(ttl=CACHE_MAX_TTL, max_entries=256, show_spinner=False, hash_funcs=CACHE_HASH_FUNCS)
+def _cached_find(coll: str, query: dict, projection: dict | None, sort: list | None, limit: int,
+                 version: tuple) -> list[dict]:
+    METRICS.inc("portal_cache_misses_total", fn="find")
+    cur = db[coll].find(query, projection)
+    if sort:
+        cur = cur.sort(sort)
+    if limit:
+        cur = cur.limit(limit)
+    return list(cur)
+
+@st.cache_data(ttl=CACHE_MAX_TTL, max_entries=4096, show_spinner=False, hash_funcs=CACHE_HASH_FUNCS)
+def _cached_find_one(coll: str, doc_id, projection: dict | None, version: tuple) -> dict | None:
+    METRICS.inc("portal_cache_misses_total", fn="find_one")
+    return db[coll].find_one({"_id": doc_id}, projection)
+
+def cached_count(coll: str, query: dict | None = None, keys=None) -> int:
+    """count_documents cached until `coll` (or the given version keys) change."""
+    METRICS.inc("portal_cache_lookups_total", fn="count")
+    return _cached_count(coll, query or {}, cache_token(*(keys or [coll])))
+
+def cached_find(coll: str, query: dict | None = None, projection: dict | None = None,
+                sort: list | None = None, limit: int = 0, keys=None) -> list[dict]:
+    """Small pick-list style finds; pass field keys (e.g. "users.name") to survive unrelated updates."""
+    METRICS.inc("portal_cache_lookups_total", fn="find")
+    return _cached_find(coll, query or {}, projection, sort, limit, cache_token(*(keys or [coll])))
+
+def cached_find_one(coll: str, doc_id, projection: dict | None = None) -> dict | None:
+    """Single document by _id, invalidated only when that document changes."""
+    METRICS.inc("portal_cache_lookups_total", fn="find_one")
+    return _cached_find_one(coll, doc_id, projection, cache_token((coll, doc_id)))
+
+
+# --- Raw BSON row views ---
+# List pages read a handful of fields per document. Their cursors return RawBSONDocument
+# (undecoded bytes) and a RowView decodes just its FIELDS into __slots__. LAZY fields such as
+# submission text are projected into their own sub-document and stay bytes until read.
+RAW_CODEC = CodecOptions(document_class=RawBSONDocument)
+_MISSING = object()
+
+
+class RowView:
+    """
+    Row over a raw BSON document. Subclasses set `__slots__ = FIELDS = (...)` for the fields
+    decoded up front, LAZY for top-level fields decoded on each access, and optionally PROJECTION
+    (rows without LAZY fields only). Rows answer row["f"], row.get("f") and "f" in row like the
+    dicts the pages used before.
+    """
+    __slots__ = ("_raw",)
+    FIELDS: tuple = ()
+    LAZY: tuple = ()
+    PROJECTION: dict | None = None
+    _fields = _lazy = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields, cls._lazy = frozenset(cls.FIELDS), frozenset(cls.LAZY)
+
+    def __init__(self, raw: RawBSONDocument):
+        if self.LAZY:
+            # {"row": {...FIELDS}, "lazy": {...LAZY}}: one C decode for the row, none for the rest
+            values = bson.decode(raw["row"].raw)
+            self._raw = raw["lazy"].raw
+        else:
+            values = bson.decode(raw.raw)
+            self._raw = None
+        # fields absent from the document stay unset slots
+        for name in self.FIELDS:
+            if name in values:
+                setattr(self, name, values[name])
+
+    @classmethod
+    def projection(cls) -> dict:
+        if not cls.LAZY:
+            return cls.PROJECTION or {name: 1 for name in cls.FIELDS}
+        # missing fields drop out of projected sub-documents, so "in" and .get() still work
+        return {"_id": 0, "row": {name: f"${name}" for name in cls.FIELDS},
+                "lazy": {name: f"${name}" for name in cls.LAZY}}
+
+    def _value(self, name):
+        if name in self._fields:
+            return getattr(self, name, _MISSING)
+        if name in self._lazy:
+            return bson.decode(self._raw).get(name, _MISSING)
+        return _MISSING
+
+    def __getitem__(self, name):
+        value = self._value(name)
+        if value is _MISSING:
+            raise KeyError(name)
+        return value
+
+    def get(self, name, default=None):
+        value = self._value(name)
+        return default if value is _MISSING else value
+
+    def __contains__(self, name):
+        return self._value(name) is not _MISSING
+
+    def __repr__(self):
+        return f"{type(self).__name__}(_id={self.get('_id')!r})"
+
+
+def find_rows(coll: str, row_cls: type[RowView], query: dict, sort=None, skip: int = 0, limit: int = 0) -> list:
+    """find() on the active profile returning row views built from raw BSON batches."""
+    cur = db[coll].with_options(codec_options=RAW_CODEC).find(query, row_cls.projection())
+    if sort:
+        cur = cur.sort(sort)
+    if skip:
+        cur = cur.skip(skip)
+    if limit:
+        cur = cur.limit(limit)
+    return [row_cls(raw) for raw in cur]
+
+
+
+# --- Admin audit log ---
+# Actions are queued in-process and written by a background thread with insert_many, so a
+# click never waits on the audit write. Old entries expire through the TTL index on ts.
+AUDIT_RETENTION_DAYS = int(os.getenv("AUDIT_RETENTION_DAYS", "365"))
+AUDIT_FLUSH_SECONDS = 2.0
+AUDIT_FLUSH_BATCH = 500
+AUDIT_BUFFER_MAX = 20000
+admin_audit_col = db.admin_audit
+
+
+def _bson_safe(value):
+    """`value` with anything BSON cannot encode (custom objects, huge ints, non-str keys) as a string."""
+    if isinstance(value, dict):
+        return {str(k): _bson_safe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_bson_safe(v) for v in value]
+    try:
+        bson.encode({"v": value})
+        return value
+    except (bson.errors.BSONError, OverflowError):
+        return repr(value)
+
+
+class AuditBuffer:
+    """Bounded in-memory queue of audit events, drained to Mongo in batches."""
+
+    def __init__(self, collection, interval: float = AUDIT_FLUSH_SECONDS,
+                 batch_size: int = AUDIT_FLUSH_BATCH, max_events: int = AUDIT_BUFFER_MAX,
+                 name: str = "audit-flush"):
+        self.collection = collection
+        self.name = name
+        self.interval = interval
+        self.batch_size = batch_size
+        # if Mongo is unreachable for long, the oldest events are dropped rather than memory growing
+        self._events = deque(maxlen=max_events)
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self.flushed = 0
+        self.dropped = 0
+        self.sanitized = 0
+        self.last_error = None
+        self.last_flush_at = None
+
+    def record(self, event: dict):
+        if len(self._events) == self._events.maxlen:
+            self.dropped += 1
+        self._events.append(event)
+        if len(self._events) >= self.batch_size:
+            self._wake.set()
+
+    def pending(self) -> int:
+        return len(self._events)
+
+    def _note_error(self, e: Exception):
+        self.last_error = f"{datetime.now(timezone.utc):%H:%M:%S} {e}"
+
+    def _requeue(self, batch: list):
+        """Put a failed batch back in front; what no longer fits counts as dropped (oldest first)."""
+        overflow = len(batch) + len(self._events) - self._events.maxlen
+        if overflow > 0:
+            self.dropped += overflow
+            batch = batch[overflow:]
+        self._events.extendleft(reversed(batch))
+
+    def _encodable(self, batch: list) -> list:
+        """The batch with unencodable values replaced by their repr; events still failing are dropped."""
+        kept = []
+        for event in batch:
+            try:
+                bson.encode(event)
+            except (bson.errors.BSONError, OverflowError):
+                event = _bson_safe(event)
+                try:
+                    bson.encode(event)
+                except (bson.errors.BSONError, OverflowError):
+                    self.dropped += 1
+                    continue
+                self.sanitized += 1
+            kept.append(event)
+        return kept
+
+    def flush(self) -> int:
+        """Write everything queued so far; on failure the batch goes back to the front."""
+        written = 0
+        with self._flush_lock:
+            while self._events:
+                batch = []
+                while self._events and len(batch) < self.batch_size:
+                    batch.append(self._events.popleft())
+                try:
+                    try:
+                        self.collection.insert_many(batch, ordered=False)
+                    except (bson.errors.BSONError, OverflowError) as e:
+                        # one bad event must not lose the batch or stall the queue behind it
+                        self._note_error(e)
+                        batch = self._encodable(batch)
+                        if batch:
+                            self.collection.insert_many(batch, ordered=False)
+                except pymongo.errors.PyMongoError as e:
+                    self._requeue(batch)
+                    self._note_error(e)
+                    break
+                written += len(batch)
+            if written:
+                self.flushed += written
+                self.last_flush_at = datetime.now(timezone.utc)
+        return written
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:      # keep the flusher alive whatever a batch does
+                self._note_error(e)
+                print(f"[{self.name}] flush failed: {e}")
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True, name=self.name).start()
+        atexit.register(self.flush)
+
+
+@st.cache_resource
+def get_audit_buffer() -> AuditBuffer:
+    buf = AuditBuffer(admin_audit_col)
+    buf.start()
+    return buf
+
+
+def audit(action: str, target_type: str | None = None, target_id=None, admin: str | None = None, **details):
+    """Queue an audit event for the current admin; never raises into the page."""
+    try:
+        state = st.session_state
+        event = {
+            "ts": datetime.now(timezone.utc),
+            "admin": admin or state.get("admin_username") or "unknown",
+            "role": state.get("effective_role"),
+            "action": action,
+        }
+        if target_type:
+            event["target"] = {"type": target_type, "id": target_id}
+        if details:
+            event["details"] = details
+        get_audit_buffer().record(event)
+    except Exception as e:
+        print(f"[Audit] Could not record {action}: {e}")
+
+
+# --- Activity stream ---
+# Append-only events in a time-series collection (timeField ts, metaField meta) for trend
+# charts; documents elsewhere are updated in place and keep no history. Buckets expire
+# after ACTIVITY_RETENTION_DAYS. Written through the same buffered flusher as the audit log.
+ACTIVITY_GRANULARITY = os.getenv("ACTIVITY_GRANULARITY", "minutes")   # "seconds" | "minutes" | "hours"
+ACTIVITY_RETENTION_DAYS = int(os.getenv("ACTIVITY_RETENTION_DAYS", "400"))
+activity_events_col = db.activity_events
+
+
+@st.cache_resource
+def get_activity_buffer() -> AuditBuffer:
+    buf = AuditBuffer(activity_events_col, name="activity-flush")
+    buf.start()
+    return buf
+
+
+def record_activity(kind: str, admin: str | None = None, tags: dict | None = None, count: int = 1, **fields):
+    """
+    Queue one activity event. `kind`, `admin` and `tags` go into meta (the series key, keep
+    them low-cardinality); `count` and `fields` are per-event values.
+    """
+    try:
+        meta = {"kind": kind, "admin": admin or st.session_state.get("admin_username") or "system"}
+        if tags:
+            meta.update(tags)
+        get_activity_buffer().record({"ts": datetime.now(timezone.utc), "meta": meta, "count": count, **fields})
+    except Exception as e:
+        print(f"[Activity] Could not record {kind}: {e}")
+
+
+def ensure_activity_collection():
+    """Create the time-series collection, or bring its expiry in line with the config."""
+    expire = ACTIVITY_RETENTION_DAYS * 86400
+    if db.list_collection_names(filter={"name": "activity_events"}):
+        db.command("collMod", "activity_events", expireAfterSeconds=expire)
+        return
+    try:
+        db.create_collection("activity_events", expireAfterSeconds=expire, timeseries={
+            "timeField": "ts", "metaField": "meta", "granularity": ACTIVITY_GRANULARITY,
+        })
+    except pymongo.errors.CollectionInvalid:
+        pass   # another replica created it first
+
+
+# --- Email delivery log ---
+# One row per recipient per message, so a student's timeline can show what they were sent.
+EMAIL_DELIVERY_RETENTION_DAYS = int(os.getenv("EMAIL_DELIVERY_RETENTION_DAYS", "365"))
+email_deliveries_col = db.email_deliveries
+
+
+@st.cache_resource
+def get_delivery_log() -> AuditBuffer:
+    buf = AuditBuffer(email_deliveries_col, name="delivery-flush")
+    buf.start()
+    return buf
+
+
+def log_deliveries(addresses, subject: str, status: str, kind: str = "email", task_id=None, error: str | None = None):
+    try:
+        now = datetime.now(timezone.utc)
+        log = get_delivery_log()
+        for addr in addresses:
+            if not addr:
+                continue
+            entry = {"email": addr.strip().lower(), "sent_at": now, "subject": subject, "status": status,
+                     "kind": kind, "task_id": task_id}
+            if error:
+                entry["error"] = error[:300]
+            log.record(entry)
+    except Exception as e:
+        print(f"[Deliveries] Could not log {subject!r}: {e}")
+
 # --- Role & session helpers ---
 def get_admin_by_id(admin_id):
     return admin_col.find_one({"_id": admin_id})
@@ -93,10 +982,9 @@ def _get_env_or_error(key: str) -> str:
     return val
 
 def get_sender_identity():
-    """Returns (address, display_name)."""
-    email_addr = _get_env_or_error("GMAIL_ADDRESS")
-    display = os.getenv("SENDER_NAME", "Innoverse USICT")
-    return email_addr, display
+    """Returns (address, display_name) of the pool's first sender; sends rewrite From per account."""
+    sender = get_sender_pool().primary
+    return sender["address"], sender["name"]
 
 def _build_email(subject: str, html_body: str, to_addr: str, from_addr: str, from_name: str) -> EmailMessage:
     msg = EmailMessage()
@@ -107,18 +995,503 @@ def _build_email(subject: str, html_body: str, to_addr: str, from_addr: str, fro
     msg.add_alternative(html_body, subtype="html")
     return msg
 
-def send_email_smtp(msg: EmailMessage):
-    """Send a single email via Gmail SMTP (App Password)."""
-    gmail_addr = _get_env_or_error("GMAIL_ADDRESS")
-    gmail_app_pw = _get_env_or_error("GMAIL_APP_PASSWORD")
+# Gmail by default; point elsewhere (e.g. mail_loadtest.py's local sink) via env
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") != "0"
+SMTP_MAX_RETRIES = int(os.getenv("SMTP_MAX_RETRIES", "3"))
+SMTP_RETRY_BASE = float(os.getenv("SMTP_RETRY_BASE", "2.0"))
+# pause between messages/chunks; Gmail throttles bursts
+SMTP_SEND_DELAY = float(os.getenv("SMTP_SEND_DELAY", "0.2"))
+
+# --- Sender pool ---
+# Campaigns are spread over several sending accounts so one account's daily cap doesn't limit
+# them. SENDER_POOL is a JSON list of {"address", "password" or "password_env", "name",
+# "daily_quota", "per_minute"}; without it the pool is the single GMAIL_ADDRESS account.
+# Daily usage lives in sender_usage so every replica draws from the same quota; an account
+# that is throttled or whose login fails is benched in sender_health and sends fail over.
+SENDER_NAME = os.getenv("SENDER_NAME", "Innoverse USICT")
+SENDER_DAILY_QUOTA = int(os.getenv("SENDER_DAILY_QUOTA", "450"))        # recipients/day; Gmail caps at 500
+SENDER_PER_MINUTE = int(os.getenv("SENDER_PER_MINUTE", "30"))           # messages/minute, per process
+SENDER_THROTTLE_COOLDOWN = int(os.getenv("SENDER_THROTTLE_COOLDOWN", "300"))   # after 421/454
+SENDER_AUTH_COOLDOWN = int(os.getenv("SENDER_AUTH_COOLDOWN", "21600"))         # after a rejected login
+SENDER_ROTATE_EVERY = int(os.getenv("SENDER_ROTATE_EVERY", "100"))     # recipients per connection
+SENDER_STATE_TTL = 15            # seconds between re-reads of shared usage and cooldowns
+SENDER_RESERVE_CHUNK = int(os.getenv("SENDER_RESERVE_CHUNK", "25"))   # quota taken at once by bulk sends
+SENDER_USAGE_RETENTION_DAYS = 90
+sender_usage_col = db.sender_usage
+sender_health_col = db.sender_health
+
+
+class NoSenderAvailable(RuntimeError):
+    """Every account in the pool is benched or out of today's quota."""
+
+
+def sender_pool_configured() -> bool:
+    return bool(os.getenv("SENDER_POOL") or (os.getenv("GMAIL_ADDRESS") and os.getenv("GMAIL_APP_PASSWORD")))
+
+
+def _load_senders() -> list[dict]:
+    raw = os.getenv("SENDER_POOL")
+    if not raw:
+        entries = [{"address": _get_env_or_error("GMAIL_ADDRESS"), "password": _get_env_or_error("GMAIL_APP_PASSWORD")}]
+    else:
+        try:
+            entries = json.loads(raw)
+        except ValueError as e:
+            raise ValueError(f"SENDER_POOL is not valid JSON: {e}") from None
+    senders = []
+    for entry in entries:
+        password = entry.get("password") or os.getenv(entry.get("password_env", ""), "")
+        if not (entry.get("address") and password):
+            raise ValueError(f"SENDER_POOL entry {entry.get('address', '?')!r} needs an address and a password")
+        senders.append({
+            "address": entry["address"].strip(),
+            "password": password,
+            "name": entry.get("name") or SENDER_NAME,
+            "daily_quota": int(entry.get("daily_quota", SENDER_DAILY_QUOTA)),
+            "per_minute": int(entry.get("per_minute", SENDER_PER_MINUTE)),
+        })
+    if not senders:
+        raise ValueError("SENDER_POOL is empty")
+    return senders
+
+
+def _utc_day(now: datetime | None = None) -> str:
+    return (now or datetime.now(timezone.utc)).strftime("%Y-%m-%d")
+
+
+def _sender_fault(exc: Exception) -> str | None:
+    """Errors about the sending account rather than the message; another account may succeed."""
+    if isinstance(exc, smtplib.SMTPAuthenticationError):
+        return "auth"
+    code = getattr(exc, "smtp_code", None)
+    text = getattr(exc, "smtp_error", b"") or b""
+    if isinstance(text, str):
+        text = text.encode()
+    if code == 550 and b"5.4.5" in text:         # Gmail: daily sending limit exceeded
+        return "quota"
+    if code in (421, 454):
+        return "throttled"
+    if isinstance(exc, smtplib.SMTPSenderRefused) and code and code >= 500:
+        return "rejected"
+    return None
+
+
+class SenderPool:
+    """
+    Sending accounts with shared daily quotas, per-minute pacing and cooldowns.
+    Quota is reserved before sending with a conditional update on today's sender_usage
+    document (per message, or ahead in chunks for bulk runs) and handed back if unused.
+    """
+
+    def __init__(self, senders: list[dict]):
+        self.senders = {s["address"]: s for s in senders}
+        self.primary = senders[0]
+        self._lock = threading.Lock()
+        self._recent = {a: deque() for a in self.senders}     # monotonic send times, last minute
+        self._remaining: dict[str, int] = {}
+        self._benched: dict[str, tuple[datetime, str]] = {}
+        self._day = None
+        self._refreshed_at = 0.0
+
+    def _refresh(self, force: bool = False):
+        day = _utc_day()
+        if not force and day == self._day and time.monotonic() - self._refreshed_at < SENDER_STATE_TTL:
+            return
+        used = {d["address"]: d.get("reserved", 0)
+                for d in sender_usage_col.find({"day": day, "address": {"$in": list(self.senders)}},
+                                               {"address": 1, "reserved": 1})}
+        now = datetime.now(timezone.utc)
+        benched = {d["_id"]: (d["until"], d.get("reason", ""))
+                   for d in sender_health_col.find({"_id": {"$in": list(self.senders)}, "until": {"$gt": now}})}
+        with self._lock:
+            self._day = day
+            self._remaining = {a: max(0, s["daily_quota"] - used.get(a, 0)) for a, s in self.senders.items()}
+            self._benched = benched
+            self._refreshed_at = time.monotonic()
+
+    def _wait(self, address: str) -> float:
+        """Seconds until this account may send again under its per-minute limit."""
+        recent = self._recent[address]
+        cutoff = time.monotonic() - 60
+        while recent and recent[0] < cutoff:
+            recent.popleft()
+        if len(recent) < self.senders[address]["per_minute"]:
+            return 0.0
+        return recent[0] - cutoff
+
+    def wait_time(self, address: str) -> float:
+        with self._lock:
+            return self._wait(address)
+
+    def pick(self, exclude=()) -> tuple[dict, float] | None:
+        """
+        Healthy account with the largest share of its quota left, so accounts drain in proportion;
+        ones that may send right away come first. Returns (sender, seconds to wait) or None.
+        """
+        self._refresh()
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            ready = [(self._wait(a), -self._remaining.get(a, 0) / s["daily_quota"], -self._remaining.get(a, 0), a)
+                     for a, s in self.senders.items()
+                     if a not in exclude and self._remaining.get(a, 0) > 0
+                     and not (a in self._benched and self._benched[a][0] > now)]
+        if not ready:
+            return None
+        wait, _, _, address = min(ready, key=lambda r: (r[0] > 0, r[0], r[1], r[2]))
+        return self.senders[address], wait
+
+    def reserve(self, sender: dict, n: int) -> int:
+        """Take up to n recipients of today's quota; returns how many were granted (0 when spent)."""
+        now = datetime.now(timezone.utc)
+        day, quota = _utc_day(now), sender["daily_quota"]
+        key = {"_id": f"{sender['address']}|{day}"}
+        sender_usage_col.update_one(key, {"$setOnInsert": {
+            "address": sender["address"], "day": day,
+            "day_start": datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc),
+            "reserved": 0, "sent": 0, "failed": 0,
+        }}, upsert=True)
+        doc = sender_usage_col.find_one_and_update(
+            {**key, "reserved": {"$lt": quota}},
+            [{"$set": {"grant": {"$min": [n, {"$subtract": [quota, "$reserved"]}]}}},
+             {"$set": {"reserved": {"$add": ["$reserved", "$grant"]}, "last_used_at": now}}],
+            projection={"grant": 1, "reserved": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        with self._lock:
+            self._remaining[sender["address"]] = quota - doc["reserved"] if doc else 0
+        return doc["grant"] if doc else 0
+
+    def release(self, sender: dict, n: int):
+        """Hand back quota for recipients that never reached the server."""
+        if n:
+            sender_usage_col.update_one({"_id": f"{sender['address']}|{_utc_day()}"}, {"$inc": {"reserved": -n}})
+            with self._lock:
+                self._remaining[sender["address"]] = self._remaining.get(sender["address"], 0) + n
+
+    def pace(self, sender: dict):
+        """Count one send against the account's per-minute limit."""
+        with self._lock:
+            self._recent[sender["address"]].append(time.monotonic())
+
+    def record(self, sender: dict, sent: int, failed: int = 0):
+        if sent or failed:
+            sender_usage_col.update_one({"_id": f"{sender['address']}|{_utc_day()}"},
+                                        {"$inc": {"sent": sent, "failed": failed}})
+
+    def bench(self, sender: dict, reason: str, exc: Exception):
+        """Take an account out of rotation: until tomorrow for a spent quota, else for a cooldown."""
+        now = datetime.now(timezone.utc)
+        if reason == "quota":
+            until = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc)
+        else:
+            until = now + timedelta(seconds=SENDER_AUTH_COOLDOWN if reason in ("auth", "rejected")
+                                    else SENDER_THROTTLE_COOLDOWN)
+        sender_health_col.update_one(
+            {"_id": sender["address"]},
+            {"$set": {"until": until, "reason": reason, "last_error": str(exc)[:300], "updated_at": now},
+             "$inc": {f"benched.{reason}": 1}},
+            upsert=True,
+        )
+        with self._lock:
+            self._benched[sender["address"]] = (until, reason)
+        METRICS.inc("portal_sender_benched_total", reason=reason)
+        print(f"[Senders] {sender['address']} benched until {until:%Y-%m-%d %H:%M} UTC ({reason}): {exc}")
+
+    def reinstate(self, address: str):
+        sender_health_col.update_one({"_id": address}, {"$set": {"until": datetime.now(timezone.utc)}})
+        with self._lock:
+            self._benched.pop(address, None)
+
+    def usage(self, days: int = 7) -> list[dict]:
+        """Per-account quota, today's counters, last `days` days sent, and cooldown state."""
+        self._refresh(force=True)
+        since = _utc_day(datetime.now(timezone.utc) - timedelta(days=days - 1))
+        rows = {d["_id"]: d for d in sender_usage_col.aggregate([
+            {"$match": {"address": {"$in": list(self.senders)}, "day": {"$gte": since}}},
+            {"$group": {"_id": "$address", "sent": {"$sum": "$sent"}, "failed": {"$sum": "$failed"},
+                        "today": {"$max": {"$cond": [{"$eq": ["$day", self._day]},
+                                                     {"sent": "$sent", "failed": "$failed",
+                                                      "reserved": "$reserved"}, None]}}}},
+        ])}
+        health = {d["_id"]: d for d in sender_health_col.find({"_id": {"$in": list(self.senders)}})}
+        now = datetime.now(timezone.utc)
+        out = []
+        for address, s in self.senders.items():
+            row, h = rows.get(address, {}), health.get(address, {})
+            today = row.get("today") or {}
+            until = h.get("until")
+            if until and until.tzinfo is None:
+                until = until.replace(tzinfo=timezone.utc)
+            out.append({
+                "address": address, "name": s["name"], "daily_quota": s["daily_quota"],
+                "per_minute": s["per_minute"], "today_sent": today.get("sent", 0),
+                "today_failed": today.get("failed", 0), "remaining": self._remaining.get(address, 0),
+                "week_sent": row.get("sent", 0), "week_failed": row.get("failed", 0),
+                "benched_until": until if until and until > now else None,
+                "reason": h.get("reason", "") if until and until > now else "",
+                "last_error": h.get("last_error", ""),
+            })
+        return out
+
+
+@st.cache_resource
+def get_sender_pool() -> SenderPool:
+    return SenderPool(_load_senders())
+
+
+@contextmanager
+def smtp_connection(sender: dict | None = None):
+    """Authenticated SMTP connection for one pool account (the first by default), reusable for many messages."""
+    sender = sender or get_sender_pool().primary
 
-    context = ssl.create_default_context()
-    # TLS on 587 (recommended)
-    with smtplib.SMTP("smtp.gmail.com", 587, timeout=30) as server:
+    with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30) as server:
         server.ehlo()
-        server.starttls(context=context)
-        server.login(gmail_addr, gmail_app_pw)
-        server.send_message(msg)
+        if SMTP_STARTTLS:
+            # TLS on 587 (recommended)
+            server.starttls(context=ssl.create_default_context())
+        server.login(sender["address"], sender["password"])
+        yield server
+
+def _smtp_transient(exc: Exception) -> bool:
+    """Worth retrying: dropped connections and 4xx replies such as 421 throttling."""
+    if isinstance(exc, (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)):
+        return True
+    return isinstance(exc, smtplib.SMTPResponseException) and 400 <= exc.smtp_code < 500
+
+def _count_transient(exc: Exception):
+    kind = "throttled" if getattr(exc, "smtp_code", None) == 421 else "deferred"
+    METRICS.inc("portal_emails_total", result=kind)
+
+def _smtp_backoff(attempt: int):
+    METRICS.inc("portal_smtp_retries_total")
+    time.sleep(SMTP_RETRY_BASE * (2 ** (attempt - 1)) * random.uniform(0.5, 1.0))
+
+def _as_sender(msg: EmailMessage, sender: dict) -> bytes:
+    """The message with its From header set to the account sending it."""
+    del msg["From"]
+    msg["From"] = f"{sender['name']} <{sender['address']}>"
+    return msg.as_bytes(policy=email_policy.SMTP)
+
+
+class PooledSMTP:
+    """
+    One SMTP connection at a time, drawn from the sender pool. deliver() reserves quota and
+    paces each send; a throttled account or rejected login moves the session to the next
+    healthy account, while other transient errors are retried on the same one with backoff.
+    With reserve_ahead > 1 quota is reserved in chunks and usage counters are written once
+    per chunk; what is left over goes back to the pool when the account changes or on close.
+    """
+
+    def __init__(self, pool: SenderPool, reserve_ahead: int = 1):
+        self.pool = pool
+        self.reserve_ahead = max(1, reserve_ahead)
+        self.sender = None
+        self.server = None
+        self._stack = None
+        self._on_connection = 0
+        self._held = 0              # quota reserved for self.sender and not used yet
+        self._sent = self._failed = 0   # not yet written to sender_usage
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _settle(self):
+        """Write the pending usage counters of the current account and hand back unused quota."""
+        if self.sender is None:
+            return
+        try:
+            self.pool.record(self.sender, self._sent, self._failed)
+            self.pool.release(self.sender, self._held)
+        except pymongo.errors.PyMongoError as e:
+            print(f"[Senders] Could not settle usage for {self.sender['address']}: {e}")
+        self._held = self._sent = self._failed = 0
+
+    def _take(self, sender: dict, n: int) -> int:
+        """Up to n recipients of quota from what this session holds, reserving a chunk when short."""
+        if self._held < n:
+            self.pool.record(sender, self._sent, self._failed)
+            self._sent = self._failed = 0
+            self._held += self.pool.reserve(sender, max(n - self._held, self.reserve_ahead))
+        granted = min(n, self._held)
+        self._held -= granted
+        return granted
+
+    def close(self):
+        self._settle()
+        if self._stack:
+            try:
+                self._stack.close()
+            except Exception:
+                pass          # QUIT on a dropped connection
+        self._stack = self.server = None
+        self._on_connection = 0
+
+    def _switch(self):
+        self.close()
+        picked = self.pool.pick()
+        if not picked:
+            self.sender = None
+            raise NoSenderAvailable("No sending account available: all are benched or out of today's quota")
+        self.sender, wait = picked
+        if wait:
+            time.sleep(wait)
+
+    def deliver(self, recipients: list[str], build) -> tuple[int, dict]:
+        """
+        Send one message built by build(sender) -> bytes. A partial quota grant sends to the
+        first `granted` recipients only; returns (granted, refused) so callers can requeue the rest.
+        """
+        attempt = 0
+        while True:
+            if self.sender is None or self._on_connection >= SENDER_ROTATE_EVERY:
+                self._switch()
+            sender = self.sender
+            granted = self._take(sender, len(recipients))
+            if not granted:
+                self.close()
+                self.sender = None          # spent today; pick another
+                continue
+            batch = recipients[:granted]
+            wait = self.pool.wait_time(sender["address"])
+            if wait:
+                time.sleep(wait)
+            try:
+                if self.server is None:
+                    self._stack = ExitStack()
+                    self.server = self._stack.enter_context(smtp_connection(sender))
+                refused = self.server.sendmail(sender["address"], batch, build(sender))
+            except smtplib.SMTPRecipientsRefused:
+                self.pool.pace(sender)
+                self._failed += len(batch)
+                self._on_connection += len(batch)
+                raise
+            except Exception as e:
+                self._held += granted       # never reached the server: close() hands it back
+                self.close()
+                reason = _sender_fault(e)
+                # throttling is usually brief: only bench the account if another one can take over
+                if reason and (reason != "throttled" or self.pool.pick(exclude={sender["address"]})):
+                    self.pool.bench(sender, reason, e)
+                    self.sender = None
+                    if self.pool.pick():
+                        METRICS.inc("portal_sender_failovers_total", reason=reason)
+                        continue
+                    raise
+                if _smtp_transient(e) and attempt < SMTP_MAX_RETRIES:
+                    attempt += 1
+                    _count_transient(e)
+                    _smtp_backoff(attempt)
+                    continue
+                raise
+            self.pool.pace(sender)
+            self._sent += len(batch) - len(refused)
+            self._failed += len(refused)
+            METRICS.inc("portal_sender_emails_total", len(batch), sender=sender["address"])
+            self._on_connection += len(batch)
+            return granted, refused
+
+
+def send_email_smtp(msg: EmailMessage, kind: str = "email", task_id=None, smtp: PooledSMTP | None = None):
+    """
+    Send a single email through the sender pool, with failover and backoff on transient errors.
+    Pass `smtp` to send over an open session (bulk runs); otherwise one is opened for this message.
+    """
+    try:
+        with ExitStack() as stack:
+            if smtp is None:
+                smtp = stack.enter_context(PooledSMTP(get_sender_pool()))
+            smtp.deliver([msg["To"]], lambda sender: _as_sender(msg, sender))
+    except Exception as e:
+        METRICS.inc("portal_emails_total", result="failed")
+        log_deliveries([msg["To"]], msg["Subject"], "failed", kind, task_id, error=str(e))
+        raise
+    METRICS.inc("portal_emails_total", result="sent")
+    log_deliveries([msg["To"]], msg["Subject"], "sent", kind, task_id)
+
+# Gmail accepts up to 100 recipients per message; stay well under it
+SMTP_BCC_CHUNK = int(os.getenv("SMTP_BCC_CHUNK", "50"))
+
+def send_batched_email(subject: str, html_body: str, recipients: list[str],
+                       chunk_size: int = SMTP_BCC_CHUNK, progress_cb=None,
+                       task_id=None) -> tuple[int, int, list[str]]:
+    """
+    Non-personalized send: the MIME message is built and serialized once per sending account,
+    then delivered as envelope-only (BCC) recipients in chunks of `chunk_size`, over one
+    connection per account. Failures are reported per address.
+    Returns (sent_count, fail_count, failed_emails).
+    """
+    payloads = {}
+
+    def payload_for(sender):
+        if sender["address"] not in payloads:
+            msg = _build_email(subject, html_body, "undisclosed-recipients:;", sender["address"], sender["name"])
+            payloads[sender["address"]] = msg.as_bytes(policy=email_policy.SMTP)
+        return payloads[sender["address"]]
+
+    recipients = list(dict.fromkeys(r for r in recipients if r))   # dedupe, keep order
+    chunks = [recipients[i:i + chunk_size] for i in range(0, len(recipients), chunk_size)]
+    total = len(recipients)
+    sent, failed, failed_list = 0, 0, []
+    failed_addrs = set()
+    done = 0
+
+    def _refused(refused):
+        nonlocal failed
+        failed_addrs.update(refused)
+        for addr, (code, resp) in refused.items():
+            failed_list.append(f"{addr} → {code} {resp.decode(errors='replace') if isinstance(resp, bytes) else resp}")
+        failed += len(refused)
+
+    def _fail(chunk, reason):
+        nonlocal failed
+        failed += len(chunk)
+        failed_addrs.update(chunk)
+        failed_list.extend(f"{addr} → {reason}" for addr in chunk)
+
+    pending = list(chunks)
+    with PooledSMTP(get_sender_pool()) as smtp:
+        while pending:
+            chunk = pending[0]
+            try:
+                n, refused = smtp.deliver(chunk, payload_for)
+            except smtplib.SMTPRecipientsRefused as e:
+                n, refused = len(chunk), e.recipients
+            except (smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                if _smtp_transient(e) or _sender_fault(e):
+                    for rest in pending:
+                        _fail(rest, e)
+                    break
+                # the whole chunk was rejected: report every address in it
+                _fail(chunk, f"{e.smtp_code} {e.smtp_error!r}")
+                n, refused = len(chunk), None
+            except Exception as e:
+                # no account left or retries exhausted: nothing left can be delivered
+                for rest in pending:
+                    _fail(rest, e)
+                break
+            if refused is not None:
+                _refused(refused)
+                sent += n - len(refused)
+            # a partial quota grant leaves the rest of the chunk for the next account
+            if n < len(chunk):
+                pending[0] = chunk[n:]
+            else:
+                pending.pop(0)
+            done += n
+            if progress_cb:
+                progress_cb(done, total)
+            time.sleep(SMTP_SEND_DELAY)
+
+    METRICS.inc("portal_emails_total", sent, result="sent")
+    METRICS.inc("portal_emails_total", failed, result="failed")
+    log_deliveries([r for r in recipients if r not in failed_addrs], subject, "sent", "task", task_id)
+    log_deliveries(failed_addrs, subject, "failed", "task", task_id)
+    return sent, failed, failed_list
 
 def render_task_email(template_key: str, task: dict, user: dict | None = None) -> tuple[str, str]:
     """
@@ -191,16 +1564,29 @@ def render_task_email(template_key: str, task: dict, user: dict | None = None) -
 
     return subject, body
 
-def gather_recipients_for_task(task_id: ObjectId, scope: str) -> list[dict]:
+def gather_recipients_for_task(task_id: ObjectId, scope: str, track: str | None = None,
+                               user_id: ObjectId | None = None) -> list[dict]:
     """
     scope: "all" → all users in the system
            "assigned" → only users assigned to this task
+           "track" → users whose profile.coding_track is `track`
+           "single_user" → the user `user_id`
     Returns a list of user documents (must have 'email').
     """
     if scope == "all":
         users = list(users_col.find({"email": {"$exists": True, "$ne": ""}}, {"name":1,"email":1}))
         return users
 
+    if scope == "track":
+        return list(users_col.find(
+            {"profile.coding_track": track, "email": {"$exists": True, "$ne": ""}},
+            {"name": 1, "email": 1}
+        ))
+
+    if scope == "single_user":
+        user = users_col.find_one({"_id": user_id, "email": {"$exists": True, "$ne": ""}}, {"name": 1, "email": 1})
+        return [user] if user else []
+
     # assigned users
     assignments = list(db.task_assignments.find({"task_id": task_id}, {"user_id": 1}))
     user_ids = [a["user_id"] for a in assignments if a.get("user_id")]
@@ -212,9 +1598,10 @@ def gather_recipients_for_task(task_id: ObjectId, scope: str) -> list[dict]:
     ))
     return users
 
-def send_bulk_emails_for_task(task: dict, template_key: str, scope: str, progress_cb=None) -> tuple[int,int,list[str]]:
+def send_bulk_emails_for_task(task: dict, template_key: str, scope: str, progress_cb=None,
+                              override_subject: str | None = None) -> tuple[int,int,list[str]]:
     """
-    Sends emails in bulk.
+    Sends personalized emails in bulk (one message per recipient).
     Returns (sent_count, fail_count, failed_emails).
     """
     from_addr, from_name = get_sender_identity()
@@ -223,32 +1610,1803 @@ def send_bulk_emails_for_task(task: dict, template_key: str, scope: str, progres
     sent, failed = 0, 0
     failed_list = []
 
-    for idx, user in enumerate(recipients, start=1):
+    # one connection per sending account for the whole run, quota reserved in chunks
+    with PooledSMTP(get_sender_pool(), reserve_ahead=SENDER_RESERVE_CHUNK) as smtp:
+        for idx, user in enumerate(recipients, start=1):
+            try:
+                subject, html = render_task_email(template_key, task, user)
+                msg = _build_email(override_subject or subject, html, user["email"], from_addr, from_name)
+                send_email_smtp(msg, kind="task", task_id=task["_id"], smtp=smtp)
+                sent += 1
+            except Exception as e:
+                failed += 1
+                failed_list.append(f'{user.get("email","")} → {e}')
+            finally:
+                # Update progress UI if provided
+                if progress_cb:
+                    progress_cb(idx, total)
+                # Be gentle with Gmail: small delay helps avoid rate limits
+                time.sleep(SMTP_SEND_DELAY)
+
+    return sent, failed, failed_list
+
+
+# --- Notification digests ---
+# Instead of one email per task update, a send can queue per-user items; a scheduled job
+# merges everything due for a user into one email per hour or per day.
+DIGEST_PERIODS = {"hourly": "Hourly digest", "daily": "Daily digest"}
+DIGEST_HOUR_UTC = int(os.getenv("DIGEST_HOUR_UTC", "16"))
+DIGEST_POLL_SECONDS = 60
+DIGEST_LOCK_SECONDS = 600
+DIGEST_MAX_ATTEMPTS = 3
+DIGEST_RETENTION_DAYS = 30
+notification_queue_col = db.notification_queue
+job_locks_col = db.job_locks
+
+
+def digest_due_at(period: str, now: datetime | None = None) -> datetime:
+    """Next send slot for a period: top of the next hour, or the next DIGEST_HOUR_UTC."""
+    now = now or datetime.now(timezone.utc)
+    if period == "hourly":
+        return now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    slot = now.replace(hour=DIGEST_HOUR_UTC, minute=0, second=0, microsecond=0)
+    return slot if slot > now else slot + timedelta(days=1)
+
+
+def queue_digest_items(task: dict, template_key: str, users: list[dict], period: str,
+                       subject: str | None = None) -> int:
+    """Queue one notification item per user for the next `period` digest."""
+    now = datetime.now(timezone.utc)
+    due_at = digest_due_at(period, now)
+    subject = subject or render_task_email(template_key, task, None)[0]
+    items = [{
+        "user_id": u["_id"],
+        "email": u["email"],
+        "name": u.get("name", ""),
+        "task_id": task["_id"],
+        "template": template_key,
+        "subject": subject,
+        "period": period,
+        "status": "pending",
+        "attempts": 0,
+        "created_at": now,
+        "due_at": due_at,
+    } for u in users if u.get("email")]
+    if items:
+        notification_queue_col.insert_many(items, ordered=False)
+    return len(items)
+
+
+def acquire_job_lock(name: str, owner: str, seconds: int) -> bool:
+    """Lease a named job across replicas; the holder can renew, others wait for expiry."""
+    now = datetime.now(timezone.utc)
+    try:
+        job_locks_col.find_one_and_update(
+            {"_id": name, "$or": [{"expires_at": {"$lte": now}}, {"owner": owner}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=seconds), "acquired_at": now}},
+            upsert=True,
+        )
+        return True
+    except pymongo.errors.DuplicateKeyError:
+        return False   # held by someone else: the upsert collided with their lock document
+
+
+def release_job_lock(name: str, owner: str):
+    job_locks_col.update_one({"_id": name, "owner": owner},
+                             {"$set": {"expires_at": datetime.now(timezone.utc)}})
+
+
+def _due_digests_pipeline(now: datetime, limit: int) -> list[dict]:
+    """Due items → one row per (user, task, template), latest wins → one row per user."""
+    return [
+        {"$match": {"status": "pending", "due_at": {"$lte": now}}},
+        {"$sort": {"created_at": 1}},
+        {"$group": {
+            "_id": {"user": "$user_id", "task": "$task_id", "template": "$template"},
+            "email": {"$last": "$email"},
+            "name": {"$last": "$name"},
+            "subject": {"$last": "$subject"},
+            "updates": {"$sum": 1},
+            "latest": {"$last": "$created_at"},
+            "ids": {"$push": "$_id"},
+        }},
+        {"$sort": {"latest": 1}},
+        {"$group": {
+            "_id": "$_id.user",
+            "email": {"$last": "$email"},
+            "name": {"$last": "$name"},
+            "items": {"$push": {"task_id": "$_id.task", "template": "$_id.template",
+                                "subject": "$subject", "updates": "$updates", "latest": "$latest"}},
+            "ids": {"$push": "$ids"},
+        }},
+        {"$limit": limit},
+        {"$lookup": {"from": "tasks", "localField": "items.task_id", "foreignField": "_id",
+                     "pipeline": [{"$project": {"title": 1, "description": 1, "due_date": 1}}],
+                     "as": "tasks"}},
+        {"$set": {"ids": {"$reduce": {"input": "$ids", "initialValue": [],
+                                      "in": {"$concatArrays": ["$$value", "$$this"]}}}}},
+    ]
+
+
+def render_digest_email(user: dict, items: list[dict], tasks: dict) -> tuple[str, str]:
+    """One email summarising every queued task update for a user."""
+    greeting = f"Hi {user.get('name') or 'there'}"
+    cards = []
+    for item in items:
+        task = tasks.get(item["task_id"], {})
+        raw_due = task.get("due_date")
+        due_str = raw_due.strftime("%Y-%m-%d") if hasattr(raw_due, "strftime") else (str(raw_due) if raw_due else "N/A")
+        repeat = f" <span style=\"color:#64748b\">(×{item['updates']})</span>" if item["updates"] > 1 else ""
+        cards.append(f"""
+          <div style="border:1px solid #e5e7eb;border-radius:12px;padding:12px 16px;margin:0 0 10px 0;background:#ffffff">
+            <p style="margin:0 0 4px 0"><b>{item['subject']}</b>{repeat}</p>
+            <p style="margin:0 0 4px 0"><b>Task:</b> {task.get('title', 'Task')} · <b>Due:</b> {due_str}</p>
+            <p style="margin:0;color:#334155">{(task.get('description') or '')[:280]}</p>
+          </div>
+        """)
+    n = len(items)
+    subject = items[0]["subject"] if n == 1 else f"Your Innoverse digest: {n} task updates"
+    body = f"""
+      <div style="font-family: Inter, Arial, sans-serif; color:#0f172a; line-height:1.6;">
+        <p>{greeting},</p>
+        <p>Here {'is the update' if n == 1 else f'are the {n} updates'} on your tasks since the last digest.</p>
+        {''.join(cards)}
+        <p style="margin-top:12px">Best,<br/>Innoverse USICT Team</p>
+      </div>
+    """
+    return subject, body
+
+
+@uses_profile("interactive")
+def send_due_digests(limit: int = 500, owner: str | None = None) -> dict:
+    """
+    Send one digest per user for every due item, under the cross-replica job lock.
+    Returns {"users", "sent", "failed", "items"}; {"skipped": True} if another replica holds the lock.
+    """
+    owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+    if not acquire_job_lock("digests", owner, DIGEST_LOCK_SECONDS):
+        return {"skipped": True}
+    summary = {"users": 0, "sent": 0, "failed": 0, "items": 0}
+    try:
+        now = datetime.now(timezone.utc)
+        rows = list(notification_queue_col.aggregate(_due_digests_pipeline(now, limit), allowDiskUse=True))
+        if not rows:
+            return summary
+        with PooledSMTP(get_sender_pool(), reserve_ahead=SENDER_RESERVE_CHUNK) as smtp:
+            for row in rows:
+                tasks = {t["_id"]: t for t in row["tasks"]}
+                subject, html = render_digest_email(row, row["items"], tasks)
+                summary["users"] += 1
+                if summary["users"] % 50 == 0:
+                    acquire_job_lock("digests", owner, DIGEST_LOCK_SECONDS)   # renew the lease on long runs
+                try:
+                    smtp.deliver([row["email"]], lambda sender: _build_email(
+                        subject, html, row["email"], sender["address"], sender["name"]
+                    ).as_bytes(policy=email_policy.SMTP))
+                except (smtplib.SMTPServerDisconnected, smtplib.SMTPAuthenticationError, NoSenderAvailable):
+                    raise     # not this user's fault: leave the rest pending for the next run
+                except smtplib.SMTPException as e:
+                    summary["failed"] += 1
+                    METRICS.inc("portal_emails_total", result="failed")
+                    log_deliveries([row["email"]], subject, "failed", "digest", error=str(e))
+                    notification_queue_col.update_many(
+                        {"_id": {"$in": row["ids"]}},
+                        [{"$set": {
+                            "attempts": {"$add": ["$attempts", 1]},
+                            "last_error": str(e)[:300],
+                            "status": {"$cond": [{"$gte": [{"$add": ["$attempts", 1]}, DIGEST_MAX_ATTEMPTS]},
+                                                 "failed", "pending"]},
+                        }}],
+                    )
+                    continue
+                notification_queue_col.update_many(
+                    {"_id": {"$in": row["ids"]}, "status": "pending"},
+                    {"$set": {"status": "sent", "sent_at": datetime.now(timezone.utc)}},
+                )
+                summary["sent"] += 1
+                summary["items"] += len(row["ids"])
+                METRICS.inc("portal_emails_total", result="sent")
+                log_deliveries([row["email"]], subject, "sent", "digest")
+                time.sleep(SMTP_SEND_DELAY)
+    finally:
+        release_job_lock("digests", owner)
+    if summary["sent"] or summary["failed"]:
+        record_activity("email.digest", admin="system", count=summary["sent"],
+                        failed=summary["failed"], items=summary["items"])
+    return summary
+
+
+def _digest_loop():
+    while True:
+        time.sleep(DIGEST_POLL_SECONDS)
+        if not sender_pool_configured():
+            continue
+        try:
+            result = send_due_digests()
+            if result.get("sent") or result.get("failed"):
+                print(f"[Digest] {result}")
+        except Exception as e:
+            print(f"[Digest] Run failed: {e}")
+
+
+@st.cache_resource
+def start_digest_scheduler() -> bool:
+    """One polling thread per process; the Mongo job lock keeps replicas from double-sending."""
+    threading.Thread(target=_digest_loop, daemon=True, name="digest-scheduler").start()
+    return True
+
+
+# Track mapping
+TRACKS = {
+    "ai": "AI/ML",
+    "webdev": "Web Development", 
+    "dsa": "Data Structures & Algorithms",
+    "app": "App Development"
+}
+
+# --- Indexes ---
+def _ensure_index(coll, keys, **options) -> bool:
+    """One create_index on its own: a conflict (e.g. the same keys under another name) skips only it."""
+    try:
+        coll.create_index(keys, **options)
+        return True
+    except pymongo.errors.PyMongoError as e:
+        print(f"[Indexes] {coll.name} {options.get('name', keys)}: {e}")
+        return False
+
+
+@st.cache_resource
+def ensure_indexes():
+    """Create the indexes the portal's queries rely on (idempotent, once per process)."""
+    # Leaderboards: sorted, limited scans instead of loading every user
+    _ensure_index(users_col, [("stats.points", -1), ("_id", 1)], name="leaderboard_overall")
+    _ensure_index(
+        users_col,
+        [("profile.coding_track", 1), ("stats.points", -1), ("_id", 1)],
+        name="leaderboard_track"
+    )
+    # Users grid: sort keys, optionally behind the track filter
+    _ensure_index(users_col, [("created_at", -1), ("_id", -1)], name="users_created")
+    _ensure_index(users_col, [("profile.coding_track", 1), ("created_at", -1), ("_id", -1)],
+                  name="users_track_created")
+    _ensure_index(users_col, [("name", 1), ("_id", 1)], name="users_name")
+    _ensure_index(users_col, [("stats.tasks_completed", -1), ("_id", 1)], name="users_tasks_completed")
+    # Review queue: claim scan, per-reviewer claims, throughput window
+    _ensure_index(submissions_col, [("status", 1), ("submitted_at", 1)], name="status_submitted")
+    _ensure_index(submissions_col, [("status", 1), ("claim.expires_at", 1)], name="review_claim_expiry")
+    _ensure_index(submissions_col, [("claim.by", 1), ("status", 1)], name="review_claims")
+    _ensure_index(submissions_col, [("reviewed_at", -1)], name="reviewed_at")
+    # Stats reconciliation: per-user $lookup of approved submissions
+    _ensure_index(submissions_col, [("user_id", 1), ("status", 1)], name="user_status")
+    _ensure_index(db.stats_reconciliations, "run_id", name="run_id")
+    _ensure_index(db.stats_reconciliations, "created_at", name="ttl_created_at",
+                  expireAfterSeconds=RECONCILE_REPORT_DAYS * 86400)
+    # Auth state: token lookups on every rerun, TTL expiry instead of sweeps
+    _ensure_index(sessions_col, "token", name="token")
+    _ensure_index(sessions_col, "admin_id", name="admin_id")
+    _ensure_index(sessions_col, "expires_on", name="ttl_expires_on", expireAfterSeconds=0)
+    _ensure_index(db.oauth_states, "expires_at", name="ttl_expires_at", expireAfterSeconds=0)
+    _ensure_index(db.restore_tickets, "session_token", name="session_token")
+    _ensure_index(db.restore_tickets, "expires_at", name="ttl_expires_at", expireAfterSeconds=0)
+    # Profiler results: browse by page/time, expire old runs
+    _ensure_index(db.perf_profiles, [("page", 1), ("created_at", -1)], name="page_created")
+    _ensure_index(db.perf_profiles, "created_at", name="ttl_created_at",
+                  expireAfterSeconds=PERF_RETENTION_DAYS * 86400)
+    # Page queries flagged by query_audit.py
+    _ensure_index(users_col, "email")     # default name: matches an existing email_1
+    _ensure_index(tasks_col, [("created_at", -1)], name="tasks_created")
+    _ensure_index(tasks_col, [("is_active", 1), ("created_at", -1)], name="tasks_active_created")
+    _ensure_index(submissions_col, [("submitted_at", -1)], name="submitted_at")
+    _ensure_index(db.task_assignments, [("task_id", 1), ("user_id", 1)], name="task_user")
+    _ensure_index(db.task_assignments, [("assigned_at", -1)], name="assigned_at")
+    _ensure_index(forums_col, [("created_at", -1)], name="forums_created")
+    _ensure_index(forum_comments_col, [("forum_id", 1), ("created_at", -1)], name="forum_created")
+    _ensure_index(admin_col, "email")
+    _ensure_index(admin_col, "username", name="username")
+    # Archival: cutoff scan on comments; archive collections browsed by user/task/forum
+    _ensure_index(forum_comments_col, [("created_at", 1)], name="created_at")
+    _ensure_index(db.archive_submissions, [("user_id", 1), ("submitted_at", -1)], name="user_submitted")
+    _ensure_index(db.archive_submissions, [("task_id", 1), ("submitted_at", -1)], name="task_submitted")
+    _ensure_index(db.archive_task_assignments, [("task_id", 1), ("user_id", 1)], name="task_user")
+    _ensure_index(db.archive_task_assignments, [("user_id", 1), ("assigned_at", -1)], name="user_assigned")
+    _ensure_index(db.archive_forum_comments, [("forum_id", 1), ("created_at", -1)], name="forum_created")
+    _ensure_index(db.archive_runs, [("created_at", -1)], name="created_at")
+    # Audit log: superadmin filters by admin / action over a time range
+    _ensure_index(admin_audit_col, [("admin", 1), ("ts", -1)], name="admin_ts")
+    _ensure_index(admin_audit_col, [("action", 1), ("ts", -1)], name="action_ts")
+    _ensure_index(admin_audit_col, "ts", name="ttl_ts", expireAfterSeconds=AUDIT_RETENTION_DAYS * 86400)
+    # Metrics snapshots: latest per host, expire after a week
+    _ensure_index(db.metrics_snapshots, [("host", 1), ("ts", -1)], name="host_ts")
+    _ensure_index(db.metrics_snapshots, "ts", name="ttl_ts", expireAfterSeconds=METRICS_RETENTION_DAYS * 86400)
+    # Link checks: stale scan over pending submissions; cached URL results expire
+    _ensure_index(submissions_col, [("status", 1), ("link_check.checked_at", 1)], name="status_link_checked")
+    _ensure_index(submissions_col, [("status", 1), ("link_check.status", 1), ("submitted_at", -1)],
+                  name="status_link_submitted")
+    _ensure_index(link_checks_col, "checked_at", name="ttl_checked_at", expireAfterSeconds=LINK_CHECK_TTL_SECONDS)
+    # Near-duplicates: watermark scan and per-task band lookups (multikey)
+    _ensure_index(signatures_col, [("params", 1), ("submitted_at", -1)], name="params_submitted")
+    _ensure_index(signatures_col, [("params", 1), ("updated_at", -1)], name="params_updated")
+    _ensure_index(submissions_col, [("submitted_at", 1), ("_id", 1)], name="submitted_id")
+    _ensure_index(submissions_col, [("updated_at", 1), ("_id", 1)], name="updated_id")
+    _ensure_index(signatures_col, [("task_id", 1), ("bands", 1)], name="task_bands")
+    # Analytics snapshot: incremental sync scans changes by updated_at (inserts ride on _id)
+    for name in SNAPSHOT_TABLES:
+        _ensure_index(db[name], "updated_at", name="updated_at")
+    # Activity stream: time-series collection, per-kind and per-admin trend scans
+    try:
+        ensure_activity_collection()
+    except pymongo.errors.PyMongoError as e:
+        print(f"[Indexes] activity_events collection: {e}")
+    _ensure_index(activity_events_col, [("meta.kind", 1), ("ts", -1)], name="kind_ts")
+    _ensure_index(activity_events_col, [("meta.admin", 1), ("ts", -1)], name="admin_ts")
+    # User timeline: one (user key, time, _id) index per merged source
+    _ensure_index(db.task_assignments, [("user_id", 1), ("assigned_at", -1), ("_id", -1)],
+                  name="user_assigned")
+    _ensure_index(submissions_col, [("user_id", 1), ("submitted_at", -1), ("_id", -1)], name="user_submitted")
+    _ensure_index(forum_comments_col, [("user.email", 1), ("created_at", -1), ("_id", -1)],
+                  name="user_email_created")
+    _ensure_index(email_deliveries_col, [("email", 1), ("sent_at", -1), ("_id", -1)], name="email_sent")
+    _ensure_index(email_deliveries_col, "sent_at", name="ttl_sent_at",
+                  expireAfterSeconds=EMAIL_DELIVERY_RETENTION_DAYS * 86400)
+    # Digests: due-item scan, per-user pending lookups, sent items expire
+    _ensure_index(notification_queue_col, [("status", 1), ("due_at", 1)], name="status_due")
+    _ensure_index(notification_queue_col, [("user_id", 1), ("status", 1)], name="user_status")
+    _ensure_index(notification_queue_col, "sent_at", name="ttl_sent_at",
+                  expireAfterSeconds=DIGEST_RETENTION_DAYS * 86400)
+    # Sender pool: today's usage per account, old days expire
+    _ensure_index(sender_usage_col, [("day", 1), ("address", 1)], name="day_address")
+    _ensure_index(sender_usage_col, "day_start", name="ttl_day_start",
+                  expireAfterSeconds=SENDER_USAGE_RETENTION_DAYS * 86400)
+    return True
+
+
+# --- Leaderboards ---
+LEADERBOARD_SIZE = 10
+LEADERBOARD_MAX_TIES = 50   # cap on extra rows tied with last place
+LEADERBOARD_KEYS = ["users.stats.points", "users.name", "users.profile"]
+
+def _user_points(user: dict):
+    return (user.get("stats") or {}).get("points", 0) or 0
+
+def _leaderboard_filter(track: str | None) -> dict:
+    return {"profile.coding_track": track} if track else {}
+
+@st.cache_data(ttl=CACHE_MAX_TTL, max_entries=64, show_spinner=False)
+def _leaderboard(track: str | None, k: int, version: tuple) -> list[dict]:
+    base = _leaderboard_filter(track)
+    proj = {"name": 1, "stats.points": 1, "profile.coding_track": 1}
+    order = [("stats.points", -1), ("_id", 1)]
+    top = list(users_col.find(base, proj).sort(order).limit(k))
+    if not top:
+        return []
+
+    # Everyone tied with last place shares the rank, so include them too
+    last = top[-1]
+    top.extend(users_col.find(
+        {**base, "stats.points": last.get("stats", {}).get("points"), "_id": {"$gt": last["_id"]}},
+        proj
+    ).sort(order).limit(LEADERBOARD_MAX_TIES))
+
+    rows, rank, prev = [], 0, None
+    for pos, u in enumerate(top, start=1):
+        pts = _user_points(u)
+        if pts != prev:
+            rank, prev = pos, pts   # standard competition ranking: 1, 2, 2, 4
+        rows.append({
+            "Rank": rank,
+            "Name": u.get("name", ""),
+            "Track": TRACKS.get(u.get("profile", {}).get("coding_track", ""), "Unknown"),
+            "Points": pts,
+            "user_id": str(u["_id"]),
+        })
+    return rows
+
+def get_leaderboard(track: str | None = None, k: int = LEADERBOARD_SIZE) -> list[dict]:
+    """Top-k users overall (track=None) or within a track; ties at the cut-off are included."""
+    return _leaderboard(track, k, cache_token(*LEADERBOARD_KEYS))
+
+@st.cache_data(ttl=CACHE_MAX_TTL, max_entries=1024, show_spinner=False, hash_funcs=CACHE_HASH_FUNCS)
+def _user_rank(user_id: ObjectId, track: str | None, version: tuple) -> tuple[int, int] | None:
+    user = users_col.find_one({"_id": user_id}, {"stats.points": 1})
+    if not user:
+        return None
+    pts = _user_points(user)
+    ahead = users_col.count_documents({**_leaderboard_filter(track), "stats.points": {"$gt": pts}})
+    return ahead + 1, pts
+
+def get_user_rank(user_id: ObjectId, track: str | None = None) -> tuple[int, int] | None:
+    """Returns (rank, points) via an index-backed count of users strictly ahead."""
+    return _user_rank(user_id, track, cache_token("users.stats.points", "users.profile"))
+
+
+# --- Review queue (claim leases + conditional transitions) ---
+REVIEW_LEASE_SECONDS = int(os.getenv("REVIEW_LEASE_SECONDS", "900"))
+REVIEW_STATUSES = ["pending", "approved", "rejected"]
+
+def as_points(value) -> int:
+    """Submission points have been stored as int, float and str; normalize to int."""
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+def as_datetime(value) -> datetime | None:
+    """Forums and comments store ISO strings where other collections store dates; normalize to aware UTC."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+def claim_next_submission(reviewer: str) -> dict | None:
+    """Atomically lease the oldest unclaimed pending submission to `reviewer`."""
+    now = datetime.now(timezone.utc)
+    return submissions_col.find_one_and_update(
+        {"status": "pending",
+         "$or": [{"claim.expires_at": None}, {"claim.expires_at": {"$lte": now}}]},
+        {"$set": {"claim": {
+            "by": reviewer,
+            "claimed_at": now,
+            "expires_at": now + timedelta(seconds=REVIEW_LEASE_SECONDS),
+        }}},
+        sort=[("submitted_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+def claim_submissions(reviewer: str, n: int) -> list[dict]:
+    claimed = []
+    for _ in range(n):
+        sub = claim_next_submission(reviewer)
+        if not sub:
+            break
+        claimed.append(sub)
+    if claimed:
+        note_write("submissions", fields=["claim"])
+    return claimed
+
+def get_my_claims(reviewer: str) -> list[dict]:
+    now = datetime.now(timezone.utc)
+    return list(submissions_col.find(
+        {"status": "pending", "claim.by": reviewer, "claim.expires_at": {"$gt": now}}
+    ).sort("submitted_at", 1))
+
+def renew_claim(sub_id, reviewer: str) -> bool:
+    now = datetime.now(timezone.utc)
+    res = submissions_col.update_one(
+        {"_id": sub_id, "status": "pending", "claim.by": reviewer, "claim.expires_at": {"$gt": now}},
+        {"$set": {"claim.expires_at": now + timedelta(seconds=REVIEW_LEASE_SECONDS)}}
+    )
+    return res.modified_count == 1
+
+def release_claim(sub_id, reviewer: str) -> bool:
+    res = submissions_col.update_one({"_id": sub_id, "claim.by": reviewer}, {"$unset": {"claim": ""}})
+    note_write("submissions", sub_id, ["claim"])
+    return res.modified_count == 1
+
+def transition_submission(sub_id, from_status: str, to_status: str, points: int, reviewer: str,
+                          require_claim: bool = False) -> bool:
+    """
+    Move a submission from `from_status` to `to_status` only if it is still in `from_status`
+    (and, for queue reviews, still leased to `reviewer`). Exactly one concurrent caller wins,
+    so user stats are adjusted exactly once. Returns True if this call applied the change.
+    """
+    now = datetime.now(timezone.utc)
+    flt = {"_id": sub_id, "status": from_status}
+    if require_claim:
+        flt["claim.by"] = reviewer
+        flt["claim.expires_at"] = {"$gt": now}
+
+    before = submissions_col.find_one_and_update(
+        flt,
+        {
+            "$set": {
+                "status": to_status,
+                "points": int(points),
+                "reviewed_by": reviewer,
+                "reviewed_at": now,
+                "updated_at": now,
+            },
+            "$unset": {"claim": ""},
+            "$push": {"status_history": {"from": from_status, "to": to_status, "by": reviewer, "at": now}},
+        },
+        projection={"user_id": 1, "points": 1},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if before is None:
+        return False
+    note_write("submissions", sub_id, ["status", "points", "reviewed_by", "reviewed_at", "claim"])
+    audit("submission.review", "submission", sub_id, admin=reviewer,
+          from_status=from_status, to_status=to_status, points=int(points))
+    record_activity("submission.status", admin=reviewer, tags={"status": to_status},
+                    submission_id=sub_id, from_status=from_status, points=int(points))
+
+    inc = {}
+    if to_status == "approved" and from_status != "approved":
+        inc = {"stats.points": int(points), "stats.tasks_completed": 1}
+    elif from_status == "approved" and to_status != "approved":
+        inc = {"stats.points": -as_points(before.get("points")), "stats.tasks_completed": -1}
+    if inc:
+        users_col.update_one({"_id": before["user_id"]}, {"$inc": inc, "$set": {"updated_at": now}})
+        note_write("users", before["user_id"], list(inc) + ["updated_at"])
+    return True
+
+def get_review_queue_stats() -> dict:
+    now = datetime.now(timezone.utc)
+    return {
+        "waiting": submissions_col.count_documents(
+            {"status": "pending", "$or": [{"claim.expires_at": None}, {"claim.expires_at": {"$lte": now}}]}
+        ),
+        "in_review": submissions_col.count_documents({"status": "pending", "claim.expires_at": {"$gt": now}}),
+    }
+
+def get_reviewer_throughput(hours: int = 24) -> list[dict]:
+    since = datetime.now(timezone.utc) - timedelta(hours=hours)
+    return list(submissions_col.aggregate([
+        {"$match": {"reviewed_at": {"$gte": since}}},
+        {"$group": {
+            "_id": "$reviewed_by",
+            "reviewed": {"$sum": 1},
+            "approved": {"$sum": {"$cond": [{"$eq": ["$status", "approved"]}, 1, 0]}},
+            "rejected": {"$sum": {"$cond": [{"$eq": ["$status", "rejected"]}, 1, 0]}},
+            "last": {"$max": "$reviewed_at"},
+        }},
+        {"$sort": {"reviewed": -1}},
+    ]))
+
+
+# --- User timeline ---
+# A student's assignments, submissions, forum comments and emails merged newest-first.
+# Each source is read through a (user key, time, _id) index with a limit of one page, and
+# the sorted cursors are k-way merged, so a page costs the same for any history length.
+TIMELINE_PAGE_SIZE = 25
+# source → (collection, time field, user key, filter path, projection); names break time ties
+TIMELINE_SOURCES = {
+    "assignment": ("task_assignments", "assigned_at", "user_id", "user_id",
+                   {"task_id": 1, "assigned_at": 1, "assigned_by": 1, "status": 1, "note": 1}),
+    "comment": ("forum_comments", "created_at", "email", "user.email",
+                {"forum_id": 1, "created_at": 1, "content": 1}),
+    "email": ("email_deliveries", "sent_at", "email", "email",
+              {"sent_at": 1, "subject": 1, "status": 1, "kind": 1, "task_id": 1, "error": 1}),
+    "submission": ("submissions", "submitted_at", "user_id", "user_id",
+                   {"task_id": 1, "submitted_at": 1, "status": 1, "points": 1, "submission_url": 1,
+                    "status_history": 1, "reviewed_by": 1}),
+}
+TIMELINE_ISO_SOURCES = {"comment"}      # the user portal writes created_at as an ISO string
+
+
+def _timeline_key(item: dict) -> tuple:
+    return item["ts"], item["source"], item["_id"]
+
+
+def _timeline_stream(source: str, user: dict, before: tuple | None, limit: int):
+    """Newest-first events of one source strictly older than `before` in (ts, source, _id) order."""
+    coll, time_field, key, path, projection = TIMELINE_SOURCES[source]
+    if key == "user_id":
+        value = user["_id"]
+    else:
+        value = user.get("email") or ""
+        value = value.strip().lower() if source == "email" else value
+    flt = {path: value}
+    if before:
+        # $lte keeps the range on the index; the few same-instant ties are dropped below.
+        # Mongo compares strings only with strings; UTC ISO strings sort in time order
+        bound = before[0].astimezone(timezone.utc).isoformat() if source in TIMELINE_ISO_SOURCES else before[0]
+        flt[time_field] = {"$lte": bound}
+    # no limit(): the boundary event and its ties come back again and are skipped, so a fixed
+    # limit could run dry early. The merge stops pulling after one page; +1 covers the boundary
+    cursor = (db[coll].find(flt, projection).sort([(time_field, -1), ("_id", -1)])
+              .batch_size(limit + 1))
+    with cursor:
+        for doc in cursor:
+            ts = as_datetime(doc.get(time_field))      # aware UTC for every source, so they merge
+            if ts is None:
+                continue
+            item = {"ts": ts, "source": source, "_id": doc["_id"], "doc": doc}
+            if before is None or _timeline_key(item) < before:
+                yield item
+
+
+@uses_profile("analytics")
+def get_user_timeline(user: dict, before: tuple | None = None,
+                      limit: int = TIMELINE_PAGE_SIZE) -> tuple[list[dict], tuple | None]:
+    """One page of the merged timeline and the cursor for the next (older) page, or None."""
+    streams = [_timeline_stream(s, user, before, limit + 1) for s in TIMELINE_SOURCES]
+    items = list(itertools.islice(heapq.merge(*streams, key=_timeline_key, reverse=True), limit + 1))
+    next_before = _timeline_key(items[limit - 1]) if len(items) > limit else None
+    return items[:limit], next_before
+
+
+# --- Submission link checks ---
+# Pending submissions' URLs are checked in the background so reviewers see dead links,
+# private repos and typos before opening them. Results are cached per URL in link_checks.
+LINK_CHECK_TTL_SECONDS = int(os.getenv("LINK_CHECK_TTL_SECONDS", str(6 * 3600)))
+LINK_CHECK_TIMEOUT = float(os.getenv("LINK_CHECK_TIMEOUT", "10"))
+LINK_CHECK_PER_HOST = int(os.getenv("LINK_CHECK_PER_HOST", "4"))
+LINK_CHECK_CONCURRENCY = int(os.getenv("LINK_CHECK_CONCURRENCY", "32"))
+LINK_CHECK_INTERVAL = int(os.getenv("LINK_CHECK_INTERVAL", "300"))
+LINK_CHECK_BATCH = 500
+LINK_CHECK_MAX_REDIRECTS = 10
+# Submitted URLs are attacker-chosen: every hop must resolve to public addresses only, unless
+# listed here (e.g. "127.0.0.0/8" for a local stand-in). Comma-separated CIDRs.
+LINK_CHECK_ALLOWED_NETWORKS = [ipaddress.ip_network(n.strip())
+                               for n in os.getenv("LINK_CHECK_ALLOWED_NETWORKS", "").split(",") if n.strip()]
+# code hosts answer 404 for private repositories as well as missing ones
+LINK_PRIVATE_404_HOSTS = {"github.com", "gitlab.com", "bitbucket.org"}
+LINK_STATUS_BADGES = {
+    "ok": "🟢 Link OK",
+    "redirect": "🟡 Redirects",
+    "private": "🔒 Private or missing repo",
+    "broken": "🔴 Broken link",
+    "timeout": "⏱️ Timed out",
+    "unreachable": "🔴 Unreachable",
+    "invalid": "⚠️ Not a URL",
+    "blocked": "⛔ Internal address",
+}
+LINK_BAD_STATUSES = ["private", "broken", "timeout", "unreachable", "invalid", "blocked"]
+link_checks_col = db.link_checks
+
+
+def normalize_submission_url(raw: str | None) -> str | None:
+    """Trim and add a missing scheme ("github.com/a/b"); None if it can't be an http(s) URL."""
+    url = (raw or "").strip()
+    if not url:
+        return None
+    if "://" not in url:
+        url = "https://" + url
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname or "." not in parts.hostname:
+        return None
+    return url
+
+
+class LinkBlocked(Exception):
+    """A link (or one of its redirects) points at a loopback, private or otherwise internal address."""
+
+
+def _address_allowed(ip) -> bool:
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    if any(ip in net for net in LINK_CHECK_ALLOWED_NETWORKS):
+        return True
+    # is_global is False for loopback, private, link-local, shared, reserved and unspecified
+    return ip.is_global and not ip.is_multicast
+
+
+async def _resolve_public(host: str, port: int, timeout: float | None) -> str:
+    """Resolve `host`; every address it has must be public. Returns the address to connect to."""
+    try:
+        addrs = [ipaddress.ip_address(host)]
+    except ValueError:
+        infos = await asyncio.wait_for(
+            asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM), timeout)
+        addrs = [ipaddress.ip_address(info[4][0]) for info in infos]
+    for ip in addrs:
+        if not _address_allowed(ip):
+            raise LinkBlocked(f"{host} resolves to {ip}")
+    return str(addrs[0])
+
+
+async def _fetch_link(client: httpx.AsyncClient, method: str, url: str) -> tuple[int, str, int]:
+    """
+    `method` on url without reading the body, following redirects by hand. Each hop is resolved
+    and checked, then connected to by that address (Host header and SNI keep the name), so a
+    redirect or a DNS answer that changes between check and connect can't reach inside.
+    Returns (status code, final URL, redirects followed).
+    """
+    for hops in range(LINK_CHECK_MAX_REDIRECTS + 1):
+        target = httpx.URL(url)
+        port = target.port or (443 if target.scheme == "https" else 80)
+        ip = await _resolve_public(target.host, port, client.timeout.connect)
+        request = client.build_request(
+            method, target.copy_with(host=ip), headers={"Host": target.netloc.decode("ascii")},
+            extensions={"sni_hostname": target.host} if target.scheme == "https" else None,
+        )
+        resp = await client.send(request, stream=True)
+        await resp.aclose()
+        location = resp.headers.get("Location")
+        if not (resp.is_redirect and location):
+            return resp.status_code, url, hops
+        url = str(target.join(location))
+        if httpx.URL(url).scheme not in ("http", "https"):
+            raise LinkBlocked(f"redirect to a non-http URL: {url[:200]}")
+    raise httpx.TooManyRedirects(f"more than {LINK_CHECK_MAX_REDIRECTS} redirects", request=request)
+
+
+def _classify_link(url: str, code: int, redirected: bool) -> str:
+    if code < 400:
+        return "redirect" if redirected else "ok"
+    host = (urllib.parse.urlsplit(url).hostname or "").lower().removeprefix("www.")
+    if code in (401, 403) or (code == 404 and host in LINK_PRIVATE_404_HOSTS):
+        return "private"
+    return "broken"
+
+
+async def _check_link(client: httpx.AsyncClient, url: str, host_limits: dict) -> dict:
+    host = urllib.parse.urlsplit(url).hostname
+    sem = host_limits.setdefault(host, asyncio.Semaphore(LINK_CHECK_PER_HOST))
+    result = {"url": url, "status": "unreachable", "http_status": None, "final_url": None, "error": None}
+    t0 = time.perf_counter()
+    async with sem:
+        try:
+            code, final, hops = await _fetch_link(client, "HEAD", url)
+            if code in (400, 403, 405, 501):
+                # plenty of hosts reject HEAD; retry as a streamed GET without reading the body
+                code, final, hops = await _fetch_link(client, "GET", url)
+            result.update(status=_classify_link(final, code, hops > 0), http_status=code,
+                          final_url=final if final != url else None)
+        except LinkBlocked as e:
+            result.update(status="blocked", error=str(e)[:300])
+        except (httpx.TimeoutException, TimeoutError):
+            result.update(status="timeout", error=f"no answer in {LINK_CHECK_TIMEOUT:g}s")
+        except (httpx.HTTPError, OSError) as e:          # OSError: the name didn't resolve
+            result.update(status="unreachable", error=f"{type(e).__name__}: {e}"[:300])
+    result["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    return result
+
+
+async def check_urls(urls: list[str], timeout: float = LINK_CHECK_TIMEOUT,
+                     concurrency: int = LINK_CHECK_CONCURRENCY) -> dict[str, dict]:
+    """Check URLs concurrently: at most `concurrency` connections, LINK_CHECK_PER_HOST per host."""
+    host_limits = {}
+    async with httpx.AsyncClient(
+        follow_redirects=False,         # _fetch_link follows them, checking every hop
+        timeout=httpx.Timeout(timeout),
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        headers={"User-Agent": "InnoverseAdmin-LinkCheck/1.0"},
+    ) as client:
+        results = await asyncio.gather(*(_check_link(client, u, host_limits) for u in urls))
+    return {r["url"]: r for r in results}
+
+
+@uses_profile("interactive")
+def run_link_checks(limit: int = LINK_CHECK_BATCH, force: bool = False) -> dict:
+    """Check pending submissions whose link result is missing or older than the TTL."""
+    now = datetime.now(timezone.utc)
+    stale = now - timedelta(seconds=LINK_CHECK_TTL_SECONDS)
+    query = {"status": "pending", "submission_url": {"$nin": [None, ""]}}
+    if not force:
+        query["$or"] = [{"link_check.checked_at": {"$exists": False}}, {"link_check.checked_at": {"$lt": stale}}]
+    subs = list(submissions_col.find(query, {"submission_url": 1}).limit(limit))
+    if not subs:
+        return {"submissions": 0, "checked": 0, "cached": 0}
+
+    by_sub = {s["_id"]: normalize_submission_url(s.get("submission_url")) for s in subs}
+    urls = sorted({u for u in by_sub.values() if u})
+    cached = {} if force else {c["_id"]: c for c in link_checks_col.find(
+        {"_id": {"$in": urls}, "checked_at": {"$gte": stale}})}
+    to_check = [u for u in urls if u not in cached]
+    fresh = asyncio.run(check_urls(to_check)) if to_check else {}
+    if fresh:
+        link_checks_col.bulk_write([pymongo.ReplaceOne(
+            {"_id": u}, {**{k: v for k, v in r.items() if k != "url"}, "checked_at": now}, upsert=True
+        ) for u, r in fresh.items()], ordered=False)
+
+    ops = []
+    for sub_id, url in by_sub.items():
+        r = fresh.get(url) or cached.get(url) or {"status": "invalid", "http_status": None, "final_url": None}
+        METRICS.inc("portal_link_checks_total", status=r["status"])
+        ops.append(pymongo.UpdateOne({"_id": sub_id}, {"$set": {"link_check": {
+            "status": r["status"],
+            "http_status": r.get("http_status"),
+            "final_url": r.get("final_url"),
+            "error": r.get("error"),
+            "checked_at": now,
+        }}}))
+    submissions_col.bulk_write(ops, ordered=False)
+    note_write("submissions", fields=["link_check"])
+    return {"submissions": len(ops), "checked": len(fresh), "cached": len(cached)}
+
+
+def _link_check_loop():
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    while True:
+        time.sleep(LINK_CHECK_INTERVAL)
+        try:
+            if acquire_job_lock("link_checks", owner, LINK_CHECK_INTERVAL):
+                try:
+                    result = run_link_checks()
+                finally:
+                    release_job_lock("link_checks", owner)
+                if result["submissions"]:
+                    print(f"[LinkCheck] {result}")
+        except Exception as e:
+            print(f"[LinkCheck] Run failed: {e}")
+
+
+@st.cache_resource
+def start_link_checker() -> bool:
+    """One polling thread per process; the job lock keeps replicas from checking the same batch."""
+    threading.Thread(target=_link_check_loop, daemon=True, name="link-checker").start()
+    return True
+
+
+def link_badge(sub: dict) -> str:
+    lc = sub.get("link_check")
+    if not lc:
+        return "⚪ Not checked yet"
+    badge = LINK_STATUS_BADGES.get(lc["status"], lc["status"])
+    if lc.get("http_status"):
+        badge += f" ({lc['http_status']})"
+    return badge
+
+
+# --- Near-duplicate submissions (MinHash + LSH) ---
+# Each submission's text is shingled and MinHashed once; the signature is cut into bands
+# and every band hashed to one int64 in a multikey index. Two submissions sharing any band
+# key are candidates, so a task's candidate pairs come from one $group over the index
+# instead of comparing all pairs. With 16 bands of 8 rows, pairs at ~0.7 Jaccard or above
+# collide in at least one band with probability > 0.5, at 0.85+ almost always.
+SIMILARITY_SHINGLE_WORDS = 3
+SIMILARITY_PERMUTATIONS = 128
+SIMILARITY_BANDS = 16
+SIMILARITY_SEED = 20240601
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.8"))
+SIMILARITY_INTERVAL = int(os.getenv("SIMILARITY_INTERVAL", "120"))
+SIMILARITY_BATCH = 2000
+SIMILARITY_MAX_BUCKET = 200       # boilerplate buckets: compare members to one representative
+# submissions re-read behind the watermarks: secondaries lag, writers' clocks drift
+SIMILARITY_LAG_SECONDS = MONGO_MAX_STALENESS + 60
+# a submission is looked at again when either time moves; its text hash decides whether to re-sign
+SIMILARITY_WATERMARKS = ("submitted_at", "updated_at")
+# stored with each signature; changing any parameter above means re-signing everything
+SIMILARITY_PARAMS = (f"ms-w{SIMILARITY_SHINGLE_WORDS}-p{SIMILARITY_PERMUTATIONS}"
+                     f"-b{SIMILARITY_BANDS}-s{SIMILARITY_SEED}")
+signatures_col = db.submission_signatures
+
+# multiply-shift hashing: (a*x + b) mod 2**64, top 32 bits; a odd. uint64 wraparound is the mod.
+_rng = np.random.default_rng(SIMILARITY_SEED)
+_MINHASH_A = _rng.integers(0, 1 << 64, size=(SIMILARITY_PERMUTATIONS, 1), dtype=np.uint64) | np.uint64(1)
+_MINHASH_B = _rng.integers(0, 1 << 64, size=(SIMILARITY_PERMUTATIONS, 1), dtype=np.uint64)
+_SHINGLE_MIX = _rng.integers(1, 1 << 32, size=SIMILARITY_SHINGLE_WORDS, dtype=np.uint64)
+_WORD_RE = re.compile(r"\w+")
+
+
+def shingle_hashes(text: str | None) -> np.ndarray:
+    """32-bit hashes of the distinct word n-grams in `text` (lower-cased, punctuation dropped)."""
+    words = _WORD_RE.findall((text or "").lower())
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    k = min(SIMILARITY_SHINGLE_WORDS, len(words))
+    # crc32 per word, then a fixed mix per position: stable across processes, unlike hash()
+    wh = np.fromiter(map(zlib.crc32, map(str.encode, words)), dtype=np.uint64, count=len(words))
+    n = len(words) - k + 1
+    mixed = sum(wh[i:i + n] * _SHINGLE_MIX[i] for i in range(k))
+    return np.unique(mixed & np.uint64(0xFFFFFFFF))
+
+
+def minhash_signature(shingles: np.ndarray) -> np.ndarray | None:
+    if not len(shingles):
+        return None
+    return ((_MINHASH_A * shingles + _MINHASH_B) >> np.uint64(32)).min(axis=1).astype(np.uint32)
+
+
+def lsh_bands(sig: np.ndarray) -> list[int]:
+    rows = SIMILARITY_PERMUTATIONS // SIMILARITY_BANDS
+    return [int.from_bytes(hashlib.blake2b(bytes([b]) + sig[b * rows:(b + 1) * rows].tobytes(),
+                                           digest_size=8).digest(), "big", signed=True)
+            for b in range(SIMILARITY_BANDS)]
+
+
+def text_hash(text: str | None) -> str:
+    return hashlib.blake2b((text or "").encode(), digest_size=16).hexdigest()
+
+
+def signature_doc(sub: dict, now: datetime) -> dict:
+    sh = shingle_hashes(sub.get("submission_text"))
+    sig = minhash_signature(sh)
+    return {
+        "_id": sub["_id"],
+        "task_id": sub.get("task_id"),
+        "user_id": sub.get("user_id"),
+        "sig": bson.Binary(sig.tobytes()) if sig is not None else None,
+        "bands": lsh_bands(sig) if sig is not None else [],
+        "shingles": int(len(sh)),
+        "text_hash": text_hash(sub.get("submission_text")),
+        # the source's times, read back as the watermarks of the next pass
+        **{f: sub.get(f) for f in SIMILARITY_WATERMARKS},
+        "params": SIMILARITY_PARAMS,
+        "signed_at": now,
+    }
+
+
+def _as_sig(raw) -> np.ndarray:
+    return np.frombuffer(raw, dtype=np.uint32)
+
+
+SIGN_FIELDS = {"task_id": 1, "user_id": 1, "submission_text": 1, **{f: 1 for f in SIMILARITY_WATERMARKS}}
+
+
+def _sign_ops(subs: list[dict], now: datetime) -> list:
+    """Re-sign submissions whose text changed (or that have no current signature); just move the rest's times."""
+    current = {d["_id"]: d for d in signatures_col.find(
+        {"_id": {"$in": [s["_id"] for s in subs]}, "params": SIMILARITY_PARAMS}, {"text_hash": 1})}
+    ops = []
+    for s in subs:
+        if current.get(s["_id"], {}).get("text_hash") == text_hash(s.get("submission_text")):
+            ops.append(pymongo.UpdateOne({"_id": s["_id"]}, {"$set": {f: s.get(f) for f in SIMILARITY_WATERMARKS}}))
+        else:
+            ops.append(pymongo.ReplaceOne({"_id": s["_id"]}, signature_doc(s, now), upsert=True))
+    return ops
+
+
+@uses_profile("interactive")
+def sign_new_submissions(limit: int = SIMILARITY_BATCH, rebuild: bool = False) -> int:
+    """
+    Sign submissions submitted or updated since the last pass, re-signing those whose text
+    changed. Keyed on times rather than _id, so edits and inserts with an older _id are seen.
+    `rebuild` re-reads every submission (new parameters). Returns how many were (re-)signed.
+    """
+    now = datetime.now(timezone.utc)
+    lag = timedelta(seconds=SIMILARITY_LAG_SECONDS)
+    seen, signed = 0, 0
+    for field in SIMILARITY_WATERMARKS:
+        query = {field: {"$ne": None}}
+        last = None if rebuild else signatures_col.find_one(
+            {"params": SIMILARITY_PARAMS, field: {"$ne": None}}, {field: 1}, sort=[("params", 1), (field, -1)])
+        if last and isinstance(last[field], datetime):
+            query[field] = {"$gt": last[field] - lag}
+        after = None
+        while seen < limit:
+            page = query if after is None else {"$and": [query, {"$or": [
+                {field: {"$gt": after[field]}}, {field: after[field], "_id": {"$gt": after["_id"]}}]}]}
+            subs = list(submissions_col.find(page, SIGN_FIELDS)
+                        .sort([(field, 1), ("_id", 1)]).limit(min(limit - seen, 1000)))
+            if not subs:
+                break
+            ops = _sign_ops(subs, now)
+            signatures_col.bulk_write(ops, ordered=False)
+            signed += sum(isinstance(op, pymongo.ReplaceOne) for op in ops)
+            seen += len(subs)
+            after = subs[-1]
+    if rebuild:
+        # submissions with neither time are only reachable by _id
+        for sub in submissions_col.find({f: None for f in SIMILARITY_WATERMARKS}, SIGN_FIELDS):
+            signatures_col.replace_one({"_id": sub["_id"]}, signature_doc(sub, now), upsert=True)
+            signed += 1
+    if signed:
+        note_write("submission_signatures")
+    return signed
+
+
+def _similarity(sigs: dict, a, b) -> float:
+    return float(np.count_nonzero(sigs[a] == sigs[b])) / SIMILARITY_PERMUTATIONS
+
+
+@st.cache_data(ttl=CACHE_MAX_TTL, max_entries=64, show_spinner=False, hash_funcs=CACHE_HASH_FUNCS)
+def _similar_clusters(task_id: ObjectId, threshold: float, version: tuple) -> list[dict]:
+    buckets = signatures_col.aggregate([
+        {"$match": {"task_id": task_id, "params": SIMILARITY_PARAMS}},
+        {"$unwind": "$bands"},
+        {"$group": {"_id": "$bands", "ids": {"$push": "$_id"}}},
+        {"$match": {"ids.1": {"$exists": True}}},
+    ])
+    candidates = set()
+    for bucket in buckets:
+        ids = sorted(bucket["ids"])
+        if len(ids) > SIMILARITY_MAX_BUCKET:
+            candidates.update((ids[0], other) for other in ids[1:])
+        else:
+            candidates.update((a, b) for i, a in enumerate(ids) for b in ids[i + 1:])
+    if not candidates:
+        return []
+
+    members = {x for pair in candidates for x in pair}
+    docs = {d["_id"]: d for d in signatures_col.find({"_id": {"$in": list(members)}},
+                                                     {"sig": 1, "user_id": 1})}
+    # a signature removed between the $group and this read (archived submission) drops its pairs
+    candidates = {(a, b) for a, b in candidates if a in docs and b in docs}
+    sigs = {k: _as_sig(d["sig"]) for k, d in docs.items()}
+    parent = {}
+
+    def find(x):
+        while parent.get(x, x) != x:
+            parent[x] = parent.get(parent[x], parent[x])
+            x = parent[x]
+        return x
+
+    pairs = []
+    for a, b in candidates:
+        if docs[a].get("user_id") == docs[b].get("user_id"):
+            continue   # resubmissions by the same student aren't copying
+        score = _similarity(sigs, a, b)
+        if score >= threshold:
+            pairs.append((a, b, score))
+            parent[find(a)] = find(b)
+
+    clusters = {}
+    for a, b, score in pairs:
+        c = clusters.setdefault(find(a), {"ids": set(), "pairs": []})
+        c["ids"].update((a, b))
+        c["pairs"].append({"a": a, "b": b, "score": round(score, 3)})
+    out = [{"ids": sorted(c["ids"]),
+            "max_score": max(p["score"] for p in c["pairs"]),
+            "pairs": sorted(c["pairs"], key=lambda p: -p["score"])} for c in clusters.values()]
+    return sorted(out, key=lambda c: (-len(c["ids"]), -c["max_score"]))
+
+
+def get_similar_clusters(task_id: ObjectId, threshold: float = SIMILARITY_THRESHOLD) -> list[dict]:
+    """Clusters of near-duplicate submissions (by different users) for one task."""
+    return _similar_clusters(task_id, threshold, cache_token("submission_signatures"))
+
+
+@uses_profile("interactive")
+def similar_to(sub_id, threshold: float = SIMILARITY_THRESHOLD) -> list[tuple]:
+    """Incremental lookup for one submission: band-index candidates, then signature check."""
+    me = signatures_col.find_one({"_id": sub_id, "params": SIMILARITY_PARAMS})
+    if not me or not me["bands"]:
+        return []
+    mine = _as_sig(me["sig"])
+    out = []
+    for d in signatures_col.find({"task_id": me["task_id"], "bands": {"$in": me["bands"]},
+                                  "_id": {"$ne": sub_id}, "user_id": {"$ne": me.get("user_id")}},
+                                 {"sig": 1}).limit(SIMILARITY_MAX_BUCKET):
+        score = float(np.count_nonzero(_as_sig(d["sig"]) == mine)) / SIMILARITY_PERMUTATIONS
+        if score >= threshold:
+            out.append((d["_id"], round(score, 3)))
+    return sorted(out, key=lambda x: -x[1])
+
+
+def _similarity_loop():
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    while True:
+        time.sleep(SIMILARITY_INTERVAL)
+        try:
+            if acquire_job_lock("similarity", owner, SIMILARITY_INTERVAL * 5):
+                try:
+                    n = sign_new_submissions()
+                finally:
+                    release_job_lock("similarity", owner)
+                if n:
+                    print(f"[Similarity] Signed {n} submission(s)")
+        except Exception as e:
+            print(f"[Similarity] Signing failed: {e}")
+
+
+@st.cache_resource
+def start_similarity_indexer() -> bool:
+    threading.Thread(target=_similarity_loop, daemon=True, name="similarity-indexer").start()
+    return True
+
+
+# --- User stats reconciliation ---
+stats_reconcile_col = db.stats_reconciliations
+RECONCILE_REPORT_DAYS = 30
+
+# points have been saved as int, float and str; coerce to a whole number server-side
+POINTS_INT_EXPR = {"$toInt": {"$round": [
+    {"$convert": {"input": "$points", "to": "double", "onError": 0, "onNull": 0}}, 0
+]}}
+
+RECONCILE_PREVIEW_ROWS = 500
+
+def _reconcile_pipeline(run_id: str, started_at: datetime, dry_run: bool = False) -> list[dict]:
+    """
+    users → recomputed stats from approved (hot + archived) submissions → only the rows that differ.
+    tasks_completed counts approved submissions, as transition_submission increments it. The
+    rows are merged into the report collection, or for a dry run returned as one count + preview.
+    """
+    pipeline = [
+        {"$project": {"name": 1, "email": 1, "stats.points": 1, "stats.tasks_completed": 1}},
+        {"$lookup": {
+            "from": "submissions",
+            "localField": "_id",
+            "foreignField": "user_id",
+            "pipeline": [
+                {"$match": {"status": "approved"}},
+                {"$group": {
+                    "_id": None,
+                    "points": {"$sum": POINTS_INT_EXPR},
+                    "tasks": {"$sum": 1},
+                }},
+            ],
+            "as": "calc",
+        }},
+        # approved submissions already moved to the archive still count
+        {"$lookup": {"from": archived_stats_col.name, "localField": "_id", "foreignField": "_id", "as": "arch"}},
+        {"$set": {
+            "old_points": {"$ifNull": ["$stats.points", 0]},
+            "old_tasks": {"$ifNull": ["$stats.tasks_completed", 0]},
+            "new_points": {"$add": [
+                {"$ifNull": [{"$first": "$calc.points"}, 0]},
+                {"$sum": {"$ifNull": [{"$first": "$arch.subs.points"}, []]}},
+            ]},
+            "new_tasks": {"$add": [
+                {"$ifNull": [{"$first": "$calc.tasks"}, 0]},
+                {"$size": {"$ifNull": [{"$first": "$arch.subs"}, []]}},
+            ]},
+        }},
+        # $ne is type-aware for strings, so "100" vs 100 counts as drift and gets fixed
+        {"$match": {"$expr": {"$or": [
+            {"$ne": ["$old_points", "$new_points"]},
+            {"$ne": ["$old_tasks", "$new_tasks"]},
+        ]}}},
+        {"$project": {
+            "_id": 0,
+            "run_id": {"$literal": run_id},
+            "user_id": "$_id",
+            "name": 1,
+            "email": 1,
+            "old_points": 1,
+            "new_points": 1,
+            "old_tasks": 1,
+            "new_tasks": 1,
+            "created_at": {"$literal": started_at},
+        }},
+    ]
+    if dry_run:
+        return pipeline + [{"$facet": {"count": [{"$count": "n"}], "rows": [{"$limit": RECONCILE_PREVIEW_ROWS}]}}]
+    return pipeline + [
+        {"$merge": {"into": stats_reconcile_col.name, "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+
+def run_stats_reconciliation(dry_run: bool = True) -> dict:
+    """
+    Recompute every user's stats.points / stats.tasks_completed from approved submissions.
+    Unless dry_run, the diff is written to stats_reconciliations and then applied to users
+    with a second $merge; a dry run writes nothing and returns the first rows as "preview".
+    Returns a summary including the run_id for the report.
+    """
+    started = time.perf_counter()
+    started_at = datetime.now(timezone.utc)
+    run_id = started_at.strftime("%Y%m%dT%H%M%S") + "-" + secrets.token_hex(3)
+
+    string_points = submissions_col.count_documents({"points": {"$type": "string"}})
+    if not dry_run and string_points:
+        submissions_col.update_many({"points": {"$type": "string"}}, [{"$set": {"points": POINTS_INT_EXPR}}])
+        note_write("submissions", fields=["points"])
+
+    preview = None
+    if dry_run:
+        result = next(users_col.aggregate(_reconcile_pipeline(run_id, started_at, dry_run=True), allowDiskUse=True))
+        corrected = result["count"][0]["n"] if result["count"] else 0
+        preview = result["rows"]
+    else:
+        users_col.aggregate(_reconcile_pipeline(run_id, started_at), allowDiskUse=True)
+        corrected = stats_reconcile_col.count_documents({"run_id": run_id})
+
+    if not dry_run and corrected:
+        stats_reconcile_col.aggregate([
+            {"$match": {"run_id": run_id}},
+            {"$project": {"_id": "$user_id", "old_points": 1, "old_tasks": 1, "new_points": 1, "new_tasks": 1}},
+            {"$merge": {
+                "into": users_col.name,
+                "on": "_id",
+                # compare-and-set: skip users whose stats moved since the diff was computed
+                "whenMatched": [{"$set": {"stats": {"$cond": [
+                    {"$and": [
+                        {"$eq": [{"$ifNull": ["$stats.points", 0]}, "$$new.old_points"]},
+                        {"$eq": [{"$ifNull": ["$stats.tasks_completed", 0]}, "$$new.old_tasks"]},
+                    ]},
+                    {"$mergeObjects": ["$stats", {
+                        "points": "$$new.new_points",
+                        "tasks_completed": "$$new.new_tasks",
+                        "reconciled_at": "$$NOW",
+                    }]},
+                    "$stats",
+                ]}}}],
+                "whenNotMatched": "discard",
+            }},
+        ])
+        note_write("users", fields=["stats"])
+
+    return {
+        "run_id": run_id,
+        "dry_run": dry_run,
+        "corrected": corrected,
+        "string_points": string_points,
+        "seconds": round(time.perf_counter() - started, 2),
+        "preview": preview,
+    }
+
+
+
+# --- Hot/cold archival ---
+# Finished-season submissions, their assignments and old forum comments move out of the
+# hot collections into archive_<name> collections or zstd Parquet files under ARCHIVE_DIR.
+ARCHIVE_BACKEND = os.getenv("ARCHIVE_BACKEND", "mongo")          # "mongo" | "parquet"
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+ARCHIVE_DEFAULT_CUTOFF_DAYS = 180
+ARCHIVE_FINAL_STATUSES = ["approved", "rejected"]
+# collection → time field the cutoff applies to, and the flat (column, path, kind) fields
+# kept beside the raw BSON so Parquet files can be filtered without decoding every row
+ARCHIVE_TARGETS = {
+    "submissions": {
+        "time_field": "submitted_at",
+        "columns": [("user_id", "user_id", "id"), ("task_id", "task_id", "id"), ("status", "status", "str"),
+                    ("points", "points", "int"), ("submitted_at", "submitted_at", "time"),
+                    ("reviewed_at", "reviewed_at", "time")],
+    },
+    "task_assignments": {
+        "time_field": "assigned_at",
+        "columns": [("user_id", "user_id", "id"), ("task_id", "task_id", "id"), ("status", "status", "str"),
+                    ("assigned_at", "assigned_at", "time")],
+    },
+    "forum_comments": {
+        "time_field": "created_at",
+        "iso_time": True,        # the user portal writes created_at as an ISO string
+        "columns": [("forum_id", "forum_id", "id"), ("user_email", "user.email", "str"),
+                    ("created_at", "created_at", "time")],
+    },
+}
+ARCHIVE_ARROW_TYPES = {"id": pa.string(), "str": pa.string(), "int": pa.int64(),
+                       "time": pa.timestamp("ms", tz="UTC")}
+archive_runs_col = db.archive_runs
+# user → approved submissions that left the hot collection, so reconciliation still counts them
+archived_stats_col = db.archived_stats
+
+
+def _doc_path(doc: dict, path: str):
+    for part in path.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+
+class MongoArchive:
+    """Archive backend: one archive_<name> collection per hot collection, same database."""
+    name = "mongo"
+
+    @staticmethod
+    def _col(coll: str):
+        return db[f"archive_{coll}"]
+
+    def write(self, coll: str, docs: list[dict], run_id: str):
+        # Upserts keep a retried batch from duplicating documents
+        self._col(coll).bulk_write([
+            pymongo.ReplaceOne({"_id": d["_id"]}, {**d, "_archive_run": run_id}, upsert=True) for d in docs
+        ], ordered=False)
+
+    @staticmethod
+    def _query(coll: str, filters: dict) -> dict:
+        paths = {c: path for c, path, _ in ARCHIVE_TARGETS[coll]["columns"]}
+        return {paths.get(k, k): v for k, v in filters.items() if v is not None}
+
+    def count(self, coll: str, filters: dict) -> int:
+        return self._col(coll).count_documents(self._query(coll, filters))
+
+    def find(self, coll: str, filters: dict, skip: int = 0, limit: int = 100) -> list[dict]:
+        time_field = ARCHIVE_TARGETS[coll]["time_field"]
+        return list(self._col(coll).find(self._query(coll, filters), {"_archive_run": 0})
+                    .sort([(time_field, -1), ("_id", -1)]).skip(skip).limit(limit))
+
+    def take(self, coll: str, filters: dict) -> list[dict]:
+        """Documents matching filters; they are removed from the archive by discard()."""
+        return list(self._col(coll).find(self._query(coll, filters), {"_archive_run": 0}))
+
+    def discard(self, coll: str, ids: list):
+        self._col(coll).delete_many({"_id": {"$in": ids}})
+
+    def sizes(self) -> dict:
+        return {coll: self._col(coll).estimated_document_count() for coll in ARCHIVE_TARGETS}
+
+
+class ParquetArchive:
+    """Archive backend: zstd Parquet files under ARCHIVE_DIR/<name>/, one per archived batch."""
+    name = "parquet"
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _dir(self, coll: str) -> str:
+        return os.path.join(self.root, coll)
+
+    def _files(self, coll: str) -> list[str]:
+        path = self._dir(coll)
+        if not os.path.isdir(path):
+            return []
+        return sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(".parquet"))
+
+    @staticmethod
+    def _schema(coll: str) -> pa.Schema:
+        cols = [("_id", pa.string())] + [(c, ARCHIVE_ARROW_TYPES[kind]) for c, _, kind in ARCHIVE_TARGETS[coll]["columns"]]
+        return pa.schema(cols + [("_bson", pa.binary())])
+
+    @staticmethod
+    def _flat(value, kind: str):
+        if value is None:
+            return None
+        if kind in ("id", "str"):
+            return str(value)
+        if kind == "int":
+            return as_points(value)
+        return as_datetime(value)
+
+    def write(self, coll: str, docs: list[dict], run_id: str):
+        columns = ARCHIVE_TARGETS[coll]["columns"]
+        data = {"_id": [str(d["_id"]) for d in docs]}
+        for col, path, kind in columns:
+            data[col] = [self._flat(_doc_path(d, path), kind) for d in docs]
+        data["_bson"] = [bson.encode(d) for d in docs]
+        os.makedirs(self._dir(coll), exist_ok=True)
+        path = os.path.join(self._dir(coll), f"{run_id}-{secrets.token_hex(4)}.parquet")
+        tmp = path + ".tmp"
+        pq.write_table(pa.table(data, schema=self._schema(coll)), tmp, compression="zstd")
+        os.replace(tmp, path)
+
+    def _expr(self, coll: str, filters: dict):
+        kinds = {c: kind for c, _, kind in ARCHIVE_TARGETS[coll]["columns"]}
+        expr = None
+        for key, value in filters.items():
+            if value is None:
+                continue
+            term = pc.field(key) == (str(value) if kinds.get(key) in ("id", "str") else value)
+            expr = term if expr is None else expr & term
+        return expr
+
+    def _dataset(self, coll: str):
+        files = self._files(coll)
+        return pa_ds.dataset(files, schema=self._schema(coll), format="parquet") if files else None
+
+    def count(self, coll: str, filters: dict) -> int:
+        ds = self._dataset(coll)
+        return ds.count_rows(filter=self._expr(coll, filters)) if ds else 0
+
+    @staticmethod
+    def _where(coll: str, filters: dict) -> tuple[str, list]:
+        kinds = {c: kind for c, _, kind in ARCHIVE_TARGETS[coll]["columns"]}
+        terms, params = [], []
+        for key, value in filters.items():
+            if value is None:
+                continue
+            if key not in kinds:
+                raise ValueError(f"{coll} archive has no column {key!r}")
+            terms.append(f'"{key}" = ?')
+            params.append(str(value) if kinds[key] in ("id", "str") else value)
+        return (" WHERE " + " AND ".join(terms) if terms else ""), params
+
+    def find(self, coll: str, filters: dict, skip: int = 0, limit: int = 100) -> list[dict]:
+        """
+        One page, newest first. DuckDB runs the sort as a top-N over the flat columns and
+        only then reads _bson for the rows on the page, so paging never loads the archive.
+        """
+        files = self._files(coll)
+        if not files:
+            return []
+        time_field = ARCHIVE_TARGETS[coll]["time_field"]
+        where, params = self._where(coll, filters)
+        paths = ", ".join(_sql_str(f) for f in files)
+        con = duckdb.connect()
+        try:
+            rows = con.execute(
+                f"SELECT _bson FROM read_parquet([{paths}], union_by_name = true){where} "
+                f'ORDER BY "{time_field}" DESC NULLS LAST, _id DESC LIMIT ? OFFSET ?',
+                params + [limit, skip],
+            ).fetchall()
+        finally:
+            con.close()
+        return [bson.decode(r[0]) for r in rows]
+
+    def take(self, coll: str, filters: dict) -> list[dict]:
+        ds = self._dataset(coll)
+        if not ds:
+            return []
+        table = ds.to_table(columns=["_bson"], filter=self._expr(coll, filters))
+        return [bson.decode(b) for b in table.column("_bson").to_pylist()]
+
+    def discard(self, coll: str, ids: list):
+        drop = pa.array([str(i) for i in ids])
+        for path in self._files(coll):
+            table = pq.read_table(path, schema=self._schema(coll))
+            keep = table.filter(pc.invert(pc.is_in(table.column("_id"), value_set=drop)))
+            if keep.num_rows == table.num_rows:
+                continue
+            if keep.num_rows == 0:
+                os.remove(path)
+            else:
+                tmp = path + ".tmp"
+                pq.write_table(keep, tmp, compression="zstd")
+                os.replace(tmp, path)
+
+    def sizes(self) -> dict:
+        return {coll: sum(pq.ParquetFile(f).metadata.num_rows for f in self._files(coll))
+                for coll in ARCHIVE_TARGETS}
+
+
+@st.cache_resource
+def get_archive():
+    if ARCHIVE_BACKEND == "parquet":
+        return ParquetArchive(ARCHIVE_DIR)
+    return MongoArchive()
+
+
+def _closed_task_ids(cutoff: datetime) -> list:
+    """Tasks whose season is over: deactivated, or due before the cutoff."""
+    return tasks_col.distinct("_id", {"$or": [{"is_active": False}, {"due_date": {"$lt": cutoff}}]})
+
+
+def _archive_query(coll: str, cutoff: datetime, closed_tasks: list) -> dict:
+    target = ARCHIVE_TARGETS[coll]
+    # Mongo compares strings only with strings; UTC ISO strings sort in time order
+    bound = cutoff.astimezone(timezone.utc).isoformat() if target.get("iso_time") else cutoff
+    query = {target["time_field"]: {"$lt": bound}}
+    if coll == "submissions":
+        query.update({"status": {"$in": ARCHIVE_FINAL_STATUSES}, "task_id": {"$in": closed_tasks}})
+    elif coll == "task_assignments":
+        query["task_id"] = {"$in": closed_tasks}
+    return query
+
+
+def _fold_archived_stats(subs: list[dict]):
+    """Record approved submissions leaving the hot collection; idempotent per submission."""
+    ops = [pymongo.UpdateOne(
+        {"_id": s["user_id"], "subs._id": {"$ne": s["_id"]}},
+        {"$push": {"subs": {"_id": s["_id"], "task_id": s.get("task_id"), "points": as_points(s.get("points"))}}},
+        upsert=True,
+    ) for s in subs if s.get("status") == "approved" and s.get("user_id")]
+    if not ops:
+        return
+    try:
+        archived_stats_col.bulk_write(ops, ordered=False)
+    except pymongo.errors.BulkWriteError as e:
+        # upsert on a user whose entry already lists the submission → duplicate _id, already folded
+        if any(err["code"] != 11000 for err in e.details.get("writeErrors", [])):
+            raise
+
+
+@uses_profile("interactive")
+def archive_cold_data(cutoff: datetime, dry_run: bool = True, batch_size: int = ARCHIVE_BATCH_SIZE,
+                      admin: str = "", progress_cb=None) -> dict:
+    """
+    Move finished-season documents older than cutoff into the archive backend in batches.
+    Each batch is copied to the archive before it is deleted from the hot collection, so an
+    interrupted run leaves at most a duplicate copy, never a lost document.
+    """
+    started = time.perf_counter()
+    started_at = datetime.now(timezone.utc)
+    run_id = started_at.strftime("%Y%m%dT%H%M%S") + "-" + secrets.token_hex(3)
+    archive = get_archive()
+    closed_tasks = _closed_task_ids(cutoff)
+    counts = {}
+    for coll in ARCHIVE_TARGETS:
+        query = _archive_query(coll, cutoff, closed_tasks)
+        hot = db[coll]
+        if dry_run:
+            counts[coll] = hot.count_documents(query)
+            continue
+        moved = 0
+        while True:
+            batch = list(hot.find(query).sort("_id", 1).limit(batch_size))
+            if not batch:
+                break
+            ids = [d["_id"] for d in batch]
+            archive.write(coll, batch, run_id)
+            if coll == "submissions":
+                _fold_archived_stats(batch)
+            hot.delete_many({"_id": {"$in": ids}})
+            if coll == "submissions":
+                signatures_col.delete_many({"_id": {"$in": ids}})
+            moved += len(batch)
+            if progress_cb:
+                progress_cb(coll, moved)
+        counts[coll] = moved
+        if moved:
+            note_write(coll)
+            if coll == "submissions":
+                note_write("submission_signatures")
+
+    summary = {
+        "run_id": run_id,
+        "dry_run": dry_run,
+        "backend": archive.name,
+        "cutoff": cutoff,
+        "counts": counts,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+    if not dry_run:
+        archive_runs_col.insert_one({**summary, "kind": "archive", "by": admin, "created_at": started_at})
+    return summary
+
+
+@uses_profile("interactive")
+def restore_archived(coll: str, filters: dict, admin: str = "") -> int:
+    """Move archived documents matching filters back into the hot collection."""
+    archive = get_archive()
+    docs = archive.take(coll, filters)
+    if not docs:
+        return 0
+    hot = db[coll]
+    for start in range(0, len(docs), ARCHIVE_BATCH_SIZE):
+        chunk = docs[start:start + ARCHIVE_BATCH_SIZE]
+        hot.bulk_write([pymongo.ReplaceOne({"_id": d["_id"]}, d, upsert=True) for d in chunk], ordered=False)
+        if coll == "submissions":
+            archived_stats_col.bulk_write([
+                pymongo.UpdateOne({"_id": d["user_id"]}, {"$pull": {"subs": {"_id": d["_id"]}}})
+                for d in chunk if d.get("user_id")
+            ], ordered=False)
+            # their times are older than the signing watermarks, so sign them here
+            signatures_col.bulk_write(_sign_ops(chunk, datetime.now(timezone.utc)), ordered=False)
+        archive.discard(coll, [d["_id"] for d in chunk])
+    note_write(coll)
+    if coll == "submissions":
+        note_write("submission_signatures")
+    archive_runs_col.insert_one({
+        "kind": "restore", "backend": archive.name, "collection": coll, "counts": {coll: len(docs)},
+        "filters": {k: v for k, v in filters.items() if v is not None},
+        "by": admin, "created_at": datetime.now(timezone.utc),
+    })
+    return len(docs)
+
+
+# --- Analytics snapshot (Parquet + DuckDB) ---
+# Analytics can read a local columnar copy instead of scanning the cluster. Each sync copies
+# rows changed since the last one (newer updated_at, or a newer _id for inserts that never set
+# updated_at) into a delta file; DuckDB reads base + deltas and keeps the newest copy of each
+# _id. Deletes only disappear at the periodic full refresh.
+ANALYTICS_BACKEND = os.getenv("ANALYTICS_BACKEND", "mongo")      # "mongo" | "snapshot"
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshot"))
+SNAPSHOT_INTERVAL = int(os.getenv("SNAPSHOT_INTERVAL", "600"))
+SNAPSHOT_FULL_REFRESH_HOURS = int(os.getenv("SNAPSHOT_FULL_REFRESH_HOURS", "24"))
+SNAPSHOT_COMPACT_FILES = 24          # deltas per table before they're folded into a new base
+SNAPSHOT_BATCH_SIZE = 20000
+# watermark overlap: secondaries may lag by up to MONGO_MAX_STALENESS, writers' clocks drift
+SNAPSHOT_LAG_SECONDS = MONGO_MAX_STALENESS + 60
+SNAPSHOT_TABLES = {
+    "users": [("name", "name", "str"), ("email", "email", "str"),
+              ("coding_track", "profile.coding_track", "str"), ("points", "stats.points", "int"),
+              ("tasks_completed", "stats.tasks_completed", "int"),
+              ("created_at", "created_at", "time"), ("updated_at", "updated_at", "time")],
+    "tasks": [("title", "title", "str"), ("track", "track", "str"), ("difficulty", "difficulty", "str"),
+              ("points", "points", "int"), ("is_active", "is_active", "bool"),
+              ("created_at", "created_at", "time"), ("updated_at", "updated_at", "time")],
+    "submissions": [("user_id", "user_id", "id"), ("task_id", "task_id", "id"), ("status", "status", "str"),
+                    ("points", "points", "int"), ("submitted_at", "submitted_at", "time"),
+                    ("reviewed_at", "reviewed_at", "time"), ("updated_at", "updated_at", "time")],
+    "task_assignments": [("user_id", "user_id", "id"), ("task_id", "task_id", "id"), ("status", "status", "str"),
+                         ("assigned_at", "assigned_at", "time"), ("updated_at", "updated_at", "time")],
+    "forum_comments": [("forum_id", "forum_id", "id"), ("user_email", "user.email", "str"),
+                       ("created_at", "created_at", "time"), ("updated_at", "updated_at", "time")],
+}
+SNAPSHOT_ARROW_TYPES = {**ARCHIVE_ARROW_TYPES, "bool": pa.bool_()}
+
+
+def _sql_str(s: str) -> str:
+    return "'" + s.replace("'", "''") + "'"
+
+
+class AnalyticsSnapshot:
+    """Parquet files under SNAPSHOT_DIR/<table>/ plus manifest.json with files and watermarks."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self.root, "manifest.json")
+
+    def manifest(self) -> dict:
+        try:
+            with open(self._manifest_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {"version": 0, "tables": {}, "retired": []}
+
+    def _save_manifest(self, manifest: dict):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self._manifest_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp, self._manifest_path)
+
+    @staticmethod
+    def _schema(table: str, seq: bool = True) -> pa.Schema:
+        cols = [("_id", pa.string())] + [(c, SNAPSHOT_ARROW_TYPES[kind]) for c, _, kind in SNAPSHOT_TABLES[table]]
+        return pa.schema(cols + ([("_seq", pa.int64())] if seq else []))
+
+    @staticmethod
+    def _value(value, kind: str):
+        if kind == "bool":
+            return None if value is None else bool(value)
+        return ParquetArchive._flat(value, kind)
+
+    @staticmethod
+    def _edge_key(doc: dict) -> str:
+        upd = doc.get("updated_at")
+        if not isinstance(upd, datetime):
+            return ""
+        return (upd.replace(tzinfo=timezone.utc) if upd.tzinfo is None else upd).isoformat()
+
+    def _copy(self, table: str, query: dict, name: str, seq: int, seen: dict | None = None) -> dict:
+        """
+        Stream matching documents into one Parquet file, skipping those whose updated_at is
+        unchanged from `seen`; returns rows written, new watermarks and everything fetched.
+        """
+        cols = SNAPSHOT_TABLES[table]
+        projection = {path: 1 for _, path, _ in cols}
+        path = os.path.join(self.root, table, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        out = {"rows": 0, "updated_at": None, "last_id": None}
+        fetched = {}
+        writer = None
+        cursor = db[table].find(query, projection, batch_size=SNAPSHOT_BATCH_SIZE)
+        try:
+            while True:
+                batch = [d for _, d in zip(range(SNAPSHOT_BATCH_SIZE), cursor)]
+                if not batch:
+                    break
+                docs = []
+                for d in batch:
+                    key = self._edge_key(d)
+                    fetched[str(d["_id"])] = (key, d["_id"])
+                    if not seen or seen.get(str(d["_id"])) != key:
+                        docs.append(d)
+                if not docs:
+                    continue
+                data = {"_id": [str(d["_id"]) for d in docs]}
+                for col, p, kind in cols:
+                    data[col] = [self._value(_doc_path(d, p), kind) for d in docs]
+                data["_seq"] = [seq] * len(docs)
+                if writer is None:
+                    writer = pq.ParquetWriter(path + ".tmp", self._schema(table), compression="zstd")
+                writer.write_table(pa.table(data, schema=self._schema(table)))
+                out["rows"] += len(docs)
+                for d in docs:
+                    upd = d.get("updated_at")
+                    if isinstance(upd, datetime):
+                        upd = upd.replace(tzinfo=timezone.utc) if upd.tzinfo is None else upd
+                        if out["updated_at"] is None or upd > out["updated_at"]:
+                            out["updated_at"] = upd
+                    if isinstance(d["_id"], ObjectId) and (out["last_id"] is None or d["_id"] > out["last_id"]):
+                        out["last_id"] = d["_id"]
+        finally:
+            cursor.close()
+            if writer is not None:
+                writer.close()
+        if writer is not None:
+            os.replace(path + ".tmp", path)
+        out["fetched"] = fetched
+        return out
+
+    def _query_since(self, state: dict) -> dict:
+        lag = timedelta(seconds=SNAPSHOT_LAG_SECONDS)
+        terms = []
+        if state.get("updated_at"):
+            terms.append({"updated_at": {"$gt": datetime.fromisoformat(state["updated_at"]) - lag}})
+        if state.get("last_id"):
+            since = ObjectId(state["last_id"]).generation_time - lag
+            terms.append({"_id": {"$gt": ObjectId.from_datetime(since)}})
+        return {"$or": terms} if terms else {}
+
+    @staticmethod
+    def _edge(fetched: dict, state: dict) -> dict:
+        """Fetched rows that fall inside the next sync's overlap window, as {_id: updated_at}."""
+        lag = timedelta(seconds=SNAPSHOT_LAG_SECONDS)
+        upd_floor = datetime.fromisoformat(state["updated_at"]) - lag if state.get("updated_at") else None
+        id_floor = ObjectId(state["last_id"]).generation_time - lag if state.get("last_id") else None
+        return {key: upd for key, (upd, _id) in fetched.items()
+                if (upd and upd_floor and datetime.fromisoformat(upd) > upd_floor)
+                or (id_floor and isinstance(_id, ObjectId) and _id.generation_time > id_floor)}
+
+    def _compact(self, table: str, state: dict, seq: int) -> list[str]:
+        """Fold base + deltas into one base file; returns the files it replaced."""
+        name = f"base-{seq:08d}.parquet"
+        path = os.path.join(self.root, table, name)
+        con = duckdb.connect()
+        try:
+            con.execute(f"COPY ({self._view_sql(table, state['files'], keep_seq=True)}) TO {_sql_str(path + '.tmp')} "
+                        f"(FORMAT PARQUET, COMPRESSION ZSTD)")
+        finally:
+            con.close()
+        os.replace(path + ".tmp", path)
+        old, state["files"] = state["files"], [name]
+        return old
+
+    @uses_profile("analytics")
+    def sync(self, full: bool = False) -> dict:
+        """Copy changed rows of every table; full=True (or a stale base) recopies everything."""
+        with self._lock:
+            manifest = self.manifest()
+            now = datetime.now(timezone.utc)
+            # files retired by the previous sync; readers listing them have long finished
+            for table, name in manifest.get("retired", []):
+                try:
+                    os.remove(os.path.join(self.root, table, name))
+                except FileNotFoundError:
+                    pass
+            manifest["retired"] = []
+            summary = {}
+            for table in SNAPSHOT_TABLES:
+                state = manifest["tables"].get(table)
+                refreshed = state and datetime.fromisoformat(state["full_at"])
+                is_full = (full or not state or
+                           now - refreshed > timedelta(hours=SNAPSHOT_FULL_REFRESH_HOURS))
+                seq = (state or {}).get("seq", 0) + 1
+                t0 = time.perf_counter()
+                if is_full:
+                    got = self._copy(table, {}, f"base-{seq:08d}.parquet", seq)
+                    retired = (state or {}).get("files", [])
+                    state = {"files": [f"base-{seq:08d}.parquet"] if got["rows"] else [], "full_at": now.isoformat()}
+                else:
+                    got = self._copy(table, self._query_since(state), f"delta-{seq:08d}.parquet", seq,
+                                     seen=state.get("edge"))
+                    retired = []
+                    if got["rows"]:
+                        state["files"].append(f"delta-{seq:08d}.parquet")
+                    if len(state["files"]) > SNAPSHOT_COMPACT_FILES:
+                        retired = self._compact(table, state, seq)
+                state["seq"] = seq
+                state["synced_at"] = now.isoformat()
+                # the overlap window re-reads older rows, so watermarks only ever move forward
+                if got["updated_at"] and (is_full or not state.get("updated_at")
+                                          or got["updated_at"] > datetime.fromisoformat(state["updated_at"])):
+                    state["updated_at"] = got["updated_at"].isoformat()
+                if got["last_id"] and (is_full or not state.get("last_id")
+                                       or got["last_id"] > ObjectId(state["last_id"])):
+                    state["last_id"] = str(got["last_id"])
+                state["edge"] = self._edge(got["fetched"], state)
+                manifest["tables"][table] = state
+                manifest["retired"] += [[table, name] for name in retired]
+                summary[table] = {"rows": got["rows"], "full": is_full,
+                                  "seconds": round(time.perf_counter() - t0, 2)}
+            if any(s["rows"] or s["full"] for s in summary.values()):
+                manifest["version"] = manifest.get("version", 0) + 1   # new data: drop cached queries
+            manifest["synced_at"] = now.isoformat()
+            self._save_manifest(manifest)
+        METRICS.inc("portal_snapshot_syncs_total")
+        return summary
+
+    def _view_sql(self, table: str, files: list[str], keep_seq: bool = False) -> str:
+        paths = ", ".join(_sql_str(os.path.join(self.root, table, f)) for f in files)
+        return (f"SELECT * {'' if keep_seq else 'EXCLUDE (_seq) '}FROM read_parquet([{paths}]) "
+                f"QUALIFY row_number() OVER (PARTITION BY _id ORDER BY _seq DESC) = 1")
+
+    def query(self, sql: str, params: list | None = None) -> pd.DataFrame:
+        """Run SQL against views named after SNAPSHOT_TABLES; each call gets its own connection."""
+        manifest = self.manifest()
+        con = duckdb.connect()
+        try:
+            con.execute("SET TimeZone = 'UTC'")
+            for table in SNAPSHOT_TABLES:
+                files = manifest["tables"].get(table, {}).get("files")
+                if files:
+                    con.execute(f"CREATE VIEW {table} AS {self._view_sql(table, files)}")
+                else:
+                    con.register(table, self._schema(table, seq=False).empty_table())
+            return con.execute(sql, params or []).df()
+        finally:
+            con.close()
+
+
+@st.cache_resource
+def get_snapshot() -> AnalyticsSnapshot:
+    return AnalyticsSnapshot(SNAPSHOT_DIR)
+
+
+@st.cache_data(ttl=CACHE_MAX_TTL, max_entries=64, show_spinner=False)
+def _snapshot_query(sql: str, version: int) -> pd.DataFrame:
+    return get_snapshot().query(sql)
+
+
+def snapshot_query(sql: str) -> pd.DataFrame:
+    """Cached until the next sync publishes a new manifest version."""
+    return _snapshot_query(sql, get_snapshot().manifest().get("version", 0))
+
+
+def _snapshot_loop(snapshot: AnalyticsSnapshot):
+    while True:
         try:
-            subject, html = render_task_email(template_key, task, user)
-            msg = _build_email(subject, html, user["email"], from_addr, from_name)
-            send_email_smtp(msg)
-            sent += 1
+            summary = snapshot.sync()
+            changed = {t: s["rows"] for t, s in summary.items() if s["rows"]}
+            if changed:
+                print(f"[Snapshot] Synced {changed}")
         except Exception as e:
-            failed += 1
-            failed_list.append(f'{user.get("email","")} → {e}')
-        finally:
-            # Update progress UI if provided
-            if progress_cb:
-                progress_cb(idx, total)
-            # Be gentle with Gmail: small delay helps avoid rate limits
-            time.sleep(0.2)
+            print(f"[Snapshot] Sync failed: {e}")
+        time.sleep(SNAPSHOT_INTERVAL)
 
-    return sent, failed, failed_list
 
+@st.cache_resource
+def start_snapshot_sync() -> bool:
+    """Per-host copy, so every process that serves snapshot analytics keeps its own in sync."""
+    if ANALYTICS_BACKEND != "snapshot":
+        return False
+    threading.Thread(target=_snapshot_loop, args=(get_snapshot(),), daemon=True, name="snapshot-sync").start()
+    return True
 
-# Track mapping
-TRACKS = {
-    "ai": "AI/ML",
-    "webdev": "Web Development", 
-    "dsa": "Data Structures & Algorithms",
-    "app": "App Development"
-}
 
 # OAuth2 session for Google authentication
 def get_google_auth(state=None, token=None):
@@ -264,50 +3422,243 @@ def get_google_auth(state=None, token=None):
     )
 
 
+# --- OIDC discovery + signing keys (ID tokens are verified locally) ---
+OIDC_ISSUER = os.getenv("OIDC_ISSUER", "https://accounts.google.com")
+OIDC_MIN_REFRESH_SECONDS = 60       # floor between forced refreshes (unknown kid)
+OIDC_DEFAULT_MAX_AGE = 3600         # when the JWKS response has no Cache-Control max-age
+
+def _cache_max_age(cache_control: str | None) -> int:
+    for part in (cache_control or "").split(","):
+        name, _, value = part.strip().partition("=")
+        if name.lower() == "max-age" and value.isdigit():
+            return int(value)
+    return OIDC_DEFAULT_MAX_AGE
+
+
+class OIDCKeyCache:
+    """Discovery metadata + JWKS for one issuer, refreshed in the background before max-age runs out."""
+
+    def __init__(self, issuer: str):
+        self.issuer = issuer.rstrip("/")
+        self._lock = threading.Lock()
+        self._metadata = None
+        self._keys = None
+        self._fetched_at = 0.0
+        self._expires_at = 0.0
+        self.last_error = None
+
+    def refresh(self, force: bool = False):
+        now = time.time()
+        if self._keys is not None and not force and now < self._expires_at:
+            return
+        if self._keys is not None and force and now - self._fetched_at < OIDC_MIN_REFRESH_SECONDS:
+            return
+        meta_resp = requests.get(f"{self.issuer}/.well-known/openid-configuration", timeout=10)
+        meta_resp.raise_for_status()
+        metadata = meta_resp.json()
+        jwks_resp = requests.get(metadata["jwks_uri"], timeout=10)
+        jwks_resp.raise_for_status()
+        keys = JsonWebKey.import_key_set(jwks_resp.json())
+        with self._lock:
+            self._metadata = metadata
+            self._keys = keys
+            self._fetched_at = time.time()
+            self._expires_at = self._fetched_at + _cache_max_age(jwks_resp.headers.get("Cache-Control"))
+
+    def metadata(self) -> dict:
+        self.refresh()
+        return self._metadata
+
+    def start_background_refresh(self):
+        def _loop():
+            while True:
+                try:
+                    # forced: the loop wakes before max-age runs out, when a plain refresh is a no-op
+                    self.refresh(force=True)
+                    self.last_error = None
+                    wait = max(OIDC_MIN_REFRESH_SECONDS, self._expires_at - time.time() - 60)
+                except Exception as e:
+                    self.last_error = str(e)
+                    print(f"[OIDC] Key refresh failed: {e}")
+                    wait = OIDC_MIN_REFRESH_SECONDS
+                time.sleep(wait)
+        threading.Thread(target=_loop, name="oidc-keys", daemon=True).start()
+        return self
+
+    def verify_id_token(self, id_token: str, client_id: str, nonce: str) -> dict:
+        """Verify signature, issuer, audience, expiry and nonce; returns the claims."""
+        self.refresh()
+        issuers = [self.issuer]
+        if self.issuer.startswith("https://"):
+            issuers.append(self.issuer[len("https://"):])   # Google also issues "accounts.google.com"
+        options = {
+            "iss": {"essential": True, "values": issuers},
+            "aud": {"essential": True, "value": client_id},
+            "exp": {"essential": True},
+            "nonce": {"essential": True, "value": nonce},
+        }
+        try:
+            claims = jwt.decode(id_token, self._keys, claims_options=options)
+        except ValueError:
+            # Signing key not in our cached set: keys rotated, refetch once
+            self.refresh(force=True)
+            claims = jwt.decode(id_token, self._keys, claims_options=options)
+        claims.validate(leeway=60)
+        return dict(claims)
+
+
+@st.cache_resource
+def get_oidc_keys() -> OIDCKeyCache:
+    return OIDCKeyCache(OIDC_ISSUER).start_background_refresh()
+
+
 def create_session_token():
     """Create a secure session token"""
     return secrets.token_urlsafe(32)
 
+# --- Cross-request auth state (lives in Mongo so any replica can serve any request) ---
+SESSION_TTL_SECONDS = 86400
+OAUTH_STATE_TTL_SECONDS = 600
+# The session token never goes in the URL. The URL carries a one-time restore ticket instead:
+# a fresh websocket session (reload, or routed to another replica) trades it for the session.
+RESTORE_TICKET_TTL_SECONDS = int(os.getenv("RESTORE_TICKET_TTL_SECONDS", "900"))
+RESTORE_TICKET_ROTATE_SECONDS = RESTORE_TICKET_TTL_SECONDS // 3
+oauth_states_col = db.oauth_states
+restore_tickets_col = db.restore_tickets
+
+def create_admin_session(admin: dict) -> str:
+    """Create (or replace) the admin's single session in Mongo and record the login."""
+    session_token = create_session_token()
+    now = datetime.now(timezone.utc)
+    session_data = {
+        "token": session_token,
+        "admin_id": admin["_id"],
+        "username": admin["username"],
+        "created_at": now,
+        "expires_at": now.timestamp() + SESSION_TTL_SECONDS,
+        "expires_on": now + timedelta(seconds=SESSION_TTL_SECONDS)  # TTL index field
+    }
+
+    # Upsert session → only 1 per admin
+    sessions_col.update_one(
+        {"admin_id": admin["_id"]},
+        {"$set": session_data},
+        upsert=True
+    )
+
+    # Update last login + increment login counter
+    admin_col.update_one(
+        {"_id": admin["_id"]},
+        {
+            "$set": {"last_login": now},
+            "$inc": {"login_count": 1}
+        }
+    )
+    audit("auth.login", "admin", admin["_id"], admin=admin.get("username"))
+    record_activity("login", admin=admin.get("username"))
+    return session_token
+
+def create_oauth_state() -> tuple[str, str]:
+    """Store a one-time OAuth state + nonce (a pending login) that any replica can complete."""
+    state = secrets.token_urlsafe(24)
+    nonce = secrets.token_urlsafe(24)
+    now = datetime.now(timezone.utc)
+    oauth_states_col.insert_one({
+        "_id": state,
+        "nonce": nonce,
+        "status": "pending",
+        "created_at": now,
+        "expires_at": now + timedelta(seconds=OAUTH_STATE_TTL_SECONDS)  # TTL index field
+    })
+    return state, nonce
+
+def begin_oauth_callback(state: str) -> dict | None:
+    """
+    Claim the pending login for `state`.
+    Returns the record with status "claimed" (caller does the code exchange), or
+    "complete"/"failed" when an earlier delivery of the same callback already finished it;
+    those records carry no session. Returns None for unknown or expired state (CSRF check failed).
+    """
+    now = datetime.now(timezone.utc)
+    rec = oauth_states_col.find_one_and_update(
+        {"_id": state, "status": "pending", "expires_at": {"$gt": now}},
+        {"$set": {"status": "claimed", "claimed_at": now}},
+        return_document=ReturnDocument.AFTER
+    )
+    if rec:
+        return rec
+
+    # Another rerun/replica is mid-exchange: give it a moment to finish
+    deadline = time.monotonic() + 10
+    rec = oauth_states_col.find_one({"_id": state, "expires_at": {"$gt": now}})
+    while rec and rec["status"] == "claimed" and time.monotonic() < deadline:
+        time.sleep(0.25)
+        rec = oauth_states_col.find_one({"_id": state})
+    if rec and rec["status"] in ("complete", "failed"):
+        return {"_id": rec["_id"], "status": rec["status"]}
+    return None
+
+def finish_oauth_callback(state: str, succeeded: bool):
+    """Record the outcome only; the session stays with the delivery that created it."""
+    oauth_states_col.update_one(
+        {"_id": state},
+        {"$set": {
+            "status": "complete" if succeeded else "failed",
+            "completed_at": datetime.now(timezone.utc)
+        },
+         "$unset": {"nonce": "", "session_token": ""}}
+    )
+
+def _ticket_id(ticket: str) -> str:
+    # only the hash is stored, so reading the collection doesn't yield usable tickets
+    return hashlib.sha256(ticket.encode()).hexdigest()
+
+def issue_restore_ticket(session_token: str) -> str:
+    ticket = secrets.token_urlsafe(24)
+    now = datetime.now(timezone.utc)
+    restore_tickets_col.insert_one({
+        "_id": _ticket_id(ticket),
+        "session_token": session_token,
+        "created_at": now,
+        "expires_at": now + timedelta(seconds=RESTORE_TICKET_TTL_SECONDS)  # TTL index field
+    })
+    return ticket
+
+def redeem_restore_ticket(ticket: str) -> str | None:
+    """Single use: the first session to present the ticket gets the session token, nobody after it."""
+    rec = restore_tickets_col.find_one_and_delete(
+        {"_id": _ticket_id(ticket), "expires_at": {"$gt": datetime.now(timezone.utc)}}
+    )
+    return rec["session_token"] if rec else None
+
+def refresh_restore_ticket(force: bool = False):
+    """Keep a live ticket in the URL; replace it once used and every RESTORE_TICKET_ROTATE_SECONDS."""
+    old = st.session_state.get("restore_ticket")
+    if old and not force and time.time() - st.session_state.get("restore_ticket_issued_at", 0) < RESTORE_TICKET_ROTATE_SECONDS:
+        return
+    if old:
+        restore_tickets_col.delete_one({"_id": _ticket_id(old)})
+    ticket = issue_restore_ticket(st.session_state.session_token)
+    st.session_state.restore_ticket = ticket
+    st.session_state.restore_ticket_issued_at = time.time()
+    st.query_params["rt"] = ticket
+
 def authenticate_admin(username, password):
     """Authenticate admin and create secure session"""
     admin = admin_col.find_one({"username": username, "password": password})
     if admin:
-        # Create a secure session token
-        session_token = create_session_token()
-        session_data = {
-            "token": session_token,
-            "admin_id": admin["_id"],
-            "username": username,
-            "created_at": datetime.now(timezone.utc),
-            "expires_at": datetime.now(timezone.utc).timestamp() + 86400  # 24 hours
-        }
-        
-        # Store session in database
-        sessions_col.update_one(
-            {"admin_id": admin["_id"]},  # find by admin
-            {"$set": session_data},
-            upsert=True
-        )
-        
-        # Update last login + increment login counter
-        admin_col.update_one(
-            {"_id": admin["_id"]},
-            {
-                "$set": {"last_login": datetime.now(timezone.utc)},
-                "$inc": {"login_count": 1}  # 👈 add or increment counter
-            }
-        )
-        
-        return session_token
+        return create_admin_session(admin)
     return None
 
 def validate_session(session_token):
     """Validate session token"""
     if not session_token:
+        METRICS.inc("portal_session_validations_total", result="missing")
         return False
     
     session = sessions_col.find_one({"token": session_token})
     if not session:
+        METRICS.inc("portal_session_validations_total", result="unknown")
         return False
     
     # Check if session has expired
@@ -315,25 +3666,26 @@ def validate_session(session_token):
     if current_time > session["expires_at"]:
         # Clean up expired session
         sessions_col.delete_one({"token": session_token})
+        METRICS.inc("portal_session_validations_total", result="expired")
         return False
     
     # Extend session expiry on valid use
     sessions_col.update_one(
         {"token": session_token},
-        {"$set": {"expires_at": current_time + 86400}}  # Extend by 24 hours
+        {"$set": {
+            "expires_at": current_time + SESSION_TTL_SECONDS,  # Extend by 24 hours
+            "expires_on": datetime.now(timezone.utc) + timedelta(seconds=SESSION_TTL_SECONDS)
+        }}
     )
-    
+    METRICS.inc("portal_session_validations_total", result="valid")
     return session["username"]
 
 def logout_admin(session_token):
     """Logout admin and clean up session"""
     if session_token:
         sessions_col.delete_one({"token": session_token})
-
-def cleanup_expired_sessions():
-    """Clean up expired sessions"""
-    current_time = datetime.now(timezone.utc).timestamp()
-    sessions_col.delete_many({"expires_at": {"$lt": current_time}})
+        restore_tickets_col.delete_many({"session_token": session_token})
+        audit("auth.logout")
 
 def main():
 
@@ -342,9 +3694,16 @@ def main():
         st.session_state["health_thread"] = True
         threading.Thread(target=keep_alive, daemon=True).start()
 
-    # Clean up expired sessions periodically
-    cleanup_expired_sessions()
-    
+    # Change-stream cache invalidation (one watcher per process)
+    start_cache_watcher()
+    ensure_indexes()
+    start_digest_scheduler()
+    start_metrics_exporter()
+    start_metrics_sampler()
+    start_link_checker()
+    start_similarity_indexer()
+    start_snapshot_sync()
+
     # Initialize session state
     if "authenticated" not in st.session_state:
         st.session_state.authenticated = False
@@ -361,185 +3720,19 @@ def main():
     # --- Google OAuth callback handler ---
     params = st.query_params
     if "code" in params and not st.session_state.authenticated:
-        code = params.get("code")
-        returned_state = params.get("state")
-        expected_state = st.session_state.get("oauth_state")
-    
-        # 1) CSRF state check
-        if expected_state and returned_state != expected_state:
-            st.error("OAuth state mismatch. Please try signing in again.")
-            # Clear params to avoid loops
-            st.query_params.clear()
-            st.stop()
-    
-        # 2) Fetch token using 'code' + explicit redirect_uri (no full URL reconstruction)
-        google = get_google_auth(state=expected_state)
-        redirect_uri = os.getenv("OAUTH_REDIRECT_URI")
-    
-        try:
-            token = google.fetch_token(
-                "https://oauth2.googleapis.com/token",
-                code=code,
-                redirect_uri=redirect_uri,                     # MUST exactly match your env & Google Console
-                client_secret=os.getenv("GOOGLE_CLIENT_SECRET"),
-                auth=None                                      # prevent Basic auth header
-            )
-        except Exception as e:
-            # Helpful diagnostics while you adjust URIs; you can remove later
-            st.error(f"OAuthError during token exchange: {e}")
-            st.write("DEBUG redirect_uri:", redirect_uri)
-            st.write("DEBUG code present:", bool(code))
-            st.query_params.clear()
-            st.stop()
-    
-        # 3) Get profile & proceed
-        google = get_google_auth(token=token)
-        resp = google.get("https://www.googleapis.com/oauth2/v2/userinfo")
-        profile = resp.json()
-    
-        email = profile.get("email")
-        name = profile.get("name")
-    
-        admin = admin_col.find_one({"email": email})
-        if admin:
-            session_token = create_session_token()
-            session_data = {
-                "token": session_token,
-                "admin_id": admin["_id"],
-                "username": admin["username"],
-                "created_at": datetime.now(timezone.utc),
-                "expires_at": datetime.now(timezone.utc).timestamp() + 86400
-            }
-    
-            # Keep only 1 session per admin
-            sessions_col.update_one(
-                {"admin_id": admin["_id"]},
-                {"$set": session_data},
-                upsert=True
-            )
-    
-            # Update last_login and increment login_count
-            admin_col.update_one(
-                {"_id": admin["_id"]},
-                {"$set": {"last_login": datetime.now(timezone.utc)}, "$inc": {"login_count": 1}}
-            )
-    
-            st.session_state.authenticated = True
-            st.session_state.admin_username = admin["username"]
-            st.session_state.session_token = session_token
-            st.session_state.admin_role = admin.get("role", "admin")
-            st.session_state.effective_role = st.session_state.admin_role
-
-    
-            st.query_params.clear()
-            st.rerun()
-        else:
-            st.error("Your Google account is not authorized as admin.")
-            st.query_params.clear()
-    
-
-    
-        google = get_google_auth(token=token)
-        resp = google.get("https://www.googleapis.com/oauth2/v2/userinfo")
-        profile = resp.json()
-    
-        email = profile.get("email")
-        name = profile.get("name")
-    
-        # Check if this email is an admin in Mongo
-        admin = admin_col.find_one({"email": email})
-        if admin:
-            session_token = create_session_token()
-            session_data = {
-                "token": session_token,
-                "admin_id": admin["_id"],
-                "username": admin["username"],
-                "created_at": datetime.now(timezone.utc),
-                "expires_at": datetime.now(timezone.utc).timestamp() + 86400  # 24h
-            }
-        
-            # Store session in DB
-            # Upsert session → only 1 per admin
-            sessions_col.update_one(
-                {"admin_id": admin["_id"]},
-                {"$set": session_data},
-                upsert=True
-            )
-            
-            # Update last login + increment login counter
-            admin_col.update_one(
-                {"_id": admin["_id"]},
-                {
-                    "$set": {"last_login": datetime.now(timezone.utc)},
-                    "$inc": {"login_count": 1}
-                }
-            )
-            
-        
-            # Set session state
-            st.session_state.authenticated = True
-            st.session_state.admin_username = admin["username"]
-            st.session_state.session_token = session_token
-        
-            # Clear query params so code doesn’t keep firing
-            st.query_params.clear()
-            st.rerun()
-        else:
-            st.error("Your Google account is not authorized as admin.")
-
-    
-        google = get_google_auth(token=token)
-        resp = google.get("https://www.googleapis.com/oauth2/v2/userinfo")
-        profile = resp.json()
-    
-        email = profile.get("email")
-        name = profile.get("name")
-    
-        # Check if this email is an admin in Mongo
-        admin = admin_col.find_one({"email": email})
-        if admin:
-            session_token = create_session_token()
-            session_data = {
-                "token": session_token,
-                "admin_id": admin["_id"],
-                "username": admin["username"],
-                "created_at": datetime.now(timezone.utc),
-                "expires_at": datetime.now(timezone.utc).timestamp() + 86400  # 24h
-            }
-        
-            # Store session in DB
-            # Upsert session → only 1 per admin
-            sessions_col.update_one(
-                {"admin_id": admin["_id"]},
-                {"$set": session_data},
-                upsert=True
-            )
-            
-            # Update last login + increment login counter
-            admin_col.update_one(
-                {"_id": admin["_id"]},
-                {
-                    "$set": {"last_login": datetime.now(timezone.utc)},
-                    "$inc": {"login_count": 1}
-                }
-            )
-            
-        
-            # Set session state
-            st.session_state.authenticated = True
-            st.session_state.admin_username = admin["username"]
-            st.session_state.session_token = session_token
-        
-            # Clear query params so code doesn’t keep firing
-            st.query_params.clear()
-            st.rerun()
-        else:
-            st.error("Your Google account is not authorized as admin.")
-        
+        handle_oauth_callback(params.get("code"), params.get("state"))
     # --- End OAuth callback handler ---
 
 
     # --- Validate session ---
+    # A fresh websocket session (reload, or routed to another replica) redeems the restore ticket
+    restored = False
+    if not st.session_state.session_token and st.query_params.get("rt"):
+        st.session_state.session_token = redeem_restore_ticket(st.query_params.get("rt"))
+        restored = bool(st.session_state.session_token)
+        if not restored:
+            del st.query_params["rt"]
+
     if st.session_state.session_token:
         username = validate_session(st.session_state.session_token)
         if username:
@@ -548,14 +3741,18 @@ def main():
             cur_admin = get_current_admin()
             if cur_admin:
                 st.session_state.admin_role = cur_admin.get("role", "admin")
-                if "effective_role" not in st.session_state:
+                if restored or "effective_role" not in st.session_state:
                     st.session_state.effective_role = st.session_state.admin_role
+            refresh_restore_ticket()
 
         else:
             # Invalid session, clear state
             st.session_state.authenticated = False
             st.session_state.admin_username = None
             st.session_state.session_token = None
+            st.session_state.pop("restore_ticket", None)
+            if "rt" in st.query_params:
+                del st.query_params["rt"]
     # --- End session validation ---
 
     # --- Show login or dashboard ---
@@ -564,6 +3761,73 @@ def main():
     else:
         admin_dashboard()
 
+def handle_oauth_callback(code: str, returned_state: str | None):
+    """One code exchange per callback; the ID token is verified locally (no userinfo round trip)."""
+    # 1) CSRF state check — the state lives in Mongo, so the login may finish on any replica
+    pending = begin_oauth_callback(returned_state) if returned_state else None
+    if pending is None:
+        st.error("OAuth state mismatch or expired. Please try signing in again.")
+        # Clear params to avoid loops
+        st.query_params.clear()
+        st.stop()
+    if pending["status"] != "claimed":
+        # An earlier delivery of this callback (a rerun, or another replica) already finished it.
+        # Its session is never handed to a second delivery: a replayed URL gets nothing.
+        st.query_params.clear()
+        st.warning("This sign-in link was already used. Please sign in again.")
+        return
+
+    # 2) Exchange the code (explicit redirect_uri, no full URL reconstruction)
+    oidc = get_oidc_keys()
+    google = get_google_auth(state=returned_state)
+    redirect_uri = os.getenv("OAUTH_REDIRECT_URI")
+    try:
+        token = google.fetch_token(
+            oidc.metadata()["token_endpoint"],
+            code=code,
+            redirect_uri=redirect_uri,                     # MUST exactly match your env & Google Console
+            client_secret=os.getenv("GOOGLE_CLIENT_SECRET"),
+            auth=None                                      # prevent Basic auth header
+        )
+    except Exception as e:
+        finish_oauth_callback(returned_state, False)
+        st.error(f"OAuthError during token exchange: {e}")
+        st.write("DEBUG redirect_uri:", redirect_uri)
+        st.write("DEBUG code present:", bool(code))
+        st.query_params.clear()
+        st.stop()
+
+    # 3) Verify the ID token against cached signing keys
+    try:
+        claims = oidc.verify_id_token(token.get("id_token", ""), os.getenv("GOOGLE_CLIENT_ID"), pending["nonce"])
+    except Exception as e:
+        finish_oauth_callback(returned_state, False)
+        st.error(f"Could not verify Google sign-in: {e}")
+        st.query_params.clear()
+        st.stop()
+
+    email = claims.get("email") if claims.get("email_verified") else None
+    admin = admin_col.find_one({"email": email}) if email else None
+    if not admin:
+        finish_oauth_callback(returned_state, False)
+        st.error("Your Google account is not authorized as admin.")
+        st.query_params.clear()
+        st.stop()
+
+    session_token = create_admin_session(admin)
+    finish_oauth_callback(returned_state, True)
+
+    st.session_state.authenticated = True
+    st.session_state.admin_username = admin["username"]
+    st.session_state.session_token = session_token
+    st.session_state.admin_role = admin.get("role", "admin")
+    st.session_state.effective_role = st.session_state.admin_role
+
+    # Only a one-time restore ticket goes in the URL, so a reload (on any replica) can log back in
+    st.query_params.clear()
+    refresh_restore_ticket(force=True)
+    st.rerun()
+
 def login_page():
     st.title("🚀 Innoverse Admin Portal")
     st.markdown("---")
@@ -574,15 +3838,26 @@ def login_page():
         st.subheader("Admin Login")
 
         # Google login only
+        # The state/nonce pair is stored in Mongo (TTL); re-issue it before it expires
+        issued_at = st.session_state.get("oauth_state_issued_at", 0)
+        if "oauth_state" not in st.session_state or time.time() - issued_at > OAUTH_STATE_TTL_SECONDS / 2:
+            state, nonce = create_oauth_state()
+            st.session_state["oauth_state"] = state
+            st.session_state["oauth_nonce"] = nonce
+            st.session_state["oauth_state_issued_at"] = time.time()
+
         google_auth = get_google_auth()
-        authorization_url, state = google_auth.create_authorization_url(
-            "https://accounts.google.com/o/oauth2/v2/auth"
+        try:
+            auth_endpoint = get_oidc_keys().metadata()["authorization_endpoint"]
+        except Exception as e:
+            st.error(f"Google sign-in is unavailable right now: {e}")
+            return
+        authorization_url, _ = google_auth.create_authorization_url(
+            auth_endpoint,
+            state=st.session_state["oauth_state"],
+            nonce=st.session_state["oauth_nonce"]
         )
         
-        # Save state in session
-        if "oauth_state" not in st.session_state:
-            st.session_state["oauth_state"] = state
-        
         # Login button (stays in same tab)
         st.markdown(
             f'<a href="{authorization_url}" target="_self">'
@@ -592,6 +3867,110 @@ def login_page():
             unsafe_allow_html=True
         )
       
+NAV_PAGES = ["📊 Dashboard", "👥 Users", "🧭 User Timeline", "📝 Tasks", "📄 Submissions", "💬 Forums", "📈 Analytics", "🗄️ Archive"]
+
+# --- On-demand rerun profiler (superadmin) ---
+perf_profiles_col = db.perf_profiles
+PERF_TOP_FUNCTIONS = 40
+PERF_TOP_ALLOCATIONS = 25
+PERF_RETENTION_DAYS = 14
+
+@st.cache_resource
+def get_profile_lock() -> threading.Lock:
+    """tracemalloc and its peak are process-global: one profiled rerun per process at a time."""
+    return threading.Lock()
+
+# the script body reruns per session, so the lock has to come from the process-wide cache
+_profile_lock = get_profile_lock()
+
+def _peak_label(profile: dict) -> str:
+    return f"{profile['peak_kb']} KB" if profile.get("peak_kb") is not None else "memory n/a"
+
+def flash(message: str, icon: str = "✅"):
+    """Queue a toast for the next rerun; anything shown right before st.rerun() never renders."""
+    st.session_state.setdefault("flash_messages", []).append((message, icon))
+
+def render_page(page: str):
+    """Run the selected page; only wrapped in the profiler while a superadmin has armed it."""
+    for message, icon in st.session_state.pop("flash_messages", []):
+        st.toast(message, icon=icon)
+    armed = st.session_state.get("perf_profile")
+    with METRICS.timer("portal_page_render_seconds", page=page):
+        if armed and armed["page"] == page:
+            profile_page_run(page, armed)
+        else:
+            dispatch_page(page)
+
+def profile_page_run(page: str, armed: dict):
+    """
+    One rerun under cProfile + tracemalloc; results go to perf_profiles.
+    tracemalloc is process-wide, so one profiled run at a time: another session's armed
+    rerun runs unprofiled meanwhile and keeps its remaining count.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        st.toast("Another session is being profiled; this rerun was not profiled.", icon="⏱️")
+        dispatch_page(page)
+        return
+    try:
+        _profile_locked(page, armed)
+    finally:
+        _profile_lock.release()
+
+def _profile_locked(page: str, armed: dict):
+    # Tracing started outside the profiler (PYTHONTRACEMALLOC, a debugger) isn't ours to
+    # reset or stop: the run keeps its timings and records memory as unavailable.
+    owns_tracing = not tracemalloc.is_tracing()
+    if owns_tracing:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        mem_before, _ = tracemalloc.get_traced_memory()
+    prof = cProfile.Profile()
+    started_at = datetime.now(timezone.utc)
+    t0 = time.perf_counter()
+    prof.enable()
+    try:
+        dispatch_page(page)   # st.rerun()/st.stop() raise through here; the finally still records
+    finally:
+        prof.disable()
+        wall_ms = (time.perf_counter() - t0) * 1000
+        peak_kb, allocations = None, []
+        if owns_tracing:
+            _, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            ])
+            tracemalloc.stop()
+            peak_kb = round((peak - mem_before) / 1024, 1)
+            allocations = snapshot.statistics("lineno")[:PERF_TOP_ALLOCATIONS]
+
+        stats = pstats.Stats(prof).stats
+        top_funcs = sorted(stats.items(), key=lambda kv: kv[1][3], reverse=True)[:PERF_TOP_FUNCTIONS]
+        perf_profiles_col.insert_one({
+            "page": page,
+            "batch": armed["batch"],
+            "run": armed["total"] - armed["remaining"] + 1,
+            "admin": st.session_state.get("admin_username"),
+            "created_at": started_at,
+            "wall_ms": round(wall_ms, 1),
+            "peak_kb": peak_kb,
+            "memory": "traced" if owns_tracing else "unavailable",
+            "functions": [{
+                "function": f"{func} ({os.path.basename(file)}:{line})",
+                "calls": nc,
+                "tottime_ms": round(tt * 1000, 2),
+                "cumtime_ms": round(ct * 1000, 2),
+            } for (file, line, func), (cc, nc, tt, ct, _callers) in top_funcs],
+            "allocations": [{
+                "site": f"{os.path.basename(s.traceback[0].filename)}:{s.traceback[0].lineno}",
+                "size_kb": round(s.size / 1024, 1),
+                "count": s.count,
+            } for s in allocations],
+        })
+        armed["remaining"] -= 1
+        if armed["remaining"] <= 0:
+            del st.session_state["perf_profile"]
+
 def admin_dashboard():
     st.title("🚀 Innoverse Admin Dashboard")
     
@@ -622,24 +4001,28 @@ def admin_dashboard():
     
         # Redirect back to login page cleanly
         st.success("You have been logged out.")
-        st.experimental_set_query_params()  # clear any query params
+        st.query_params.clear()  # clear any query params (including the restore ticket)
         st.rerun()
     
     
     st.sidebar.markdown("---")
     
-    pages = ["📊 Dashboard", "👥 Users", "📝 Tasks", "📄 Submissions", "💬 Forums", "📈 Analytics"]
+    pages = list(NAV_PAGES)
     if is_superadmin_session():
         pages.insert(1, "🛡️ Superadmin")  # show extra page only if in superadmin mode
 
     page = st.sidebar.selectbox("Navigate to:", pages)
+    render_page(page)
 
+def dispatch_page(page: str):
     if page == "🛡️ Superadmin":
         superadmin_page()
     elif page == "📊 Dashboard":
         dashboard_overview()
     elif page == "👥 Users":
         users_management()
+    elif page == "🧭 User Timeline":
+        user_timeline_page()
     elif page == "📝 Tasks":
         tasks_management()
     elif page == "📄 Submissions":
@@ -648,16 +4031,19 @@ def admin_dashboard():
         forums_management()
     elif page == "📈 Analytics":
         analytics_page()
+    elif page == "🗄️ Archive":
+        archive_page()
 
 
+@uses_profile("analytics")
 def dashboard_overview():
     st.header("📊 Dashboard Overview")
     
     # Key metrics
-    total_users = users_col.count_documents({})
-    total_tasks = tasks_col.count_documents({})
-    total_submissions = submissions_col.count_documents({})
-    total_forums = forums_col.count_documents({})
+    total_users = cached_count("users")
+    total_tasks = cached_count("tasks")
+    total_submissions = cached_count("submissions")
+    total_forums = cached_count("forums")
     
     col1, col2, col3, col4 = st.columns(4)
     
@@ -677,26 +4063,91 @@ def dashboard_overview():
     
     with col1:
         st.subheader("Recent Users")
-        recent_users = list(users_col.find({}).sort("created_at", -1).limit(5))
+        recent_users = cached_find(
+            "users", {}, {"name": 1, "profile.coding_track": 1},
+            sort=[("created_at", -1)], limit=5,
+            keys=["users.name", "users.profile", "users.created_at"]
+        )
         for user in recent_users:
             track_name = TRACKS.get(user.get('profile', {}).get('coding_track', ''), 'No track')
             st.write(f"• {user['name']} - {track_name}")
     
     with col2:
         st.subheader("Recent Submissions")
-        recent_submissions = list(submissions_col.find({}).sort("submitted_at", -1).limit(5))
+        recent_submissions = cached_find(
+            "submissions", {}, {"user_id": 1, "task_id": 1, "status": 1},
+            sort=[("submitted_at", -1)], limit=5,
+            keys=["submissions.status", "submissions.submitted_at"]
+        )
         for sub in recent_submissions:
-            user = users_col.find_one({"_id": sub["user_id"]})
-            task = tasks_col.find_one({"_id": sub["task_id"]})
+            user = cached_find_one("users", sub["user_id"], {"name": 1})
+            task = cached_find_one("tasks", sub["task_id"], {"title": 1})
             st.write(f"• {user['name'] if user else 'Unknown'} - {task['title'] if task else 'Unknown Task'} - {sub['status']}")
 
+    st.markdown("---")
+
+    # Leaderboard
+    st.subheader("🏆 Leaderboard")
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        lb_track = st.selectbox("Leaderboard", ["overall"] + list(TRACKS.keys()),
+                                format_func=lambda x: "Overall" if x == "overall" else TRACKS[x],
+                                key="dash_lb_track")
+        lb_track = None if lb_track == "overall" else lb_track
+        rows = get_leaderboard(lb_track)
+        if rows:
+            st.dataframe(pd.DataFrame(rows).drop(columns=["user_id"]), use_container_width=True, hide_index=True)
+        else:
+            st.info("No users with points yet.")
+    with col2:
+        user_rank_lookup(lb_track)
+
+@st.fragment
+@uses_profile("analytics")
+def user_rank_lookup(lb_track: str | None):
+    """Rank lookup box; typing an email reruns only this fragment."""
+    lookup_email = st.text_input("Find a user's rank (email)", key="dash_rank_email")
+    if lookup_email:
+        u = users_col.find_one({"email": lookup_email.strip()}, {"name": 1})
+        if not u:
+            st.info("No user with that email.")
+        else:
+            ranked = get_user_rank(u["_id"], lb_track)
+            if ranked:
+                rank, pts = ranked
+                scope_name = TRACKS[lb_track] if lb_track else "overall"
+                st.metric(f"{u.get('name', '')} · {scope_name}", f"#{rank}", f"{pts} pts", delta_color="off")
+
+
+# Users grid: only the displayed columns, sorted/paged server-side
+USER_GRID_PAGE_SIZES = [25, 50, 100, 200]
+USER_GRID_PROJECTION = {
+    "name": 1, "email": 1, "profile.coding_track": 1, "stats.points": 1,
+    "stats.tasks_completed": 1, "is_active": 1, "created_at": 1,
+}
+
+
+class UserGridRow(RowView):
+    __slots__ = FIELDS = ("_id", "name", "email", "profile", "stats", "is_active", "created_at")
+    PROJECTION = USER_GRID_PROJECTION
+
+
+USER_GRID_SORTS = {
+    "Newest": [("created_at", -1), ("_id", -1)],
+    "Oldest": [("created_at", 1), ("_id", 1)],
+    "Name (A–Z)": [("name", 1), ("_id", 1)],
+    "Points (high → low)": [("stats.points", -1), ("_id", 1)],
+    "Tasks completed": [("stats.tasks_completed", -1), ("_id", 1)],
+}
+
+@uses_profile("interactive")   # admins expect their own edits in the grid right away
 def users_management():
     st.header("👥 Users Management")
     
     # User statistics by track
     track_stats = {}
     for track_id, track_name in TRACKS.items():
-        count = users_col.count_documents({"profile.coding_track": track_id})
+        count = cached_count("users", {"profile.coding_track": track_id}, keys=["users.profile"])
         track_stats[track_name] = count
     
     col1, col2 = st.columns(2)
@@ -723,6 +4174,8 @@ def users_management():
         track_filter = st.selectbox("Filter by Track", ["All"] + list(TRACKS.values()))
     with col2:
         status_filter = st.selectbox("Filter by Status", ["All", "Active", "Inactive"])
+    with col3:
+        sort_label = st.selectbox("Sort by", list(USER_GRID_SORTS.keys()), key="user_grid_sort")
     
     # Build query
     query = {}
@@ -734,26 +4187,506 @@ def users_management():
     elif status_filter == "Inactive":
         query["is_active"] = False
     
-    users = list(users_col.find(query).sort("created_at", -1))
-    
-    if users:
-        users_data = []
-        for user in users:
-            users_data.append({
-                "Name": user["name"],
-                "Email": user["email"],
-                "Track": TRACKS.get(user.get("profile", {}).get("coding_track", ""), "Unknown"),
-                "Points": user.get("stats", {}).get("points", 0),
-                "Tasks Completed": user.get("stats", {}).get("tasks_completed", 0),
-                "Status": "Active" if user.get("is_active", True) else "Inactive",
-                "Join Date": user["created_at"].strftime("%Y-%m-%d") if user.get("created_at") and hasattr(user["created_at"], 'strftime') else "Unknown"
-            })
-        
-        df = pd.DataFrame(users_data)
-        st.dataframe(df, use_container_width=True)
-    else:
+
+    total = cached_count("users", query, keys=["users/*", "users.profile", "users.is_active"])
+    if not total:
         st.info("No users found matching the criteria.")
+        return
+
+    col1, col2, _ = st.columns([1, 1, 2])
+    with col1:
+        page_size = st.selectbox("Rows per page", USER_GRID_PAGE_SIZES, index=1, key="user_grid_page_size")
+    pages = max(1, -(-total // page_size))
+    with col2:
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1,
+                               key="user_grid_page")
+
+    # Filter, sort and slice in Mongo; only the displayed fields come back
+    rows = find_rows("users", UserGridRow, query, sort=USER_GRID_SORTS[sort_label],
+                     skip=(page - 1) * page_size, limit=page_size)
+
+    users_data = []
+    for user in rows:
+        users_data.append({
+            "Name": user.get("name", ""),
+            "Email": user.get("email", ""),
+            "Track": TRACKS.get(user.get("profile", {}).get("coding_track", ""), "Unknown"),
+            "Points": user.get("stats", {}).get("points", 0),
+            "Tasks Completed": user.get("stats", {}).get("tasks_completed", 0),
+            "Status": "Active" if user.get("is_active", True) else "Inactive",
+            "Join Date": user["created_at"].strftime("%Y-%m-%d") if user.get("created_at") and hasattr(user["created_at"], 'strftime') else "Unknown"
+        })
+
+    df = pd.DataFrame(users_data)
+    st.dataframe(df, use_container_width=True, hide_index=True)
+    first = (page - 1) * page_size + 1
+    st.caption(f"Showing {first}–{first + len(users_data) - 1} of {total} users")
+
+TIMELINE_ICONS = {"assignment": "📌", "submission": "📤", "comment": "💬", "email": "📧"}
+TIMELINE_STATUS_ICONS = {"pending": "⏳", "approved": "✅", "rejected": "❌", "sent": "✅", "failed": "⚠️"}
+
+
+def _render_timeline_item(item: dict):
+    doc, source = item["doc"], item["source"]
+    when = item["ts"].strftime("%Y-%m-%d %H:%M")
+    task = cached_find_one("tasks", doc["task_id"], {"title": 1}) if doc.get("task_id") else None
+    task_title = task["title"] if task else "Unknown task"
+    icon = TIMELINE_ICONS[source]
+    if source == "assignment":
+        st.markdown(f"{icon} `{when}` Assigned **{task_title}** by {doc.get('assigned_by', '—')}"
+                    + (f" · _{doc['note']}_" if doc.get("note") else ""))
+    elif source == "submission":
+        status = doc.get("status", "")
+        st.markdown(f"{icon} `{when}` Submitted **{task_title}** · "
+                    f"{TIMELINE_STATUS_ICONS.get(status, '')} {status} · {as_points(doc.get('points'))} pts")
+        history = doc.get("status_history") or []
+        if history or doc.get("submission_url"):
+            with st.expander("Details"):
+                if doc.get("submission_url"):
+                    st.write(f"**URL:** {doc['submission_url']}")
+                for h in history:
+                    at = h.get("at")
+                    at_str = at.strftime("%Y-%m-%d %H:%M") if hasattr(at, "strftime") else "—"
+                    st.write(f"`{at_str}` {h.get('from')} → **{h.get('to')}** by {h.get('by', '—')}")
+    elif source == "comment":
+        forum = cached_find_one("forums", doc.get("forum_id"), {"title": 1})
+        st.markdown(f"{icon} `{when}` Commented in **{forum['title'] if forum else 'a forum'}**: "
+                    f"{(doc.get('content') or '')[:160]}")
+    else:
+        status = doc.get("status", "")
+        st.markdown(f"{icon} `{when}` Email ({doc.get('kind', 'email')}) **{doc.get('subject', '')}** · "
+                    f"{TIMELINE_STATUS_ICONS.get(status, '')} {status}"
+                    + (f" · {doc['error']}" if doc.get("error") else ""))
+
+
+@uses_profile("analytics")
+def user_timeline_page():
+    st.header("🧭 User Timeline")
+
+    q = st.text_input("Find a student by email or name", key="timeline_search",
+                      placeholder="Start of an email address, or a name")
+    if not q.strip():
+        st.info("Search for a student to see everything they have done, newest first.")
+        return
+    prefix = "^" + re.escape(q.strip())
+    # email prefix uses the email index; name prefix uses users_name
+    matches = list(users_col.find({"$or": [{"email": {"$regex": prefix}}, {"name": {"$regex": prefix}}]},
+                                  {"name": 1, "email": 1, "profile.coding_track": 1, "stats": 1})
+                   .sort("name", 1).limit(20))
+    if not matches:
+        st.info("No matching users.")
+        return
+    by_id = {m["_id"]: m for m in matches}
+    user_id = st.selectbox("Student", list(by_id), key="timeline_user",
+                           format_func=lambda i: f"{by_id[i].get('name', '')} ({by_id[i].get('email', '')})")
+    user = by_id[user_id]
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Track", TRACKS.get(user.get("profile", {}).get("coding_track", ""), "Unknown"))
+    with col2:
+        st.metric("Points", _user_points(user))
+    with col3:
+        st.metric("Tasks completed", user.get("stats", {}).get("tasks_completed", 0))
+
+    # keyset pages: a stack of "before" cursors, reset when another student is picked
+    state = st.session_state
+    if state.get("timeline_for") != user_id:
+        state.timeline_for = user_id
+        state.timeline_cursors = [None]
+    items, next_before = get_user_timeline(user, state.timeline_cursors[-1])
+    if not items:
+        st.info("No activity recorded for this student.")
+    for item in items:
+        _render_timeline_item(item)
+
+    col1, col2, _ = st.columns([1, 1, 3])
+    with col1:
+        if len(state.timeline_cursors) > 1 and st.button("← Newer", use_container_width=True):
+            state.timeline_cursors.pop()
+            st.rerun()
+    with col2:
+        if next_before and st.button("Older →", use_container_width=True):
+            state.timeline_cursors.append(next_before)
+            st.rerun()
+    st.caption(f"Page {len(state.timeline_cursors)} · {TIMELINE_PAGE_SIZE} events per page")
+
+@st.fragment
+@uses_profile("interactive")
+def assign_task_panel():
+    """User search + assignment forms; typing in the search boxes reruns only this fragment."""
+    st.subheader("Select Assignment Type")
+    assignment_type = st.radio("Choose assignment type:", 
+                               ["Assign Existing Task", "Create Custom Task"], 
+                               horizontal=True)
+    if assignment_type == "Assign Existing Task":
+        all_users = cached_find("users", {}, {"_id": 1, "name": 1, "email": 1}, keys=["users.name", "users.email"])
+        st.subheader("🔍 Find User")
+        search_query = st.text_input("Search users by name or email", key="user_search_existing_outside")
+        filtered_users = []
+        if search_query:
+            filtered_users = [
+                user for user in all_users 
+                if search_query.lower() in user['name'].lower() or search_query.lower() in user['email'].lower()
+            ]
+            if filtered_users:
+                st.write(f"**Found {len(filtered_users)} matching users:**")
+                for user in filtered_users[:5]:
+                    st.write(f"• **{user['name']}** - {user['email']}")
+            else:
+                st.write("No users found matching your search.")
+        st.markdown("---")
+        with st.form("assign_existing_task"):
+            col1, col2 = st.columns(2)
+            with col1:
+                active_tasks = cached_find("tasks", {"is_active": True})
+                if active_tasks:
+                    task_options = {str(task["_id"]): f"{task['title']} ({TRACKS.get(task.get('track', ''), task.get('track', 'Unknown'))})" for task in active_tasks}
+                    selected_task_id = st.selectbox("Select Task", options=list(task_options.keys()), 
+                                                    format_func=lambda x: task_options[x])
+                else:
+                    st.warning("No active tasks available")
+                    selected_task_id = None
+            with col2:
+                st.write("**Select User:**")
+                display_users = filtered_users if search_query and filtered_users else all_users[:20]
+                if display_users:
+                    user_options = {str(user["_id"]): f"{user['name']} ({user['email']})" for user in display_users}
+                    selected_user_id = st.selectbox(f"Available Users ({len(display_users)})", 
+                                                    options=list(user_options.keys()), 
+                                                    format_func=lambda x: user_options[x],
+                                                    key="user_select_existing")
+                else:
+                    st.warning("No users available")
+                    selected_user_id = None
+            assignment_note = st.text_area("Assignment Note (optional)", 
+                                           placeholder="Add any specific instructions for this user...",
+                                           key="note_existing")
+            submit_existing = st.form_submit_button("Assign Existing Task", use_container_width=True)
+            if submit_existing:
+                if selected_task_id and selected_user_id and active_tasks:
+                    existing_assignment = db.task_assignments.find_one({
+                        "task_id": ObjectId(selected_task_id),
+                        "user_id": ObjectId(selected_user_id)
+                    })
+                    if not existing_assignment:
+                        assignment_data = {
+                            "task_id": ObjectId(selected_task_id),
+                            "user_id": ObjectId(selected_user_id),
+                            "assigned_by": st.session_state.admin_username,
+                            "assigned_at": datetime.now(timezone.utc),
+                            "note": assignment_note,
+                            "status": "assigned",
+                            "assignment_type": "existing"
+                        }
+                        res = db.task_assignments.insert_one(assignment_data)
+                        note_write("task_assignments", res.inserted_id)
+                        audit("task.assign", "task", ObjectId(selected_task_id), user_id=ObjectId(selected_user_id))
+                        record_activity("assignment", tags={"type": "existing"},
+                                        task_id=ObjectId(selected_task_id), user_id=ObjectId(selected_user_id))
+                        task_title = [task['title'] for task in active_tasks if str(task['_id']) == selected_task_id][0]
+                        user_name = user_options[selected_user_id]
+                        st.success(f"Task '{task_title}' assigned to {user_name} successfully!")
+                        st.rerun()
+                    else:
+                        st.error("This task is already assigned to this user!")
+                else:
+                    st.error("Please select both a task and a user!")
+    else:
+        all_users = cached_find("users", {}, {"_id": 1, "name": 1, "email": 1}, keys=["users.name", "users.email"])
+        st.subheader("🔍 Find User")
+        search_query_custom = st.text_input("Search users by name or email", key="user_search_custom_outside")
+        filtered_users_custom = []
+        if search_query_custom:
+            filtered_users_custom = [
+                user for user in all_users 
+                if search_query_custom.lower() in user['name'].lower() or search_query_custom.lower() in user['email'].lower()
+            ]
+            if filtered_users_custom:
+                st.write(f"**Found {len(filtered_users_custom)} matching users:**")
+                for user in filtered_users_custom[:5]:
+                    st.write(f"• **{user['name']}** - {user['email']}")
+            else:
+                st.write("No users found matching your search.")
+        st.markdown("---")
+        with st.form("assign_custom_task"):
+            st.subheader("Create & Assign Custom Task")
+            col1, col2 = st.columns(2)
+            with col1:
+                custom_title = st.text_input("Custom Task Title")
+                custom_track = st.selectbox("Track", ["ai", "webdev", "dsa", "app"], 
+                                            format_func=lambda x: TRACKS[x], key="custom_track")
+                custom_difficulty = st.selectbox("Difficulty", ["beginner", "intermediate", "advanced"], 
+                                                 key="custom_difficulty")
+                custom_points = st.number_input("Points", min_value=1, value=100, key="custom_points")
+                custom_due_date = st.date_input("Due Date", key="custom_due_date")
+            with col2:
+                st.write("**Select User:**")
+                display_users_custom = filtered_users_custom if search_query_custom and filtered_users_custom else all_users[:20]
+                if display_users_custom:
+                    user_options_custom = {str(user["_id"]): f"{user['name']} ({user['email']})" for user in display_users_custom}
+                    selected_user_id_custom = st.selectbox(f"Available Users ({len(display_users_custom)})", 
+                                                           options=list(user_options_custom.keys()), 
+                                                           format_func=lambda x: user_options_custom[x],
+                                                           key="user_select_custom")
+                else:
+                    st.warning("No users available")
+                    selected_user_id_custom = None
+            custom_description = st.text_area("Task Description", key="custom_description")
+            custom_requirements = st.text_area("Requirements (one per line)", key="custom_requirements")
+            assignment_note_custom = st.text_area("Assignment Note (optional)", 
+                                                  placeholder="Add any specific instructions for this user...",
+                                                  key="note_custom")
+            submit_custom = st.form_submit_button("Create & Assign Custom Task", use_container_width=True)
+            if submit_custom:
+                if custom_title and custom_description and selected_user_id_custom:
+                    req_list = [req.strip() for req in custom_requirements.split('\n') if req.strip()]
+                    custom_task_data = {
+                        "title": custom_title,
+                        "description": custom_description,
+                        "due_date": datetime.combine(custom_due_date, datetime.min.time()).replace(tzinfo=timezone.utc),
+                        "points": custom_points,
+                        "is_active": True,
+                        "team_id": None,
+                        "type": "individual",
+                        "difficulty": custom_difficulty,
+                        "track": custom_track,
+                        "requirements": req_list,
+                        "created_by": st.session_state.admin_username,
+                        "created_at": datetime.now(timezone.utc),
+                        "updated_at": datetime.now(timezone.utc),
+                        "is_custom": True,
+                        "assigned_to": ObjectId(selected_user_id_custom)
+                    }
+                    custom_task_result = tasks_col.insert_one(custom_task_data)
+                    custom_task_id = custom_task_result.inserted_id
+                    note_write("tasks", custom_task_id)
+                    assignment_data = {
+                        "task_id": custom_task_id,
+                        "user_id": ObjectId(selected_user_id_custom),
+                        "assigned_by": st.session_state.admin_username,
+                        "assigned_at": datetime.now(timezone.utc),
+                        "note": assignment_note_custom,
+                        "status": "assigned",
+                        "assignment_type": "custom"
+                    }
+                    res = db.task_assignments.insert_one(assignment_data)
+                    note_write("task_assignments", res.inserted_id)
+                    audit("task.create_custom", "task", custom_task_id, user_id=ObjectId(selected_user_id_custom),
+                          title=custom_title)
+                    record_activity("task.create", tags={"type": "custom"}, task_id=custom_task_id)
+                    record_activity("assignment", tags={"type": "custom"},
+                                    task_id=custom_task_id, user_id=ObjectId(selected_user_id_custom))
+                    user_name = user_options_custom[selected_user_id_custom]
+                    st.success(f"Custom task '{custom_title}' created and assigned to {user_name} successfully!")
+                    st.rerun()
+                else:
+                    st.error("Please fill in all required fields and select a user!")
+
+@st.fragment
+@uses_profile("interactive")
+def task_email_panel(task: dict):
+    """Per-task email panel; its widgets rerun only this fragment."""
+    # ---------- 📧 Email Users About This Task ----------
+    st.markdown("---")
+    st.subheader("📧 Email users about this task")
+
+    # Fail-fast if email env is not configured
+    try:
+        _ = get_sender_identity()
+    except Exception as e:
+        st.error(f"Email sending not configured: {e}")
+        return
+
+    tid = str(task["_id"])
+
+    # NEW: add "track" and "single_user" scopes
+    scope = st.radio(
+        "Recipients",
+        options=["all", "assigned", "track", "single_user"],
+        format_func=lambda v: (
+            "All users (system-wide)" if v == "all" else
+            "Only users assigned to this task" if v == "assigned" else
+            "Users in a specific track" if v == "track" else
+            "Search and send to one user"
+        ),
+        horizontal=True,
+        key=f"scope_{tid}"
+    )
+
+    # Template & preview
+    template_key = st.selectbox(
+        "Template",
+        options=["new_update", "reminder", "time_finished"],
+        format_func=lambda k: {
+            "new_update": "New Task Update",
+            "reminder": "Reminder of Task",
+            "time_finished": "Task Time Finished"
+        }[k],
+        key=f"tmpl_{tid}"
+    )
+    default_subject, default_html = render_task_email(template_key, task, None)
+    subject_input = st.text_input("Subject", value=default_subject, key=f"subj_{tid}")
+    st.markdown("**Preview (HTML):**")
+    st.markdown(default_html, unsafe_allow_html=True)
+
+    # Build recipient list per scope
+    recipient_emails = []
+    recipient_users = []
+    track_key_selected = None
+
+    if scope in ["all", "assigned"]:
+        recips_preview = gather_recipients_for_task(task["_id"], scope)
+        if not recips_preview:
+            st.warning("No recipients found for this scope.")
+        else:
+            recipient_users = [u for u in recips_preview if u.get("email")]
+            recipient_emails = [u["email"] for u in recipient_users]
+            st.caption(f"About to email **{len(recipient_emails)}** user(s).")
+
+    elif scope == "track":
+        track_key_selected = st.selectbox(
+            "Select track",
+            list(TRACKS.keys()),
+            format_func=lambda x: TRACKS[x],
+            key=f"email_track_{tid}"
+        )
+        if track_key_selected:
+            users_in_track = gather_recipients_for_task(task["_id"], "track", track=track_key_selected)
+            if not users_in_track:
+                st.warning(f"No users found in track: {TRACKS.get(track_key_selected, track_key_selected)}")
+            else:
+                recipient_users = users_in_track
+                recipient_emails = [u["email"] for u in users_in_track]
+                st.caption(
+                    f"Track **{TRACKS.get(track_key_selected, track_key_selected)}** → "
+                    f"**{len(recipient_emails)}** user(s)."
+                )
+
+    elif scope == "single_user":
+        search_query_one = st.text_input("🔍 Search user by name or email", key=f"user_search_{tid}")
+        if search_query_one:
+            matches = list(users_col.find({
+                "$or": [
+                    {"name": {"$regex": search_query_one, "$options": "i"}},
+                    {"email": {"$regex": search_query_one, "$options": "i"}}
+                ]
+            }).limit(5))
+            if matches:
+                user_options = {str(u["_id"]): f"{u['name']} ({u['email']})" for u in matches}
+                selected_uid = st.selectbox(
+                    "Select User",
+                    options=list(user_options.keys()),
+                    format_func=lambda x: user_options[x],
+                    key=f"user_sel_{tid}"
+                )
+                if selected_uid:
+                    udoc = users_col.find_one({"_id": ObjectId(selected_uid)}, {"name": 1, "email": 1})
+                    if udoc and udoc.get("email"):
+                        recipient_users = [udoc]
+                        recipient_emails = [udoc["email"]]
+                        st.caption(f"Will send to: **{udoc['name']}** ({udoc['email']})")
+            else:
+                st.info("No matching users found.")
+
+    # Buttons
+    c1, c2, _ = st.columns([1, 1, 2])
+    cur_admin = get_current_admin()
+    admin_email = (cur_admin or {}).get("email")
+
+    with c1:
+        if admin_email and st.button("Send test to me", key=f"send_test_{tid}"):
+            try:
+                from_addr, from_name = get_sender_identity()
+                msg = _build_email(subject_input, default_html, admin_email, from_addr, from_name)
+                send_email_smtp(msg, kind="test", task_id=task["_id"])
+                st.success(f"Sent test email to {admin_email}")
+            except Exception as e:
+                st.error(f"Failed to send test: {e}")
+
+    with c2:
+        if recipient_emails:
+            timing = st.radio(
+                "Timing",
+                options=["immediate", *DIGEST_PERIODS],
+                format_func=lambda v: "Send now" if v == "immediate" else DIGEST_PERIODS[v],
+                horizontal=True,
+                key=f"timing_{tid}"
+            )
+        if recipient_emails and timing != "immediate":
+            due_at = digest_due_at(timing)
+            st.caption(f"Queued for each user's {timing} digest, sent {due_at:%Y-%m-%d %H:%M} UTC "
+                       f"together with their other pending updates.")
+            confirm = st.checkbox("Confirm queue", key=f"confirm_digest_{tid}")
+            if confirm and st.button("Queue for digest", key=f"queue_digest_{tid}"):
+                queued = queue_digest_items(task, template_key, recipient_users, timing, subject_input)
+                audit("task.email_digest", "task", task["_id"], scope=scope, period=timing,
+                      template=template_key, queued=queued)
+                record_activity("email.campaign", tags={"delivery": timing}, count=queued,
+                                task_id=task["_id"], scope=scope)
+                st.success(f"Queued {queued} digest item(s).")
+        elif recipient_emails:
+            delivery = st.radio(
+                "Delivery",
+                options=["batched", "personalized"],
+                index=0 if scope in ("track", "single_user") else 1,
+                format_func=lambda v: (
+                    f"Batched — one message, BCC chunks of {SMTP_BCC_CHUNK}" if v == "batched"
+                    else "Personalized — one email per user"
+                ),
+                key=f"delivery_{tid}"
+            )
+            confirm = st.checkbox("Confirm send", key=f"confirm_{tid}")
+            if confirm and st.button("Send to recipients", key=f"send_all_{tid}"):
+                prog = st.progress(0.0)
+                status_txt = st.empty()
+
+                def _cb(i, total):
+                    frac = (i / total) if total else 0
+                    prog.progress(frac)
+                    status_txt.write(f"Sending… {i}/{total}")
+
+                if delivery == "batched":
+                    # Same body for everyone: build MIME once, deliver in RCPT chunks
+                    sent, failed, fails = send_batched_email(
+                        subject_input, default_html, recipient_emails, progress_cb=_cb, task_id=task["_id"]
+                    )
+                elif scope in ("all", "assigned"):
+                    sent, failed, fails = send_bulk_emails_for_task(
+                        task, template_key, scope, progress_cb=_cb, override_subject=subject_input
+                    )
+                else:
+                    sent, failed, fails = 0, 0, []
+                    from_addr, from_name = get_sender_identity()
+                    total = len(recipient_emails)
+                    with PooledSMTP(get_sender_pool(), reserve_ahead=SENDER_RESERVE_CHUNK) as smtp:
+                        for idx, to in enumerate(recipient_emails, start=1):
+                            try:
+                                msg = _build_email(subject_input, default_html, to, from_addr, from_name)
+                                send_email_smtp(msg, kind="task", task_id=task["_id"], smtp=smtp)
+                                sent += 1
+                            except Exception as e:
+                                failed += 1
+                                fails.append(f"{to} → {e}")
+                            _cb(idx, total)
+                            time.sleep(SMTP_SEND_DELAY)
 
+                prog.empty(); status_txt.empty()
+                if sent:
+                    st.success(f"Emails sent: {sent}")
+                if failed:
+                    with st.expander(f"Show {failed} failures"):
+                        for line in fails:
+                            st.write("• ", line)
+                if sent or failed:
+                    audit("task.email", "task", task["_id"], scope=scope, delivery=delivery,
+                          template=template_key, sent=sent, failed=failed)
+                    record_activity("email.campaign", tags={"delivery": delivery}, count=sent,
+                                    task_id=task["_id"], scope=scope, failed=failed)
+                    st.toast(f"Done. Sent {sent}, Failed {failed}", icon="📧")
+
+
+@uses_profile("interactive")
 def tasks_management():
     st.header("📝 Tasks Management")
     
@@ -790,7 +4723,10 @@ def tasks_management():
                         "created_at": datetime.now(timezone.utc),
                         "updated_at": datetime.now(timezone.utc)
                     }
-                    tasks_col.insert_one(task_data)
+                    res = tasks_col.insert_one(task_data)
+                    note_write("tasks", res.inserted_id)
+                    audit("task.create", "task", res.inserted_id, title=title)
+                    record_activity("task.create", tags={"track": track}, task_id=res.inserted_id)
                     st.success("Task created successfully!")
                     st.rerun()
                 else:
@@ -798,162 +4734,7 @@ def tasks_management():
     
     # ---------------- Assign Task to Individual User ----------------
     with st.expander("👤 Assign Task to Individual User"):
-        st.subheader("Select Assignment Type")
-        assignment_type = st.radio("Choose assignment type:", 
-                                   ["Assign Existing Task", "Create Custom Task"], 
-                                   horizontal=True)
-        if assignment_type == "Assign Existing Task":
-            all_users = list(users_col.find({}, {"_id": 1, "name": 1, "email": 1}))
-            st.subheader("🔍 Find User")
-            search_query = st.text_input("Search users by name or email", key="user_search_existing_outside")
-            filtered_users = []
-            if search_query:
-                filtered_users = [
-                    user for user in all_users 
-                    if search_query.lower() in user['name'].lower() or search_query.lower() in user['email'].lower()
-                ]
-                if filtered_users:
-                    st.write(f"**Found {len(filtered_users)} matching users:**")
-                    for user in filtered_users[:5]:
-                        st.write(f"• **{user['name']}** - {user['email']}")
-                else:
-                    st.write("No users found matching your search.")
-            st.markdown("---")
-            with st.form("assign_existing_task"):
-                col1, col2 = st.columns(2)
-                with col1:
-                    active_tasks = list(tasks_col.find({"is_active": True}))
-                    if active_tasks:
-                        task_options = {str(task["_id"]): f"{task['title']} ({TRACKS.get(task.get('track', ''), task.get('track', 'Unknown'))})" for task in active_tasks}
-                        selected_task_id = st.selectbox("Select Task", options=list(task_options.keys()), 
-                                                        format_func=lambda x: task_options[x])
-                    else:
-                        st.warning("No active tasks available")
-                        selected_task_id = None
-                with col2:
-                    st.write("**Select User:**")
-                    display_users = filtered_users if search_query and filtered_users else all_users[:20]
-                    if display_users:
-                        user_options = {str(user["_id"]): f"{user['name']} ({user['email']})" for user in display_users}
-                        selected_user_id = st.selectbox(f"Available Users ({len(display_users)})", 
-                                                        options=list(user_options.keys()), 
-                                                        format_func=lambda x: user_options[x],
-                                                        key="user_select_existing")
-                    else:
-                        st.warning("No users available")
-                        selected_user_id = None
-                assignment_note = st.text_area("Assignment Note (optional)", 
-                                               placeholder="Add any specific instructions for this user...",
-                                               key="note_existing")
-                submit_existing = st.form_submit_button("Assign Existing Task", use_container_width=True)
-                if submit_existing:
-                    if selected_task_id and selected_user_id and active_tasks:
-                        existing_assignment = db.task_assignments.find_one({
-                            "task_id": ObjectId(selected_task_id),
-                            "user_id": ObjectId(selected_user_id)
-                        })
-                        if not existing_assignment:
-                            assignment_data = {
-                                "task_id": ObjectId(selected_task_id),
-                                "user_id": ObjectId(selected_user_id),
-                                "assigned_by": st.session_state.admin_username,
-                                "assigned_at": datetime.now(timezone.utc),
-                                "note": assignment_note,
-                                "status": "assigned",
-                                "assignment_type": "existing"
-                            }
-                            db.task_assignments.insert_one(assignment_data)
-                            task_title = [task['title'] for task in active_tasks if str(task['_id']) == selected_task_id][0]
-                            user_name = user_options[selected_user_id]
-                            st.success(f"Task '{task_title}' assigned to {user_name} successfully!")
-                            st.rerun()
-                        else:
-                            st.error("This task is already assigned to this user!")
-                    else:
-                        st.error("Please select both a task and a user!")
-        else:
-            all_users = list(users_col.find({}, {"_id": 1, "name": 1, "email": 1}))
-            st.subheader("🔍 Find User")
-            search_query_custom = st.text_input("Search users by name or email", key="user_search_custom_outside")
-            filtered_users_custom = []
-            if search_query_custom:
-                filtered_users_custom = [
-                    user for user in all_users 
-                    if search_query_custom.lower() in user['name'].lower() or search_query_custom.lower() in user['email'].lower()
-                ]
-                if filtered_users_custom:
-                    st.write(f"**Found {len(filtered_users_custom)} matching users:**")
-                    for user in filtered_users_custom[:5]:
-                        st.write(f"• **{user['name']}** - {user['email']}")
-                else:
-                    st.write("No users found matching your search.")
-            st.markdown("---")
-            with st.form("assign_custom_task"):
-                st.subheader("Create & Assign Custom Task")
-                col1, col2 = st.columns(2)
-                with col1:
-                    custom_title = st.text_input("Custom Task Title")
-                    custom_track = st.selectbox("Track", ["ai", "webdev", "dsa", "app"], 
-                                                format_func=lambda x: TRACKS[x], key="custom_track")
-                    custom_difficulty = st.selectbox("Difficulty", ["beginner", "intermediate", "advanced"], 
-                                                     key="custom_difficulty")
-                    custom_points = st.number_input("Points", min_value=1, value=100, key="custom_points")
-                    custom_due_date = st.date_input("Due Date", key="custom_due_date")
-                with col2:
-                    st.write("**Select User:**")
-                    display_users_custom = filtered_users_custom if search_query_custom and filtered_users_custom else all_users[:20]
-                    if display_users_custom:
-                        user_options_custom = {str(user["_id"]): f"{user['name']} ({user['email']})" for user in display_users_custom}
-                        selected_user_id_custom = st.selectbox(f"Available Users ({len(display_users_custom)})", 
-                                                               options=list(user_options_custom.keys()), 
-                                                               format_func=lambda x: user_options_custom[x],
-                                                               key="user_select_custom")
-                    else:
-                        st.warning("No users available")
-                        selected_user_id_custom = None
-                custom_description = st.text_area("Task Description", key="custom_description")
-                custom_requirements = st.text_area("Requirements (one per line)", key="custom_requirements")
-                assignment_note_custom = st.text_area("Assignment Note (optional)", 
-                                                      placeholder="Add any specific instructions for this user...",
-                                                      key="note_custom")
-                submit_custom = st.form_submit_button("Create & Assign Custom Task", use_container_width=True)
-                if submit_custom:
-                    if custom_title and custom_description and selected_user_id_custom:
-                        req_list = [req.strip() for req in custom_requirements.split('\n') if req.strip()]
-                        custom_task_data = {
-                            "title": custom_title,
-                            "description": custom_description,
-                            "due_date": datetime.combine(custom_due_date, datetime.min.time()).replace(tzinfo=timezone.utc),
-                            "points": custom_points,
-                            "is_active": True,
-                            "team_id": None,
-                            "type": "individual",
-                            "difficulty": custom_difficulty,
-                            "track": custom_track,
-                            "requirements": req_list,
-                            "created_by": st.session_state.admin_username,
-                            "created_at": datetime.now(timezone.utc),
-                            "updated_at": datetime.now(timezone.utc),
-                            "is_custom": True,
-                            "assigned_to": ObjectId(selected_user_id_custom)
-                        }
-                        custom_task_result = tasks_col.insert_one(custom_task_data)
-                        custom_task_id = custom_task_result.inserted_id
-                        assignment_data = {
-                            "task_id": custom_task_id,
-                            "user_id": ObjectId(selected_user_id_custom),
-                            "assigned_by": st.session_state.admin_username,
-                            "assigned_at": datetime.now(timezone.utc),
-                            "note": assignment_note_custom,
-                            "status": "assigned",
-                            "assignment_type": "custom"
-                        }
-                        db.task_assignments.insert_one(assignment_data)
-                        user_name = user_options_custom[selected_user_id_custom]
-                        st.success(f"Custom task '{custom_title}' created and assigned to {user_name} successfully!")
-                        st.rerun()
-                    else:
-                        st.error("Please fill in all required fields and select a user!")
+        assign_task_panel()
     
     st.markdown("---")
     
@@ -962,8 +4743,8 @@ def tasks_management():
         recent_assignments = list(db.task_assignments.find({}).sort("assigned_at", -1).limit(10))
         if recent_assignments:
             for assignment in recent_assignments:
-                task = tasks_col.find_one({"_id": assignment["task_id"]})
-                user = users_col.find_one({"_id": assignment["user_id"]})
+                task = cached_find_one("tasks", assignment["task_id"])
+                user = cached_find_one("users", assignment["user_id"], {"name": 1})
                 if task and user:
                     col1, col2, col3, col4 = st.columns([2, 2, 1, 1])
                     with col1:
@@ -978,9 +4759,13 @@ def tasks_management():
                     with col4:
                         if st.button("Remove", key=f"remove_assignment_{assignment['_id']}"):
                             db.task_assignments.delete_one({"_id": assignment["_id"]})
+                            note_write("task_assignments", assignment["_id"])
+                            audit("task.unassign", "task", task["_id"], user_id=assignment["user_id"])
                             if task.get('is_custom'):
                                 if st.button("Also delete custom task?", key=f"delete_custom_{task['_id']}"):
                                     tasks_col.delete_one({"_id": task["_id"]})
+                                    note_write("tasks", task["_id"])
+                                    audit("task.delete", "task", task["_id"])
                             st.success("Assignment removed!")
                             st.rerun()
                     if assignment.get("note"):
@@ -1047,190 +4832,61 @@ def tasks_management():
                             {"_id": task["_id"]},
                             {"$set": {"is_active": not task['is_active'], "updated_at": datetime.now(timezone.utc)}}
                         )
+                        note_write("tasks", task["_id"], ["is_active", "updated_at"])
+                        audit("task.deactivate" if task["is_active"] else "task.activate", "task", task["_id"])
                         st.rerun()
 
                 # ---------- 📧 Email Users About This Task ----------
-                st.markdown("---")
-                st.subheader("📧 Email users about this task")
+                task_email_panel(task)
+    else:
+        st.info("No tasks found matching the criteria.")
 
-                # Fail-fast if email env is not configured
-                try:
-                    _ = get_sender_identity()
-                except Exception as e:
-                    st.error(f"Email sending not configured: {e}")
-                    continue
+@st.fragment
+@uses_profile("interactive")
+def submission_review_controls(sub: dict):
+    """Status/points controls for one submission, rerun in isolation."""
+    st.write(f"**Status:** {sub['status'].upper()}")
 
-                tid = str(task["_id"])
-
-                # NEW: add "track" and "single_user" scopes
-                scope = st.radio(
-                    "Recipients",
-                    options=["all", "assigned", "track", "single_user"],
-                    format_func=lambda v: (
-                        "All users (system-wide)" if v == "all" else
-                        "Only users assigned to this task" if v == "assigned" else
-                        "Users in a specific track" if v == "track" else
-                        "Search and send to one user"
-                    ),
-                    horizontal=True,
-                    key=f"scope_{tid}"
-                )
+    # Status update form
+    new_status = st.selectbox("Update Status", ["pending", "approved", "rejected"], 
+                            index=["pending", "approved", "rejected"].index(sub["status"]),
+                            key=f"status_{sub['_id']}")
 
-                # Template & preview
-                template_key = st.selectbox(
-                    "Template",
-                    options=["new_update", "reminder", "time_finished"],
-                    format_func=lambda k: {
-                        "new_update": "New Task Update",
-                        "reminder": "Reminder of Task",
-                        "time_finished": "Task Time Finished"
-                    }[k],
-                    key=f"tmpl_{tid}"
-                )
-                default_subject, default_html = render_task_email(template_key, task, None)
-                subject_input = st.text_input("Subject", value=default_subject, key=f"subj_{tid}")
-                st.markdown("**Preview (HTML):**")
-                st.markdown(default_html, unsafe_allow_html=True)
-
-                # Build recipient list per scope
-                recipient_emails = []
-                track_key_selected = None
-
-                if scope in ["all", "assigned"]:
-                    recips_preview = gather_recipients_for_task(task["_id"], scope)
-                    if not recips_preview:
-                        st.warning("No recipients found for this scope.")
-                    else:
-                        recipient_emails = [u["email"] for u in recips_preview if u.get("email")]
-                        st.caption(f"About to email **{len(recipient_emails)}** user(s).")
-
-                elif scope == "track":
-                    track_key_selected = st.selectbox(
-                        "Select track",
-                        list(TRACKS.keys()),
-                        format_func=lambda x: TRACKS[x],
-                        key=f"email_track_{tid}"
-                    )
-                    if track_key_selected:
-                        users_in_track = list(users_col.find(
-                            {"profile.coding_track": track_key_selected, "email": {"$exists": True, "$ne": ""}},
-                            {"name": 1, "email": 1}
-                        ))
-                        if not users_in_track:
-                            st.warning(f"No users found in track: {TRACKS.get(track_key_selected, track_key_selected)}")
-                        else:
-                            recipient_emails = [u["email"] for u in users_in_track]
-                            st.caption(
-                                f"Track **{TRACKS.get(track_key_selected, track_key_selected)}** → "
-                                f"**{len(recipient_emails)}** user(s)."
-                            )
-
-                elif scope == "single_user":
-                    search_query_one = st.text_input("🔍 Search user by name or email", key=f"user_search_{tid}")
-                    if search_query_one:
-                        matches = list(users_col.find({
-                            "$or": [
-                                {"name": {"$regex": search_query_one, "$options": "i"}},
-                                {"email": {"$regex": search_query_one, "$options": "i"}}
-                            ]
-                        }).limit(5))
-                        if matches:
-                            user_options = {str(u["_id"]): f"{u['name']} ({u['email']})" for u in matches}
-                            selected_uid = st.selectbox(
-                                "Select User",
-                                options=list(user_options.keys()),
-                                format_func=lambda x: user_options[x],
-                                key=f"user_sel_{tid}"
-                            )
-                            if selected_uid:
-                                udoc = users_col.find_one({"_id": ObjectId(selected_uid)}, {"name": 1, "email": 1})
-                                if udoc and udoc.get("email"):
-                                    recipient_emails = [udoc["email"]]
-                                    st.caption(f"Will send to: **{udoc['name']}** ({udoc['email']})")
-                        else:
-                            st.info("No matching users found.")
-
-                # Buttons
-                c1, c2, _ = st.columns([1, 1, 2])
-                cur_admin = get_current_admin()
-                admin_email = (cur_admin or {}).get("email")
+    if sub["status"] != "approved":
+        new_points = st.number_input("Award Points", min_value=0, value=as_points(sub.get('points', 0)), key=f"points_{sub['_id']}")
+    else:
+        new_points = as_points(sub.get('points', 0))
 
-                with c1:
-                    if admin_email and st.button("Send test to me", key=f"send_test_{tid}"):
-                        try:
-                            from_addr, from_name = get_sender_identity()
-                            msg = _build_email(subject_input, default_html, admin_email, from_addr, from_name)
-                            send_email_smtp(msg)
-                            st.success(f"Sent test email to {admin_email}")
-                        except Exception as e:
-                            st.error(f"Failed to send test: {e}")
+    if st.button("Update", key=f"update_{sub['_id']}"):
+        # Conditional on the status we rendered: a concurrent review wins once, stats move once
+        applied = transition_submission(
+            sub["_id"], sub["status"], new_status, new_points, st.session_state.admin_username
+        )
+        if applied:
+            flash("Submission updated!")
+            st.rerun()
+        else:
+            st.warning("This submission was changed by another admin. Reload to see its current status.")
 
-                with c2:
-                    if recipient_emails:
-                        confirm = st.checkbox("Confirm send", key=f"confirm_{tid}")
-                        if confirm and st.button("Send to recipients", key=f"send_all_{tid}"):
-                            prog = st.progress(0.0)
-                            status_txt = st.empty()
 
-                            def _cb(i, total):
-                                frac = (i / total) if total else 0
-                                prog.progress(frac)
-                                status_txt.write(f"Sending… {i}/{total}")
+class SubmissionRow(RowView):
+    __slots__ = FIELDS = ("_id", "user_id", "task_id", "status", "points", "submitted_at",
+                          "submission_url", "link_check")
+    LAZY = ("submission_text",)
 
-                            try:
-                                if scope == "single_user" or scope == "track":
-                                    # Manual send loop for custom recipient list
-                                    sent, failed, fails = 0, 0, []
-                                    from_addr, from_name = get_sender_identity()
-                                    total = len(recipient_emails)
-                                    for idx, to in enumerate(recipient_emails, start=1):
-                                        try:
-                                            # personalize if you want user names (we send generic here)
-                                            msg = _build_email(subject_input, default_html, to, from_addr, from_name)
-                                            send_email_smtp(msg)
-                                            sent += 1
-                                        except Exception as e:
-                                            failed += 1
-                                            fails.append(f"{to} → {e}")
-                                        _cb(idx, total)
-                                        time.sleep(0.2)
-                                else:
-                                    # use bulk helper for all/assigned
-                                    sent, failed, fails = send_bulk_emails_for_task(
-                                        task, template_key, scope, progress_cb=_cb, override_subject=subject_input
-                                    )
-                            except TypeError:
-                                # fallback if helper lacks override_subject
-                                orig_render = render_task_email
-                                def render_override(tk, tsk, usr):
-                                    _, html = orig_render(tk, tsk, usr)
-                                    return subject_input, html
-                                try:
-                                    globals()['render_task_email'] = render_override
-                                    sent, failed, fails = send_bulk_emails_for_task(task, template_key, scope, progress_cb=_cb)
-                                finally:
-                                    globals()['render_task_email'] = orig_render
-
-                            prog.empty(); status_txt.empty()
-                            if sent:
-                                st.success(f"Emails sent: {sent}")
-                            if failed:
-                                with st.expander(f"Show {failed} failures"):
-                                    for line in fails:
-                                        st.write("• ", line)
-                            if sent or failed:
-                                st.toast(f"Done. Sent {sent}, Failed {failed}", icon="📧")
-    else:
-        st.info("No tasks found matching the criteria.")
 
+SUBMISSION_BROWSE_PAGE_SIZE = 25
+
+
+@uses_profile("interactive")
 def submissions_management():
     st.header("📄 Submissions Management")
     
     # Submission statistics
-    total_subs = submissions_col.count_documents({})
-    approved_subs = submissions_col.count_documents({"status": "approved"})
-    pending_subs = submissions_col.count_documents({"status": "pending"})
-    rejected_subs = submissions_col.count_documents({"status": "rejected"})
+    total_subs = cached_count("submissions", keys=["submissions/*"])
+    approved_subs = cached_count("submissions", {"status": "approved"}, keys=["submissions.status"])
+    pending_subs = cached_count("submissions", {"status": "pending"}, keys=["submissions.status"])
+    rejected_subs = cached_count("submissions", {"status": "rejected"}, keys=["submissions.status"])
     
     col1, col2, col3, col4 = st.columns(4)
     with col1:
@@ -1243,29 +4899,55 @@ def submissions_management():
         st.metric("Rejected", rejected_subs)
     
     st.markdown("---")
+
+    mode = st.radio("Mode", ["🎯 Review queue", "📋 Browse all", "🧬 Similar submissions"],
+                    horizontal=True, key="submissions_mode")
+    if mode == "🎯 Review queue":
+        review_queue_panel()
+        return
+    if mode == "🧬 Similar submissions":
+        similarity_panel()
+        return
     
     # Submissions list
     st.subheader("All Submissions")
     
     # Filters
-    col1, col2 = st.columns(2)
+    col1, col2, col3 = st.columns([2, 2, 1])
     with col1:
         status_filter = st.selectbox("Filter by Status", ["All", "pending", "approved", "rejected"])
     with col2:
         sort_by = st.selectbox("Sort by", ["Newest", "Oldest"])
+    with col3:
+        hide_broken = st.checkbox("Hide broken links", key="hide_broken_links")
+        if st.button("🔗 Check links now"):
+            with st.spinner("Checking submission links…"):
+                result = run_link_checks()
+            st.toast(f"Checked {result['checked']} URL(s) for {result['submissions']} submission(s).")
     
     # Build query
     query = {}
     if status_filter != "All":
         query["status"] = status_filter
+    if hide_broken:
+        query["link_check.status"] = {"$nin": LINK_BAD_STATUSES}
     
     sort_order = -1 if sort_by == "Newest" else 1
-    submissions = list(submissions_col.find(query).sort("submitted_at", sort_order))
+    total = cached_count("submissions", query,
+                         keys=["submissions/*", "submissions.status", "submissions.link_check"])
+    pages = max(1, -(-total // SUBMISSION_BROWSE_PAGE_SIZE))
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1,
+                           key="submissions_browse_page")
+    # One page of expanders per run: only those rows are fetched and decoded
+    submissions = find_rows("submissions", SubmissionRow, query, sort=[("submitted_at", sort_order)],
+                            skip=(page - 1) * SUBMISSION_BROWSE_PAGE_SIZE, limit=SUBMISSION_BROWSE_PAGE_SIZE)
     
     if submissions:
+        first = (page - 1) * SUBMISSION_BROWSE_PAGE_SIZE + 1
+        st.caption(f"Showing {first}–{first + len(submissions) - 1} of {total} submissions")
         for sub in submissions:
-            user = users_col.find_one({"_id": sub["user_id"]})
-            task = tasks_col.find_one({"_id": sub["task_id"]})
+            user = cached_find_one("users", sub["user_id"], {"name": 1})
+            task = cached_find_one("tasks", sub["task_id"], {"title": 1})
             
             with st.expander(f"{user['name'] if user else 'Unknown User'} - {task['title'] if task else 'Unknown Task'} - {sub['status'].upper()}"):
                 col1, col2 = st.columns([2, 1])
@@ -1274,6 +4956,8 @@ def submissions_management():
                     st.write(f"**User:** {user['name'] if user else 'Unknown'}")
                     st.write(f"**Task:** {task['title'] if task else 'Unknown'}")
                     st.write(f"**Submission URL:** {sub.get('submission_url', 'N/A')}")
+                    st.caption(link_badge(sub) + (f" → {sub['link_check']['final_url']}"
+                                                  if (sub.get("link_check") or {}).get("final_url") else ""))
                     st.write(f"**Submission Text:** {sub.get('submission_text', 'N/A')}")
                     # Safe date handling  
                     submitted_date = sub.get('submitted_at', 'Unknown')
@@ -1285,44 +4969,172 @@ def submissions_management():
                     st.write(f"**Current Points:** {sub.get('points', 0)}")
                 
                 with col2:
-                    st.write(f"**Status:** {sub['status'].upper()}")
-                    
-                    # Status update form
-                    new_status = st.selectbox("Update Status", ["pending", "approved", "rejected"], 
-                                            index=["pending", "approved", "rejected"].index(sub["status"]),
-                                            key=f"status_{sub['_id']}")
-                    
-                    if sub["status"] != "approved":
-                        new_points = st.number_input("Award Points", min_value=0, value=int(sub.get('points', 0)), key=f"points_{sub['_id']}")
-                    else:
-                        new_points = int(sub.get('points', 0))
-                    
-                    if st.button("Update", key=f"update_{sub['_id']}"):
-                        update_data = {
-                            "status": new_status,
-                            "points": str(new_points),
-                            "updated_at": datetime.now(timezone.utc)
-                        }
-                        
-                        submissions_col.update_one({"_id": sub["_id"]}, {"$set": update_data})
-                        
-                        # Update user stats if approved
-                        if new_status == "approved" and sub["status"] != "approved":
-                            users_col.update_one(
-                                {"_id": sub["user_id"]},
-                                {
-                                    "$inc": {
-                                        "stats.points": new_points,
-                                        "stats.tasks_completed": 1
-                                    }
-                                }
-                            )
-                        
-                        st.success("Submission updated!")
-                        st.rerun()
+                    submission_review_controls(sub)
     else:
         st.info("No submissions found matching the criteria.")
 
+@st.fragment
+@uses_profile("interactive")
+def queue_review_controls(sub: dict, task: dict | None, reviewer: str):
+    """Decision controls for one leased submission, rerun in isolation."""
+    default_pts = as_points(sub.get("points")) or as_points((task or {}).get("points"))
+    pts = st.number_input("Award Points", min_value=0, value=default_pts, key=f"q_points_{sub['_id']}")
+    c1, c2 = st.columns(2)
+    decision = None
+    with c1:
+        if st.button("✅ Approve", key=f"q_approve_{sub['_id']}", use_container_width=True):
+            decision = "approved"
+    with c2:
+        if st.button("❌ Reject", key=f"q_reject_{sub['_id']}", use_container_width=True):
+            decision = "rejected"
+    if decision:
+        if transition_submission(sub["_id"], "pending", decision, pts, reviewer, require_claim=True):
+            flash(f"Submission {decision}.")
+        else:
+            flash("Lease expired or submission already reviewed; it was not changed.", icon="⚠️")
+        st.rerun()
+    c1, c2 = st.columns(2)
+    with c1:
+        if st.button("Extend", key=f"q_renew_{sub['_id']}", use_container_width=True):
+            renew_claim(sub["_id"], reviewer)
+            st.rerun()
+    with c2:
+        if st.button("Release", key=f"q_release_{sub['_id']}", use_container_width=True):
+            release_claim(sub["_id"], reviewer)
+            st.rerun()
+
+
+def review_queue_panel():
+    """Each admin works on submissions leased to them; nobody else is handed the same one."""
+    reviewer = st.session_state.admin_username
+
+    qstats = get_review_queue_stats()
+    my_claims = get_my_claims(reviewer)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Waiting in queue", qstats["waiting"])
+    with col2:
+        st.metric("In review (leased)", qstats["in_review"])
+    with col3:
+        st.metric("Leased to you", len(my_claims))
+
+    col1, col2, _ = st.columns([1, 1, 2])
+    with col1:
+        batch = st.number_input("Batch size", min_value=1, max_value=20, value=1, key="review_batch")
+    with col2:
+        st.write("")
+        if st.button("Claim next", use_container_width=True):
+            got = claim_submissions(reviewer, int(batch))
+            if got:
+                st.rerun()
+            else:
+                st.info("Queue is empty.")
+
+    st.caption(f"Claims expire after {REVIEW_LEASE_SECONDS // 60} minutes and return to the queue.")
+
+    for sub in my_claims:
+        user = cached_find_one("users", sub["user_id"], {"name": 1})
+        task = cached_find_one("tasks", sub["task_id"], {"title": 1, "points": 1})
+        expires = sub["claim"]["expires_at"]
+        if expires.tzinfo is None:
+            expires = expires.replace(tzinfo=timezone.utc)
+        mins_left = max(0, int((expires - datetime.now(timezone.utc)).total_seconds() // 60))
+
+        with st.container(border=True):
+            col1, col2 = st.columns([2, 1])
+            with col1:
+                st.write(f"**User:** {user['name'] if user else 'Unknown'}")
+                st.write(f"**Task:** {task['title'] if task else 'Unknown'}")
+                st.write(f"**Submission URL:** {sub.get('submission_url', 'N/A')}")
+                st.caption(link_badge(sub) + (f" → {sub['link_check']['final_url']}"
+                                              if (sub.get("link_check") or {}).get("final_url") else ""))
+                st.write(f"**Submission Text:** {sub.get('submission_text', 'N/A')}")
+                submitted_date = sub.get('submitted_at', 'Unknown')
+                if hasattr(submitted_date, 'strftime'):
+                    submitted_str = submitted_date.strftime('%Y-%m-%d %H:%M')
+                else:
+                    submitted_str = str(submitted_date)
+                st.write(f"**Submitted:** {submitted_str}")
+                st.caption(f"⏳ Lease: {mins_left} min left")
+                similar = similar_to(sub["_id"])
+                if similar:
+                    st.warning(f"🧬 Near-duplicate of {len(similar)} other submission(s) for this task "
+                               f"(up to {similar[0][1]:.0%} similar).")
+            with col2:
+                queue_review_controls(sub, task, reviewer)
+
+    st.markdown("---")
+    st.subheader("Reviewer throughput (last 24h)")
+    rows = get_reviewer_throughput(24)
+    if rows:
+        st.dataframe(pd.DataFrame([{
+            "Reviewer": r["_id"] or "—",
+            "Reviewed": r["reviewed"],
+            "Approved": r["approved"],
+            "Rejected": r["rejected"],
+            "Per hour": round(r["reviewed"] / 24, 2),
+            "Last review": r["last"].strftime("%Y-%m-%d %H:%M") if r.get("last") else "—",
+        } for r in rows]), use_container_width=True, hide_index=True)
+    else:
+        st.info("No reviews in the last 24 hours.")
+
+def similarity_panel():
+    """Clusters of near-identical submissions to the same task by different students."""
+    tasks = cached_find("tasks", {}, {"title": 1}, sort=[("created_at", -1)], keys=["tasks.title"])
+    if not tasks:
+        st.info("No tasks yet.")
+        return
+    titles = {t["_id"]: t.get("title", str(t["_id"])) for t in tasks}
+    col1, col2, col3 = st.columns([3, 2, 1])
+    with col1:
+        task_id = st.selectbox("Task", list(titles), format_func=titles.get, key="similar_task")
+    with col2:
+        threshold = st.slider("Minimum similarity", 0.5, 1.0, SIMILARITY_THRESHOLD, 0.05, key="similar_threshold")
+    with col3:
+        st.write("")
+        if st.button("🧬 Index new", use_container_width=True):
+            with st.spinner("Signing new submissions…"):
+                n = sign_new_submissions()
+            st.toast(f"Signed {n} new submission(s).")
+
+    clusters = get_similar_clusters(task_id, threshold)
+    st.caption(f"Similarity is estimated from {SIMILARITY_PERMUTATIONS}-value MinHash signatures over "
+               f"{SIMILARITY_SHINGLE_WORDS}-word shingles; submissions are indexed every "
+               f"{SIMILARITY_INTERVAL // 60} min.")
+    if not clusters:
+        st.success("No near-duplicate submissions found for this task.")
+        return
+
+    for i, cluster in enumerate(clusters, 1):
+        subs = {s["_id"]: s for s in submissions_col.find(
+            {"_id": {"$in": cluster["ids"]}},
+            {"user_id": 1, "status": 1, "submitted_at": 1, "submission_url": 1, "submission_text": 1})}
+        if len(subs) < 2:
+            continue   # the rest were archived
+        with st.expander(f"Cluster {i}: {len(subs)} submissions, up to {cluster['max_score']:.0%} similar"):
+            rows = []
+            for sub_id in cluster["ids"]:
+                sub = subs.get(sub_id)
+                if not sub:
+                    continue
+                user = cached_find_one("users", sub["user_id"], {"name": 1, "email": 1})
+                submitted = sub.get("submitted_at")
+                rows.append({
+                    "Student": user["name"] if user else "Unknown",
+                    "Email": user.get("email", "") if user else "",
+                    "Status": sub.get("status", ""),
+                    "Submitted": submitted.strftime("%Y-%m-%d %H:%M") if hasattr(submitted, "strftime") else "",
+                    "URL": sub.get("submission_url", ""),
+                    "Text": (sub.get("submission_text") or "")[:120],
+                })
+            st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+            names = {r: (cached_find_one("users", subs[r]["user_id"], {"name": 1}) or {}).get("name", "Unknown")
+                     for r in subs}
+            st.caption("Closest pairs: " + "; ".join(
+                f"{names[p['a']]} ↔ {names[p['b']]} {p['score']:.0%}"
+                for p in cluster["pairs"][:10] if p["a"] in subs and p["b"] in subs))
+
+@uses_profile("interactive")
 def forums_management():
     st.header("💬 Forums Management")
     
@@ -1356,6 +5168,8 @@ def forums_management():
                     }
                     
                     forums_col.insert_one(forum_data)
+                    note_write("forums", forum_data["_id"])
+                    audit("forum.create", "forum", forum_data["_id"], title=forum_data.get("title"))
                     st.success("Forum created successfully!")
                     st.rerun()
                 else:
@@ -1371,7 +5185,7 @@ def forums_management():
     if forums:
         for forum in forums:
             # Get comment count
-            comment_count = forum_comments_col.count_documents({"forum_id": forum["_id"]})
+            comment_count = cached_count("forum_comments", {"forum_id": forum["_id"]}, keys=["forum_comments/*"])
             
             with st.expander(f"{forum['title']} ({comment_count} comments)"):
                 col1, col2 = st.columns([3, 1])
@@ -1398,6 +5212,9 @@ def forums_management():
                         # Delete forum and its comments
                         forums_col.delete_one({"_id": forum["_id"]})
                         forum_comments_col.delete_many({"forum_id": forum["_id"]})
+                        note_write("forums", forum["_id"])
+                        note_write("forum_comments")
+                        audit("forum.delete", "forum", forum["_id"], title=forum.get("title"))
                         st.success("Forum deleted!")
                         st.rerun()
                 
@@ -1411,32 +5228,365 @@ def forums_management():
     else:
         st.info("No forums found.")
 
+class SignupRow(RowView):
+    __slots__ = FIELDS = ("created_at", "profile")
+    PROJECTION = {"_id": 0, "created_at": 1, "profile.coding_track": 1}
+
+
+class SubmissionStatusRow(RowView):
+    __slots__ = FIELDS = ("task_id", "status")
+    PROJECTION = {"_id": 0, "task_id": 1, "status": 1}
+
+
+class UserPointsRow(RowView):
+    __slots__ = FIELDS = ("stats",)
+    PROJECTION = {"_id": 0, "stats.points": 1}
+
+
+def _registrations_live() -> tuple[pd.DataFrame, pd.DataFrame]:
+    users = find_rows("users", SignupRow, {})
+    user_dates = []
+    user_tracks = []
+    for user in users:
+        if "created_at" in user:
+            user_dates.append(user["created_at"].date())
+            user_tracks.append(TRACKS.get(user.get("profile", {}).get("coding_track", ""), "Unknown"))
+    df = pd.DataFrame({"date": user_dates, "track": user_tracks})
+    df["count"] = 1
+    return df.groupby("date").count()["count"].reset_index(), df.groupby("track").count()["count"].reset_index()
+
+
+def _registrations_snapshot() -> tuple[pd.DataFrame, pd.DataFrame]:
+    daily = snapshot_query("""
+        SELECT CAST(created_at AS DATE) AS date, count(*) AS count
+        FROM users WHERE created_at IS NOT NULL GROUP BY 1 ORDER BY 1""")
+    by_track = snapshot_query("""
+        SELECT coding_track AS track, count(*) AS count
+        FROM users WHERE created_at IS NOT NULL GROUP BY 1""")
+    by_track["track"] = by_track["track"].map(lambda t: TRACKS.get(t, "Unknown"))
+    return daily, by_track.groupby("track", as_index=False)["count"].sum()
+
+
+def _task_performance_live() -> pd.DataFrame:
+    submissions = find_rows("submissions", SubmissionStatusRow, {})
+    tasks = list(tasks_col.find({}, {"title": 1}))
+    totals, approved = Counter(), Counter()
+    for s in submissions:
+        totals[s["task_id"]] += 1
+        approved[s["task_id"]] += s["status"] == "approved"
+    task_stats = {}
+    for task in tasks:
+        approved_count = approved[task["_id"]]
+        total_count = totals[task["_id"]]
+        task_stats[task["title"]] = {
+            "total_submissions": total_count,
+            "approved_submissions": approved_count,
+            "completion_rate": (approved_count / total_count * 100) if total_count > 0 else 0
+        }
+    if not (submissions and task_stats):
+        return pd.DataFrame()
+    df = pd.DataFrame.from_dict(task_stats, orient="index").reset_index()
+    df.columns = ["Task", "Total Submissions", "Approved Submissions", "Completion Rate"]
+    return df
+
+
+def _task_performance_snapshot() -> pd.DataFrame:
+    df = snapshot_query("""
+        SELECT t.title AS "Task",
+               count(s._id) AS "Total Submissions",
+               count(s._id) FILTER (WHERE s.status = 'approved') AS "Approved Submissions"
+        FROM tasks t LEFT JOIN submissions s ON s.task_id = t._id
+        GROUP BY t._id, t.title""")
+    if df.empty or not df["Total Submissions"].any():
+        return pd.DataFrame()
+    total = df["Total Submissions"].where(df["Total Submissions"] > 0)
+    df["Completion Rate"] = (df["Approved Submissions"] / total * 100).fillna(0)
+    return df
+
+
+def _points_live() -> tuple[pd.DataFrame, pd.DataFrame]:
+    users_with_points = find_rows("users", UserPointsRow, {})
+    points = pd.DataFrame({"points": [_user_points(u) for u in users_with_points]})
+    track_avg = pd.DataFrame([
+        {"track": TRACKS.get(r["_id"], "Unknown"), "points": r["points"]}
+        for r in users_col.aggregate([
+            {"$group": {"_id": "$profile.coding_track", "points": {"$avg": {"$ifNull": ["$stats.points", 0]}}}}
+        ])
+    ])
+    return points, track_avg
+
+
+def _points_snapshot() -> tuple[pd.DataFrame, pd.DataFrame]:
+    points = snapshot_query("SELECT coalesce(points, 0) AS points FROM users")
+    track_avg = snapshot_query("""
+        SELECT coding_track AS track, avg(coalesce(points, 0)) AS points FROM users GROUP BY 1""")
+    track_avg["track"] = track_avg["track"].map(lambda t: TRACKS.get(t, "Unknown"))
+    return points, track_avg
+
+
+ANALYTICS_SOURCES = {"mongo": "Live (MongoDB)", "snapshot": "Snapshot (DuckDB)"}
+# window → (label, span, $dateTrunc unit, buckets in the moving average)
+ACTIVITY_WINDOWS = {
+    "24h": ("Last 24 hours (hourly)", timedelta(hours=24), "hour", 3),
+    "14d": ("Last 14 days (daily)", timedelta(days=14), "day", 7),
+    "90d": ("Last 90 days (daily)", timedelta(days=90), "day", 7),
+}
+ACTIVITY_KINDS = {"login": "Logins", "task.create": "Tasks created", "assignment": "Assignments",
+                  "submission.status": "Review decisions", "email.campaign": "Campaign emails",
+                  "email.digest": "Digest emails"}
+
+
+def _bucket(field: str, unit: str) -> dict:
+    trunc = {"date": field, "unit": unit, "timezone": "UTC"}
+    if unit == "week":
+        trunc["startOfWeek"] = "monday"
+    return {"$dateTrunc": trunc}
+
+
+@st.cache_data(ttl=60, max_entries=16, show_spinner=False)
+def activity_trends(window: str) -> dict[str, pd.DataFrame]:
+    """Bucketed activity counts for the window; the stream can't be change-watched, so TTL cached."""
+    _, span, unit, smooth = ACTIVITY_WINDOWS[window]
+    since = datetime.now(timezone.utc) - span
+    # a range window sums whole time buckets, so missing (zero) buckets don't skew the average
+    by_kind = pd.DataFrame(activity_events_col.aggregate([
+        {"$match": {"ts": {"$gte": since}}},
+        {"$group": {"_id": {"kind": "$meta.kind", "bucket": _bucket("$ts", unit)}, "count": {"$sum": "$count"}}},
+        {"$project": {"_id": 0, "kind": "$_id.kind", "bucket": "$_id.bucket", "count": 1}},
+        {"$setWindowFields": {
+            "partitionBy": "$kind", "sortBy": {"bucket": 1},
+            "output": {"rolling": {"$sum": "$count", "window": {"range": [-(smooth - 1), 0], "unit": unit}}},
+        }},
+    ]), columns=["kind", "bucket", "count", "rolling"])
+    by_kind["moving_avg"] = by_kind["rolling"] / smooth
+    logins = pd.DataFrame(activity_events_col.aggregate([
+        {"$match": {"meta.kind": "login", "ts": {"$gte": since}}},
+        {"$group": {"_id": {"admin": "$meta.admin", "bucket": _bucket("$ts", unit)}, "count": {"$sum": "$count"}}},
+        {"$project": {"_id": 0, "admin": "$_id.admin", "bucket": "$_id.bucket", "count": 1}},
+        {"$sort": {"bucket": 1}},
+    ]), columns=["admin", "bucket", "count"])
+    decisions = pd.DataFrame(activity_events_col.aggregate([
+        {"$match": {"meta.kind": "submission.status", "ts": {"$gte": since}}},
+        {"$group": {"_id": {"status": "$meta.status", "bucket": _bucket("$ts", unit)}, "count": {"$sum": "$count"}}},
+        {"$project": {"_id": 0, "status": "$_id.status", "bucket": "$_id.bucket", "count": 1}},
+        {"$setWindowFields": {
+            "partitionBy": "$status", "sortBy": {"bucket": 1},
+            "output": {"cumulative": {"$sum": "$count", "window": {"documents": ["unbounded", "current"]}}},
+        }},
+    ]), columns=["status", "bucket", "count", "cumulative"])
+    # submissions are inserted by the student app, which doesn't emit events; submitted_at is never rewritten
+    submitted = pd.DataFrame(submissions_col.aggregate([
+        {"$match": {"submitted_at": {"$gte": since}}},
+        {"$group": {"_id": _bucket("$submitted_at", unit), "count": {"$sum": 1}}},
+        {"$project": {"_id": 0, "bucket": "$_id", "count": 1}},
+        {"$sort": {"bucket": 1}},
+    ]), columns=["bucket", "count"])
+    by_kind["kind"] = by_kind["kind"].map(lambda k: ACTIVITY_KINDS.get(k, k))
+    return {"by_kind": by_kind, "logins": logins, "decisions": decisions, "submitted": submitted}
+
+
+def activity_trends_section():
+    st.subheader("Activity Trends")
+    window = st.selectbox("Window", list(ACTIVITY_WINDOWS), index=1,
+                          format_func=lambda w: ACTIVITY_WINDOWS[w][0], key="activity_window")
+    _, _, unit, smooth = ACTIVITY_WINDOWS[window]
+    trends = activity_trends(window)
+    if trends["by_kind"].empty and trends["submitted"].empty:
+        st.info("No activity recorded in this window yet.")
+        return
+
+    if not trends["submitted"].empty:
+        fig = px.bar(trends["submitted"], x="bucket", y="count", title=f"Submissions per {unit}")
+        st.plotly_chart(fig, use_container_width=True)
+    if not trends["by_kind"].empty:
+        fig = px.line(trends["by_kind"], x="bucket", y="moving_avg", color="kind",
+                      title=f"Admin activity per {unit} ({smooth}-{unit} moving average)")
+        st.plotly_chart(fig, use_container_width=True)
+    col1, col2 = st.columns(2)
+    with col1:
+        if not trends["decisions"].empty:
+            fig = px.line(trends["decisions"], x="bucket", y="cumulative", color="status",
+                          title="Review decisions (running total)")
+            st.plotly_chart(fig, use_container_width=True)
+    with col2:
+        if not trends["logins"].empty:
+            fig = px.bar(trends["logins"], x="bucket", y="count", color="admin", title=f"Logins per {unit} by admin")
+            st.plotly_chart(fig, use_container_width=True)
+
+# --- Cohorts and funnels ---
+# Both run as one aggregation over users, with $lookup into submissions / task_assignments on
+# their (user_id, …) indexes, and are cached for the UTC day; only the small result comes back.
+COHORT_WEEKS = int(os.getenv("COHORT_WEEKS", "12"))
+FUNNEL_STAGES = {"registered": "Registered", "assigned": "Assigned", "submitted": "Submitted",
+                 "approved": "Approved"}
+
+
+@st.cache_data(ttl=86400, max_entries=8, show_spinner=False)
+def cohort_retention(day: str, weeks: int = COHORT_WEEKS) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    (sizes, active) for users who signed up in the last `weeks` weeks: cohort size per signup
+    week, and how many of each cohort submitted something N weeks after signing up.
+    """
+    today = datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    since = today - timedelta(weeks=weeks, days=today.weekday())      # from a Monday
+    result = next(users_col.aggregate([
+        {"$match": {"created_at": {"$gte": since}}},
+        {"$project": {"cohort": _bucket("$created_at", "week")}},
+        # distinct submission weeks per user, read from the user_submitted index
+        {"$lookup": {
+            "from": "submissions", "localField": "_id", "foreignField": "user_id",
+            "let": {"cohort": "$cohort"},
+            "pipeline": [
+                {"$match": {"$expr": {"$gte": ["$submitted_at", "$$cohort"]}}},
+                {"$group": {"_id": _bucket("$submitted_at", "week")}},
+            ],
+            "as": "weeks",
+        }},
+        {"$project": {"cohort": 1, "offsets": {"$map": {"input": "$weeks", "in": {"$dateDiff": {
+            "startDate": "$cohort", "endDate": "$$this._id", "unit": "week", "startOfWeek": "monday"}}}}}},
+        {"$facet": {
+            "sizes": [{"$group": {"_id": "$cohort", "users": {"$sum": 1}}}],
+            "active": [
+                {"$unwind": "$offsets"},
+                {"$group": {"_id": {"cohort": "$cohort", "week": "$offsets"}, "users": {"$sum": 1}}},
+            ],
+        }},
+    ], allowDiskUse=True), {"sizes": [], "active": []})
+    sizes = pd.DataFrame([{"cohort": r["_id"], "users": r["users"]} for r in result["sizes"]],
+                         columns=["cohort", "users"])
+    active = pd.DataFrame([{"cohort": r["_id"]["cohort"], "week": r["_id"]["week"], "users": r["users"]}
+                           for r in result["active"]], columns=["cohort", "week", "users"])
+    return sizes, active
+
+
+@st.cache_data(ttl=86400, max_entries=8, show_spinner=False)
+def track_funnels(day: str) -> pd.DataFrame:
+    """Users per track reaching each stage: registered → assigned → submitted → approved."""
+    # Assignments and submissions are first grouped down to one document per active user and
+    # unioned with users' tracks; one hash $group then joins them by user, with no per-user lookup.
+    rows = users_col.aggregate([
+        {"$project": {"track": {"$ifNull": ["$profile.coding_track", "unknown"]}}},
+        {"$unionWith": {"coll": "task_assignments", "pipeline": [
+            {"$group": {"_id": "$user_id"}},
+            {"$project": {"assigned": {"$literal": 1}}},
+        ]}},
+        {"$unionWith": {"coll": "submissions", "pipeline": [
+            {"$group": {"_id": {"user": "$user_id", "status": "$status"}}},
+            {"$group": {"_id": "$_id.user",
+                        "approved": {"$max": {"$cond": [{"$eq": ["$_id.status", "approved"]}, 1, 0]}}}},
+            {"$project": {"submitted": {"$literal": 1}, "approved": 1}},
+        ]}},
+        {"$group": {"_id": "$_id", "track": {"$max": "$track"}, "assigned": {"$max": "$assigned"},
+                    "submitted": {"$max": "$submitted"}, "approved": {"$max": "$approved"}}},
+        {"$match": {"track": {"$type": "string"}}},          # activity of deleted users
+        {"$group": {
+            "_id": "$track",
+            "registered": {"$sum": 1},
+            "assigned": {"$sum": "$assigned"},       # $sum skips the missing ones
+            "submitted": {"$sum": "$submitted"},
+            "approved": {"$sum": "$approved"},
+        }},
+    ], allowDiskUse=True)
+    return pd.DataFrame([
+        {"track": TRACKS.get(r["_id"], "Unknown"), "stage": label, "users": r[stage]}
+        for r in rows for stage, label in FUNNEL_STAGES.items()
+    ], columns=["track", "stage", "users"])
+
+
+def cohorts_section():
+    st.subheader("Cohort Retention")
+    day = _utc_day()
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        st.caption(f"Share of each signup week's users who submitted in each following week, over the last "
+                   f"{COHORT_WEEKS} weeks. Computed in MongoDB once per UTC day.")
+    with col2:
+        if st.button("🔄 Recompute", use_container_width=True, key="cohorts_recompute"):
+            cohort_retention.clear()
+            track_funnels.clear()
+    with st.spinner("Building cohorts…"):
+        sizes, active = cohort_retention(day)
+    if sizes.empty:
+        st.info(f"No signups in the last {COHORT_WEEKS} weeks.")
+    else:
+        size = sizes.sort_values("cohort").set_index("cohort")["users"]
+        table = (active.pivot_table(index="cohort", columns="week", values="users", aggfunc="sum")
+                 .reindex(index=size.index, columns=range(COHORT_WEEKS + 1)).fillna(0))
+        pct = table.div(size, axis=0).mul(100).round(1)
+        # weeks that haven't happened yet for a cohort are blank, not 0%
+        this_week = pd.Timestamp(day) - pd.Timedelta(days=pd.Timestamp(day).weekday())
+        for cohort in pct.index:
+            pct.loc[cohort, pct.columns > (this_week - pd.Timestamp(cohort)).days // 7] = None
+        pct = pct.dropna(axis=1, how="all")
+        labels = [f"{c:%Y-%m-%d} ({size[c]})" for c in pct.index]
+        fig = px.imshow(pct.values, x=[f"W{int(w)}" for w in pct.columns], y=labels, text_auto=".0f",
+                        color_continuous_scale="Blues", aspect="auto",
+                        labels={"x": "Weeks after signup", "y": "Signup week (users)", "color": "% active"})
+        fig.update_layout(title="Weekly retention (% of cohort submitting)")
+        st.plotly_chart(fig, use_container_width=True)
+        pct.index, pct.columns = labels, [f"W{int(w)}" for w in pct.columns]
+        with st.expander("Retention table (%)"):
+            st.dataframe(pct, use_container_width=True)
+
+    st.subheader("Track Funnels")
+    with st.spinner("Building funnels…"):
+        funnels = track_funnels(day)
+    if funnels.empty:
+        st.info("No users yet.")
+        return
+    fig = px.funnel(funnels, x="users", y="stage", color="track", title="Registered → assigned → submitted → approved")
+    st.plotly_chart(fig, use_container_width=True)
+    wide = (funnels.pivot_table(index="track", columns="stage", values="users", aggfunc="sum", fill_value=0)
+            [list(FUNNEL_STAGES.values())].astype(int))
+    for prev, stage in zip(list(FUNNEL_STAGES.values()), list(FUNNEL_STAGES.values())[1:]):
+        wide[f"{prev} → {stage}"] = (wide[stage] / wide[prev].where(wide[prev] > 0) * 100).round(1).fillna(0)
+    st.dataframe(wide, use_container_width=True)
+
+
+def analytics_snapshot_status():
+    snapshot = get_snapshot()
+    manifest = snapshot.manifest()
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        if manifest.get("synced_at"):
+            synced = datetime.fromisoformat(manifest["synced_at"])
+            mins = int((datetime.now(timezone.utc) - synced).total_seconds() // 60)
+            st.caption(f"Snapshot synced {mins} min ago · {len(manifest['tables'])} tables under {SNAPSHOT_DIR} · "
+                       f"incremental every {SNAPSHOT_INTERVAL // 60} min, full refresh every "
+                       f"{SNAPSHOT_FULL_REFRESH_HOURS}h")
+        else:
+            st.warning("No snapshot yet. Sync once to create it.")
+    with col2:
+        if st.button("🔄 Sync snapshot", use_container_width=True):
+            with st.spinner("Copying changed rows…"):
+                summary = snapshot.sync()
+            st.toast("Synced: " + ", ".join(f"{t} +{s['rows']}" for t, s in summary.items()))
+            audit("analytics.snapshot_sync", rows={t: s["rows"] for t, s in summary.items()})
+    return bool(manifest.get("synced_at"))
+
+
+@uses_profile("analytics")
 def analytics_page():
     st.header("📈 Analytics")
+
+    source = st.radio("Data source", list(ANALYTICS_SOURCES), format_func=ANALYTICS_SOURCES.get,
+                      index=list(ANALYTICS_SOURCES).index(ANALYTICS_BACKEND)
+                      if ANALYTICS_BACKEND in ANALYTICS_SOURCES else 0,
+                      horizontal=True, key="analytics_source")
+    use_snapshot = source == "snapshot"
+    if use_snapshot and not analytics_snapshot_status():
+        return
     
     # User registration over time
     st.subheader("User Registration Trend")
-    users = list(users_col.find({}, {"created_at": 1, "profile.coding_track": 1}))
+    daily_reg, track_reg = _registrations_snapshot() if use_snapshot else _registrations_live()
     
-    if users:
-        user_dates = []
-        user_tracks = []
-        
-        for user in users:
-            if "created_at" in user:
-                user_dates.append(user["created_at"].date())
-                user_tracks.append(TRACKS.get(user.get("profile", {}).get("coding_track", ""), "Unknown"))
-        
-        df = pd.DataFrame({"date": user_dates, "track": user_tracks})
-        df["count"] = 1
-        
+    if not daily_reg.empty:
         # Daily registrations
-        daily_reg = df.groupby("date").count()["count"].reset_index()
         fig = px.line(daily_reg, x="date", y="count", title="Daily User Registrations")
         st.plotly_chart(fig, use_container_width=True)
         
         # Registrations by track
-        track_reg = df.groupby("track").count()["count"].reset_index()
         fig = px.bar(track_reg, x="track", y="count", title="Registrations by Track")
         st.plotly_chart(fig, use_container_width=True)
     
@@ -1445,51 +5595,25 @@ def analytics_page():
     # Task completion analytics
     st.subheader("Task Performance")
     
-    # Get submission data
-    submissions = list(submissions_col.find({}))
-    tasks = list(tasks_col.find({}))
+    df = _task_performance_snapshot() if use_snapshot else _task_performance_live()
     
-    if submissions and tasks:
-        # Task completion rates
-        task_stats = {}
-        for task in tasks:
-            task_submissions = [s for s in submissions if s["task_id"] == task["_id"]]
-            approved_count = len([s for s in task_submissions if s["status"] == "approved"])
-            total_count = len(task_submissions)
-            
-            task_stats[task["title"]] = {
-                "total_submissions": total_count,
-                "approved_submissions": approved_count,
-                "completion_rate": (approved_count / total_count * 100) if total_count > 0 else 0
-            }
+    # Display top performing tasks
+    if not df.empty:
+        df = df.sort_values("Completion Rate", ascending=False)
         
-        # Display top performing tasks
-        if task_stats:
-            df = pd.DataFrame.from_dict(task_stats, orient="index").reset_index()
-            df.columns = ["Task", "Total Submissions", "Approved Submissions", "Completion Rate"]
-            df = df.sort_values("Completion Rate", ascending=False)
-            
-            fig = px.bar(df.head(10), x="Task", y="Completion Rate", title="Top 10 Tasks by Completion Rate")
-            fig.update_layout(xaxis_tickangle=45)
-            st.plotly_chart(fig, use_container_width=True)
-            
-            st.dataframe(df, use_container_width=True)
+        fig = px.bar(df.head(10), x="Task", y="Completion Rate", title="Top 10 Tasks by Completion Rate")
+        fig.update_layout(xaxis_tickangle=45)
+        st.plotly_chart(fig, use_container_width=True)
+        
+        st.dataframe(df, use_container_width=True)
     
     st.markdown("---")
     
     # Points distribution
     st.subheader("Points Distribution")
-    users_with_points = list(users_col.find({}, {"name": 1, "stats.points": 1, "profile.coding_track": 1}))
+    df, track_avg = _points_snapshot() if use_snapshot else _points_live()
     
-    if users_with_points:
-        points_data = []
-        for user in users_with_points:
-            points = user.get("stats", {}).get("points", 0)
-            track = TRACKS.get(user.get("profile", {}).get("coding_track", ""), "Unknown")
-            points_data.append({"user": user["name"], "points": points, "track": track})
-        
-        df = pd.DataFrame(points_data)
-        
+    if not df.empty:
         # Points histogram
         fig = px.histogram(df, x="points", nbins=20, title="Points Distribution")
         st.plotly_chart(fig, use_container_width=True)
@@ -1499,15 +5623,232 @@ def analytics_page():
         
         with col1:
             st.subheader("Top 10 Overall")
-            top_overall = df.nlargest(10, "points")[["user", "points"]]
-            st.dataframe(top_overall, use_container_width=True)
+            top_overall = pd.DataFrame(get_leaderboard(None, 10))
+            st.dataframe(top_overall[["Rank", "Name", "Points"]], use_container_width=True, hide_index=True)
+            for track_id, track_name in TRACKS.items():
+                with st.expander(f"Top 10 · {track_name}"):
+                    rows = get_leaderboard(track_id, 10)
+                    if rows:
+                        st.dataframe(pd.DataFrame(rows)[["Rank", "Name", "Points"]],
+                                     use_container_width=True, hide_index=True)
+                    else:
+                        st.info("No users in this track.")
         
         with col2:
             st.subheader("Average Points by Track")
-            track_avg = df.groupby("track")["points"].mean().reset_index()
             fig = px.bar(track_avg, x="track", y="points", title="Average Points by Track")
             st.plotly_chart(fig, use_container_width=True)
 
+    st.markdown("---")
+    cohorts_section()
+
+    st.markdown("---")
+    activity_trends_section()
+
+ARCHIVE_PAGE_SIZE = 100
+ARCHIVE_LABELS = {"submissions": "Submissions", "task_assignments": "Task assignments",
+                  "forum_comments": "Forum comments"}
+
+@uses_profile("interactive")   # restores must disappear from the list on the next rerun
+def archive_page():
+    st.header("🗄️ Archive")
+    archive = get_archive()
+    st.caption(f"Read-only view of archived data ({archive.name} backend). "
+               "Hot collections only hold current-season data.")
+    sizes = archive.sizes()
+    for col, coll in zip(st.columns(len(ARCHIVE_TARGETS)), ARCHIVE_TARGETS):
+        with col:
+            st.metric(ARCHIVE_LABELS[coll], f"{sizes[coll]:,} archived", f"{cached_count(coll):,} hot",
+                      delta_color="off")
+
+    coll = st.selectbox("Collection", list(ARCHIVE_TARGETS), format_func=ARCHIVE_LABELS.get, key="archive_coll")
+    filters = {}
+    c1, c2, c3 = st.columns(3)
+    if coll == "forum_comments":
+        forums = cached_find("forums", {}, {"title": 1}, sort=[("created_at", -1)], keys=["forums.title"])
+        forum_titles = {str(f["_id"]): f["title"] for f in forums}
+        with c1:
+            forum_pick = st.selectbox("Forum", [""] + list(forum_titles),
+                                      format_func=lambda k: forum_titles.get(k, "All forums"), key="archive_forum")
+        with c2:
+            author = st.text_input("Commenter email", key="archive_author").strip()
+        filters["forum_id"] = forum_pick or None      # forum ids are strings
+        filters["user_email"] = author or None
+    else:
+        tasks = cached_find("tasks", {}, {"title": 1}, sort=[("created_at", -1)], keys=["tasks.title"])
+        task_titles = {str(t["_id"]): t["title"] for t in tasks}
+        with c1:
+            email = st.text_input("User email", key="archive_user_email").strip()
+        with c2:
+            task_pick = st.selectbox("Task", [""] + list(task_titles),
+                                     format_func=lambda k: task_titles.get(k, "All tasks"), key="archive_task")
+        with c3:
+            status = st.selectbox("Status", [""] + (REVIEW_STATUSES if coll == "submissions" else ["assigned"]),
+                                  format_func=lambda s: s or "Any", key="archive_status")
+        filters["user_id"] = None
+        if email:
+            u = users_col.find_one({"email": email}, {"_id": 1})
+            if not u:
+                st.info("No user with that email.")
+                return
+            filters["user_id"] = u["_id"]
+        filters["task_id"] = ObjectId(task_pick) if task_pick else None
+        filters["status"] = status or None
+
+    total = archive.count(coll, filters)
+    pages = max(1, -(-total // ARCHIVE_PAGE_SIZE))
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1, key="archive_page")
+    docs = archive.find(coll, filters, skip=(page - 1) * ARCHIVE_PAGE_SIZE, limit=ARCHIVE_PAGE_SIZE)
+    if not docs:
+        st.info("Nothing archived matches these filters.")
+    else:
+        fmt = lambda d: as_datetime(d).strftime("%Y-%m-%d %H:%M") if as_datetime(d) else ""
+        if coll == "forum_comments":
+            rows = [{
+                "Created": fmt(d.get("created_at")),
+                "Forum": forum_titles.get(str(d.get("forum_id")), "—"),
+                "Author": d.get("user", {}).get("full_name", ""),
+                "Email": d.get("user", {}).get("email", ""),
+                "Comment": (d.get("content") or "")[:120],
+            } for d in docs]
+        else:
+            names = {u["_id"]: u.get("name", "") for u in users_col.find(
+                {"_id": {"$in": list({d.get("user_id") for d in docs})}}, {"name": 1})}
+            rows = [{
+                "When": fmt(d.get(ARCHIVE_TARGETS[coll]["time_field"])),
+                "User": names.get(d.get("user_id"), str(d.get("user_id", ""))),
+                "Task": task_titles.get(str(d.get("task_id")), "—"),
+                "Status": d.get("status", ""),
+                **({"Points": as_points(d.get("points")), "Reviewed": fmt(d.get("reviewed_at"))}
+                   if coll == "submissions" else {"Assigned by": d.get("assigned_by", "")}),
+            } for d in docs]
+        st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+        first = (page - 1) * ARCHIVE_PAGE_SIZE + 1
+        st.caption(f"Showing {first}–{first + len(docs) - 1} of {total:,} archived documents")
+
+    if not is_superadmin_session():
+        return
+    st.markdown("---")
+    st.subheader("Restore")
+    scoped = any(filters.get(k) is not None for k in ("user_id", "task_id", "forum_id", "user_email"))
+    if not scoped:
+        st.caption("Pick a user, task or forum above to restore its archived documents.")
+        return
+    confirm = st.checkbox(f"Move the {total:,} matching document(s) back to the hot collection",
+                          key="archive_restore_confirm")
+    if confirm and st.button("Restore"):
+        with st.spinner("Restoring…"):
+            restored = restore_archived(coll, filters, admin=st.session_state.admin_username or "")
+        audit("archive.restore", coll, None, restored=restored,
+              filters={k: v for k, v in filters.items() if v is not None})
+        flash(f"Restored {restored} document(s).")
+        st.rerun()
+
+
+@st.fragment
+@uses_profile("interactive")
+def admin_card(a: dict):
+    """Controls for one admin account, rerun in isolation."""
+    c1, c2, c3, c4 = st.columns([1,1,1,1])
+    with c1:
+        st.write(f"**Role:** {a.get('role','admin')}")
+        st.write(f"**Active:** {'Yes' if a.get('is_active', True) else 'No'}")
+    with c2:
+        st.write(f"**Login Count:** {a.get('login_count',0)}")
+        ll = a.get("last_login")
+        st.write("**Last Login:** " + (ll.strftime("%Y-%m-%d %H:%M") if ll and hasattr(ll, 'strftime') else "—"))
+    with c3:
+        if st.button("Toggle Active", key=f"toggle_active_{a['_id']}"):
+            admin_col.update_one(
+                {"_id": a["_id"]},
+                {"$set": {"is_active": not a.get("is_active", True),
+                          "updated_at": datetime.now(timezone.utc)}}
+            )
+            audit("admin.deactivate" if a.get("is_active", True) else "admin.activate", "admin", a["_id"],
+                  username=a.get("username"))
+            st.success("Status updated.")
+            st.rerun()
+    with c4:
+        if a.get("role") != "superadmin":
+            if st.button("Reset Login Count", key=f"reset_logins_{a['_id']}"):
+                admin_col.update_one({"_id": a["_id"]}, {"$set": {"login_count": 0}})
+                audit("admin.reset_logins", "admin", a["_id"], username=a.get("username"))
+                st.success("Login count reset.")
+                st.rerun()
+
+    # Optional: change role
+    new_r = st.selectbox(
+        "Change Role",
+        ["admin", "superadmin"],
+        index=0 if a.get("role") == "admin" else 1,
+        key=f"role_sel_{a['_id']}"
+    )
+    if new_r != a.get("role"):
+        if st.button("Apply Role Change", key=f"apply_role_{a['_id']}"):
+            admin_col.update_one(
+                {"_id": a["_id"]},
+                {"$set": {"role": new_r, "updated_at": datetime.now(timezone.utc)}}
+            )
+            audit("admin.role", "admin", a["_id"], username=a.get("username"), from_role=a.get("role"), to_role=new_r)
+            st.success("Role updated.")
+            st.rerun()
+
+
+def render_metrics_snapshot(snap: dict):
+    """Tables for one Metrics.snapshot(): pages, Mongo by collection, email, sessions, cache."""
+    ms = lambda s: round(s * 1000, 1)
+    hists = snap.get("histograms", [])
+    counters = snap.get("counters", [])
+    by_name = lambda name: [c for c in counters if c["name"] == name]
+
+    pages = [h for h in hists if h["name"] == "portal_page_render_seconds"]
+    st.markdown("**Page render time**")
+    if pages:
+        st.dataframe(pd.DataFrame([{
+            "Page": h["labels"].get("page"), "Runs": h["count"], "p50 (ms)": ms(h["p50"]),
+            "p95 (ms)": ms(h["p95"]), "p99 (ms)": ms(h["p99"]), "Mean (ms)": ms(h["sum"] / h["count"]),
+        } for h in sorted(pages, key=lambda h: -h["p95"])]), use_container_width=True, hide_index=True)
+    else:
+        st.caption("No page runs recorded yet.")
+
+    mongo = [h for h in hists if h["name"] == "portal_mongo_command_seconds"]
+    failures = {(c["labels"].get("collection"), c["labels"].get("command")): c["value"]
+                for c in by_name("portal_mongo_command_failures_total")}
+    st.markdown("**MongoDB commands by collection**")
+    if mongo:
+        st.dataframe(pd.DataFrame([{
+            "Collection": h["labels"].get("collection"), "Command": h["labels"].get("command"),
+            "Count": h["count"], "p50 (ms)": ms(h["p50"]), "p95 (ms)": ms(h["p95"]),
+            "Total (s)": round(h["sum"], 2),
+            "Failures": failures.get((h["labels"].get("collection"), h["labels"].get("command")), 0),
+        } for h in sorted(mongo, key=lambda h: -h["sum"])]), use_container_width=True, hide_index=True)
+    else:
+        st.caption("No MongoDB commands recorded yet.")
+
+    c1, c2, c3 = st.columns(3)
+    with c1:
+        st.markdown("**Email**")
+        emails = {c["labels"].get("result"): c["value"] for c in by_name("portal_emails_total")}
+        retries = sum(c["value"] for c in by_name("portal_smtp_retries_total"))
+        st.dataframe(pd.DataFrame([{"Outcome": k, "Count": v} for k, v in sorted(emails.items())]
+                                  + [{"Outcome": "retries", "Count": retries}]),
+                     use_container_width=True, hide_index=True)
+    with c2:
+        st.markdown("**Session validations**")
+        st.dataframe(pd.DataFrame([{"Result": c["labels"].get("result"), "Count": c["value"]}
+                                   for c in by_name("portal_session_validations_total")]),
+                     use_container_width=True, hide_index=True)
+    with c3:
+        st.markdown("**Query cache**")
+        lookups = {c["labels"].get("fn"): c["value"] for c in by_name("portal_cache_lookups_total")}
+        misses = {c["labels"].get("fn"): c["value"] for c in by_name("portal_cache_misses_total")}
+        st.dataframe(pd.DataFrame([{
+            "Query": fn, "Lookups": n, "Misses": misses.get(fn, 0),
+            "Hit ratio": f"{max(0.0, 1 - misses.get(fn, 0) / n):.0%}" if n else "—",
+        } for fn, n in sorted(lookups.items())]), use_container_width=True, hide_index=True)
+
+
+@uses_profile("interactive")
 def superadmin_page():
     if not is_superadmin_session():
         st.error("You must be in Superadmin mode to access this page.")
@@ -1515,7 +5856,8 @@ def superadmin_page():
 
     st.header("🛡️ Superadmin Control Panel")
 
-    tabs = st.tabs(["📋 Admins Overview", "➕ Create / Manage Admins", "🧰 Tools"])
+    tabs = st.tabs(["📋 Admins Overview", "➕ Create / Manage Admins", "🧰 Tools", "⏱️ Profiles", "📜 Audit Log",
+                    "📊 Metrics"])
 
     # --- Tab 1: Overview ---
     with tabs[0]:
@@ -1574,6 +5916,7 @@ def superadmin_page():
                             "created_at": now,
                             "updated_at": now
                         })
+                        audit("admin.create", "admin", new_username, role=new_role, email=new_email)
                         st.success(f"Admin '{new_username}' ({new_role}) created successfully.")
                         st.rerun()
 
@@ -1583,45 +5926,7 @@ def superadmin_page():
         if existing:
             for a in existing:
                 with st.expander(f"{a.get('username','')} • {a.get('email','')}"):
-                    c1, c2, c3, c4 = st.columns([1,1,1,1])
-                    with c1:
-                        st.write(f"**Role:** {a.get('role','admin')}")
-                        st.write(f"**Active:** {'Yes' if a.get('is_active', True) else 'No'}")
-                    with c2:
-                        st.write(f"**Login Count:** {a.get('login_count',0)}")
-                        ll = a.get("last_login")
-                        st.write("**Last Login:** " + (ll.strftime("%Y-%m-%d %H:%M") if ll and hasattr(ll, 'strftime') else "—"))
-                    with c3:
-                        if st.button("Toggle Active", key=f"toggle_active_{a['_id']}"):
-                            admin_col.update_one(
-                                {"_id": a["_id"]},
-                                {"$set": {"is_active": not a.get("is_active", True),
-                                          "updated_at": datetime.now(timezone.utc)}}
-                            )
-                            st.success("Status updated.")
-                            st.rerun()
-                    with c4:
-                        if a.get("role") != "superadmin":
-                            if st.button("Reset Login Count", key=f"reset_logins_{a['_id']}"):
-                                admin_col.update_one({"_id": a["_id"]}, {"$set": {"login_count": 0}})
-                                st.success("Login count reset.")
-                                st.rerun()
-
-                    # Optional: change role
-                    new_r = st.selectbox(
-                        "Change Role",
-                        ["admin", "superadmin"],
-                        index=0 if a.get("role") == "admin" else 1,
-                        key=f"role_sel_{a['_id']}"
-                    )
-                    if new_r != a.get("role"):
-                        if st.button("Apply Role Change", key=f"apply_role_{a['_id']}"):
-                            admin_col.update_one(
-                                {"_id": a["_id"]},
-                                {"$set": {"role": new_r, "updated_at": datetime.now(timezone.utc)}}
-                            )
-                            st.success("Role updated.")
-                            st.rerun()
+                    admin_card(a)
         else:
             st.info("No admins to manage.")
 
@@ -1631,7 +5936,8 @@ def superadmin_page():
         col1, col2 = st.columns(2)
         with col1:
             if st.button("Force-logout all admins (rotate sessions)"):
-                sessions_col.delete_many({})
+                res = sessions_col.delete_many({})
+                audit("admin.force_logout_all", sessions=res.deleted_count)
                 st.success("All admin sessions cleared.")
         with col2:
             if st.button("Deactivate all non-superadmin accounts"):
@@ -1639,7 +5945,321 @@ def superadmin_page():
                     {"role": {"$ne": "superadmin"}},
                     {"$set": {"is_active": False, "updated_at": datetime.now(timezone.utc)}}
                 )
+                audit("admin.deactivate_all")
                 st.success("All non-superadmin accounts deactivated.")
 
+        st.markdown("---")
+        st.subheader("Profile Page Reruns")
+        armed = st.session_state.get("perf_profile")
+        if armed:
+            st.info(f"Profiling armed: next {armed['remaining']} rerun(s) of {armed['page']}.")
+            if st.button("Disarm profiler"):
+                del st.session_state["perf_profile"]
+                st.rerun()
+        else:
+            c1, c2, c3 = st.columns([2, 1, 1])
+            with c1:
+                prof_page = st.selectbox("Page", ["🛡️ Superadmin"] + NAV_PAGES, key="perf_page")
+            with c2:
+                prof_runs = st.number_input("Reruns", min_value=1, max_value=20, value=3, key="perf_runs")
+            with c3:
+                st.write("")
+                if st.button("Arm profiler", use_container_width=True):
+                    st.session_state["perf_profile"] = {
+                        "page": prof_page,
+                        "remaining": int(prof_runs),
+                        "total": int(prof_runs),
+                        "batch": secrets.token_hex(4),
+                    }
+                    st.rerun()
+            st.caption("Wraps your next reruns of that page in cProfile + tracemalloc. No overhead while disarmed.")
+
+        st.markdown("---")
+        st.subheader("Reconcile User Stats")
+        st.caption("Recomputes points and tasks completed from approved submissions and repairs drifted users.")
+        dry_run = st.checkbox("Dry run (report only)", value=True, key="reconcile_dry_run")
+        if st.button("Run reconciliation"):
+            with st.spinner("Reconciling…"):
+                summary = run_stats_reconciliation(dry_run=dry_run)
+            if not dry_run:
+                audit("stats.reconcile", run_id=summary["run_id"], corrected=summary["corrected"])
+            st.session_state["reconcile_run"] = summary
+        summary = st.session_state.get("reconcile_run")
+        if summary:
+            verb = "would be corrected" if summary["dry_run"] else "corrected"
+            st.success(
+                f"Run {summary['run_id']}: {summary['corrected']} user(s) {verb}, "
+                f"{summary['string_points']} submission(s) with string points, in {summary['seconds']}s."
+            )
+            diffs = summary.get("preview")
+            if diffs is None:
+                diffs = list(stats_reconcile_col.find({"run_id": summary["run_id"]}).limit(RECONCILE_PREVIEW_ROWS))
+            if diffs:
+                st.dataframe(pd.DataFrame([{
+                    "Name": d.get("name", ""),
+                    "Email": d.get("email", ""),
+                    "Points (old → new)": f"{d.get('old_points')} → {d.get('new_points')}",
+                    "Tasks (old → new)": f"{d.get('old_tasks')} → {d.get('new_tasks')}",
+                } for d in diffs]), use_container_width=True, hide_index=True)
+
+        st.markdown("---")
+        st.subheader("Archive Cold Data")
+        st.caption(f"Moves reviewed submissions and assignments of finished tasks, and forum comments, "
+                   f"older than the cutoff to the {ARCHIVE_BACKEND} archive in batches of {ARCHIVE_BATCH_SIZE}.")
+        c1, c2 = st.columns(2)
+        with c1:
+            archive_cutoff = st.date_input(
+                "Archive data older than",
+                value=(datetime.now(timezone.utc) - timedelta(days=ARCHIVE_DEFAULT_CUTOFF_DAYS)).date(),
+                key="archive_cutoff",
+            )
+        with c2:
+            archive_dry_run = st.checkbox("Dry run (count only)", value=True, key="archive_dry_run")
+        if st.button("Run archival"):
+            cutoff = datetime.combine(archive_cutoff, datetime.min.time()).replace(tzinfo=timezone.utc)
+            progress = st.empty()
+            with st.spinner("Archiving…"):
+                summary = archive_cold_data(
+                    cutoff, dry_run=archive_dry_run, admin=st.session_state.admin_username or "",
+                    progress_cb=lambda coll, n: progress.caption(f"{coll}: {n:,} moved"),
+                )
+            progress.empty()
+            if not archive_dry_run:
+                audit("archive.run", run_id=summary["run_id"], cutoff=cutoff, counts=summary["counts"])
+            st.session_state["archive_run"] = summary
+        summary = st.session_state.get("archive_run")
+        if summary:
+            verb = "would be archived" if summary["dry_run"] else "archived"
+            moved = ", ".join(f"{n:,} {ARCHIVE_LABELS[c].lower()}" for c, n in summary["counts"].items())
+            st.success(f"Run {summary['run_id']}: {moved} {verb} in {summary['seconds']}s.")
+        runs = list(archive_runs_col.find({}).sort("created_at", -1).limit(10))
+        if runs:
+            st.dataframe(pd.DataFrame([{
+                "When": r["created_at"].strftime("%Y-%m-%d %H:%M"),
+                "Kind": r["kind"],
+                "Backend": r.get("backend", ""),
+                "By": r.get("by", ""),
+                "Documents": ", ".join(f"{c}: {n:,}" for c, n in r.get("counts", {}).items()),
+            } for r in runs]), use_container_width=True, hide_index=True)
+
+        st.markdown("---")
+        st.subheader("Notification Digests")
+        pending = {r["_id"]: r for r in notification_queue_col.aggregate([
+            {"$match": {"status": "pending"}},
+            {"$group": {"_id": "$period", "items": {"$sum": 1}, "users": {"$addToSet": "$user_id"},
+                        "next": {"$min": "$due_at"}}},
+        ])}
+        cols = st.columns(len(DIGEST_PERIODS) + 1)
+        for col, (period, label) in zip(cols, DIGEST_PERIODS.items()):
+            with col:
+                row = pending.get(period)
+                st.metric(label, f"{row['items'] if row else 0} items",
+                          f"{len(row['users'])} users · next {row['next']:%H:%M} UTC" if row else None,
+                          delta_color="off")
+        with cols[-1]:
+            st.metric("Failed items", notification_queue_col.count_documents({"status": "failed"}))
+        if st.button("Send due digests now"):
+            with st.spinner("Sending digests…"):
+                result = send_due_digests()
+            if result.get("skipped"):
+                st.info("Another replica is sending digests right now.")
+            else:
+                audit("digest.send_now", **result)
+                st.success(f"Sent {result['sent']} digest(s) covering {result['items']} item(s); "
+                           f"{result['failed']} failed.")
+
+        st.markdown("---")
+        st.subheader("Sender Pool")
+        pool = None
+        if not sender_pool_configured():
+            st.info("Email sending not configured: set SENDER_POOL, or GMAIL_ADDRESS and GMAIL_APP_PASSWORD.")
+        else:
+            try:
+                pool = get_sender_pool()
+            except ValueError as e:
+                st.error(f"Email sending not configured: {e}")
+        if pool:
+            usage = pool.usage()
+            c1, c2, c3 = st.columns(3)
+            with c1:
+                st.metric("Accounts", len(usage), f"{sum(1 for u in usage if not u['benched_until'])} healthy",
+                          delta_color="off")
+            with c2:
+                st.metric("Sent today", sum(u["today_sent"] for u in usage))
+            with c3:
+                st.metric("Quota left today", f"{sum(u['remaining'] for u in usage)} / "
+                                              f"{sum(u['daily_quota'] for u in usage)}")
+            st.dataframe(pd.DataFrame([{
+                "Account": f"{u['name']} <{u['address']}>",
+                "Today (sent / failed)": f"{u['today_sent']} / {u['today_failed']}",
+                "Remaining": f"{u['remaining']} of {u['daily_quota']}",
+                "Per minute": u["per_minute"],
+                "7 days (sent / failed)": f"{u['week_sent']} / {u['week_failed']}",
+                "Status": (f"⏸️ {u['reason']} until {u['benched_until']:%H:%M} UTC" if u["benched_until"]
+                           else "✅ healthy"),
+                "Last error": u["last_error"][:120],
+            } for u in usage]), use_container_width=True, hide_index=True)
+            benched = [u["address"] for u in usage if u["benched_until"]]
+            if benched:
+                c1, c2 = st.columns([3, 1])
+                with c1:
+                    to_reinstate = st.selectbox("Benched account", benched, key="sender_reinstate")
+                with c2:
+                    st.write("")
+                    if st.button("Reinstate", use_container_width=True):
+                        pool.reinstate(to_reinstate)
+                        audit("sender.reinstate", "sender", to_reinstate)
+                        st.rerun()
+            st.caption(f"Accounts come from SENDER_POOL (or GMAIL_ADDRESS). Throttled accounts rest "
+                       f"{SENDER_THROTTLE_COOLDOWN // 60} min, rejected logins {SENDER_AUTH_COOLDOWN // 3600} h, "
+                       f"and a spent daily quota until midnight UTC.")
+
+        st.markdown("---")
+        st.subheader("Cache Sync")
+        versions = get_cache_versions()
+        watcher = start_cache_watcher()
+        c1, c2, c3 = st.columns(3)
+        with c1:
+            st.metric("Mode", "Change streams" if versions.mode == "stream" else f"TTL-only ({CACHE_FALLBACK_TTL}s)")
+        with c2:
+            st.metric("Events applied", versions.events_seen)
+        with c3:
+            last = versions.last_event_at
+            st.metric("Last event", last.strftime("%H:%M:%S") if last else "—")
+        if watcher.last_error:
+            st.caption(f"Watcher: {watcher.last_error}")
+        if st.button("Invalidate all caches"):
+            versions.bump_all()
+            audit("cache.invalidate_all")
+            st.success("Cache versions bumped.")
+
+    # --- Tab 4: Profiles ---
+    with tabs[3]:
+        st.subheader("Rerun Profiles")
+        profiles = list(perf_profiles_col.find({}, {"functions": 0, "allocations": 0})
+                        .sort("created_at", -1).limit(100))
+        if not profiles:
+            st.info("No profiles yet. Arm the profiler from the Tools tab.")
+        else:
+            labels = {
+                str(p["_id"]): f"{p['created_at'].strftime('%m-%d %H:%M:%S')} · {p['page']} · "
+                               f"run {p.get('run', 1)} · {p['wall_ms']} ms · {_peak_label(p)}"
+                for p in profiles
+            }
+            st.dataframe(pd.DataFrame([{
+                "When": p["created_at"].strftime("%Y-%m-%d %H:%M:%S"),
+                "Page": p["page"],
+                "Admin": p.get("admin", ""),
+                "Batch": p.get("batch", ""),
+                "Run": p.get("run", 1),
+                "Wall (ms)": p["wall_ms"],
+                "Peak (KB)": p.get("peak_kb"),
+            } for p in profiles]), use_container_width=True, hide_index=True)
+            st.caption("Memory is traced process-wide: allocations by other sessions' reruns that overlap "
+                       "a profiled run are counted too. Runs without a peak had tracing already active.")
+
+            picked = st.multiselect("Select one profile to inspect, or two to compare",
+                                    list(labels.keys()), format_func=lambda k: labels[k],
+                                    max_selections=2, key="perf_pick")
+            docs = [perf_profiles_col.find_one({"_id": ObjectId(k)}) for k in picked]
+            if len(docs) == 1:
+                d = docs[0]
+                st.markdown("**Top functions by cumulative time**")
+                st.dataframe(pd.DataFrame(d["functions"]), use_container_width=True, hide_index=True)
+                st.markdown("**Top allocation sites**")
+                st.dataframe(pd.DataFrame(d["allocations"]), use_container_width=True, hide_index=True)
+            elif len(docs) == 2:
+                a, b = docs
+                c1, c2 = st.columns(2)
+                with c1:
+                    st.metric("Wall (ms)", b["wall_ms"], round(b["wall_ms"] - a["wall_ms"], 1), delta_color="inverse")
+                with c2:
+                    if a.get("peak_kb") is not None and b.get("peak_kb") is not None:
+                        st.metric("Peak (KB)", b["peak_kb"], round(b["peak_kb"] - a["peak_kb"], 1),
+                                  delta_color="inverse")
+                    else:
+                        st.metric("Peak (KB)", b.get("peak_kb") if b.get("peak_kb") is not None else "n/a")
+                fa = pd.DataFrame(a["functions"])[["function", "cumtime_ms"]].rename(columns={"cumtime_ms": "A (ms)"})
+                fb = pd.DataFrame(b["functions"])[["function", "cumtime_ms"]].rename(columns={"cumtime_ms": "B (ms)"})
+                cmp_df = fa.merge(fb, on="function", how="outer").fillna(0)
+                cmp_df["Δ (ms)"] = (cmp_df["B (ms)"] - cmp_df["A (ms)"]).round(2)
+                st.dataframe(cmp_df.sort_values("Δ (ms)", key=abs, ascending=False),
+                             use_container_width=True, hide_index=True)
+
+    # --- Tab 5: Audit Log ---
+    with tabs[4]:
+        st.subheader("Audit Log")
+        buf = get_audit_buffer()
+        c1, c2, c3, c4 = st.columns(4)
+        with c1:
+            st.metric("Queued", buf.pending())
+        with c2:
+            st.metric("Written", buf.flushed)
+        with c3:
+            st.metric("Dropped", buf.dropped)
+        with c4:
+            st.write("")
+            if st.button("Flush now", use_container_width=True):
+                buf.flush()
+                st.rerun()
+        if buf.last_error:
+            st.caption(f"Last flush error: {buf.last_error}")
+        if buf.sanitized:
+            st.caption(f"{buf.sanitized} event(s) written with unencodable values stored as text.")
+
+        usernames = [a["username"] for a in admin_col.find({}, {"username": 1}).sort("username", 1) if a.get("username")]
+        c1, c2, c3 = st.columns(3)
+        with c1:
+            f_admin = st.selectbox("Admin", ["Any"] + usernames, key="audit_admin")
+        with c2:
+            f_action = st.selectbox("Action", ["Any"] + sorted(admin_audit_col.distinct("action")), key="audit_action")
+        with c3:
+            today = datetime.now(timezone.utc).date()
+            f_range = st.date_input("Date range", value=(today - timedelta(days=7), today), key="audit_range")
+        # served by the (admin, ts) / (action, ts) indexes; ts alone uses the TTL index
+        query = {}
+        if f_admin != "Any":
+            query["admin"] = f_admin
+        if f_action != "Any":
+            query["action"] = f_action
+        if isinstance(f_range, (list, tuple)) and len(f_range) == 2:
+            start = datetime.combine(f_range[0], datetime.min.time()).replace(tzinfo=timezone.utc)
+            end = datetime.combine(f_range[1], datetime.min.time()).replace(tzinfo=timezone.utc) + timedelta(days=1)
+            query["ts"] = {"$gte": start, "$lt": end}
+        events = list(admin_audit_col.find(query).sort("ts", -1).limit(500))
+        if events:
+            st.dataframe(pd.DataFrame([{
+                "When": e["ts"].strftime("%Y-%m-%d %H:%M:%S"),
+                "Admin": e.get("admin", ""),
+                "Role": e.get("role") or "",
+                "Action": e["action"],
+                "Target": f"{e['target']['type']} {e['target'].get('id') or ''}".strip() if e.get("target") else "",
+                "Details": ", ".join(f"{k}={v}" for k, v in (e.get("details") or {}).items()),
+            } for e in events]), use_container_width=True, hide_index=True)
+            if len(events) == 500:
+                st.caption("Showing the 500 most recent matching events; narrow the filters to see older ones.")
+        else:
+            st.info("No audit events match these filters.")
+
+    # --- Tab 6: Metrics ---
+    with tabs[5]:
+        st.subheader("Portal Metrics")
+        st.caption(f"Prometheus endpoint: http://{METRICS_HOST}:{METRICS_PORT}/metrics · "
+                   f"snapshots every {METRICS_SNAPSHOT_SECONDS}s, kept {METRICS_RETENTION_DAYS} days")
+        latest = {s["_id"]: s for s in db.metrics_snapshots.aggregate([
+            {"$sort": {"host": 1, "ts": -1}},
+            {"$group": {"_id": "$host", "ts": {"$first": "$ts"}, "counters": {"$first": "$counters"},
+                        "histograms": {"$first": "$histograms"}}},
+        ])}
+        this_host = f"{socket.gethostname()}:{os.getpid()}"
+        source = st.selectbox(
+            "Source", ["live"] + sorted(latest),
+            format_func=lambda h: f"This process ({this_host}, live)" if h == "live"
+            else f"{h} · snapshot {latest[h]['ts']:%m-%d %H:%M:%S}",
+            key="metrics_source",
+        )
+        render_metrics_snapshot(METRICS.snapshot() if source == "live" else latest[source])
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,188 @@
+"""
+Queries-per-interaction benchmark for the fragment-based panels in app.py.
+
+For each interaction (typing in a search box, changing a task's email scope,
+editing a submission's points, changing an admin's role) it counts the MongoDB
+commands issued when
+
+  * full   – the whole script reruns, as every widget change did before fragments
+  * frag   – only the fragment owning the widget reruns, as the browser asks for
+
+Both sides load the full app through Streamlit's AppTest against the seeded
+database from query_audit.py, log in, open the page and make the same widget
+change with caches warm; only commands sent after the change are counted.
+AppTest always reruns the whole script, so the frag side uses FragmentAppTest,
+which keeps the page's fragments between runs and requests a rerun of just the
+one that owns the widget.
+
+    python bench_fragments.py
+    python bench_fragments.py --uri mongodb://localhost:27017 --users 5000 --submissions 20000
+"""
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+from dataclasses import replace
+from unittest.mock import patch
+
+import pymongo
+from pymongo import monitoring
+from streamlit.runtime.fragment import MemoryFragmentStorage
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1 import app_test as app_test_module
+from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+from query_audit import APP_PATH, HERE, CommandRecorder, seed
+
+
+class FragmentAppTest(AppTest):
+    """
+    AppTest whose fragments survive between runs. With `fragment_id` set, the next
+    widget change reruns only that fragment (the RerunData the browser sends for a
+    widget inside a fragment) instead of the whole script.
+    """
+
+    def __init__(self, script_path: str, *, default_timeout: float):
+        super().__init__(script_path, default_timeout=default_timeout)
+        self.fragments = MemoryFragmentStorage()
+        self.fragment_id = None
+
+    def _run(self, widget_state=None, timeout=None):
+        test = self
+
+        class Runner(LocalScriptRunner):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self._fragment_storage = test.fragments
+
+            def request_rerun(self, rerun_data):
+                if test.fragment_id and rerun_data.widget_states is not None:
+                    rerun_data = replace(rerun_data, fragment_id_queue=[test.fragment_id])
+                return super().request_rerun(rerun_data)
+
+        with patch.object(app_test_module, "LocalScriptRunner", Runner):
+            return super()._run(widget_state, timeout)
+
+    def fragment_for(self, name: str, key: str) -> str:
+        """Id of the stored fragment running function `name` for the item in widget `key`."""
+        item = key.rsplit("_", 1)[-1]
+        found = []
+        for fid, wrapped in self.fragments._fragments.items():
+            # st.fragment keeps the function and its call arguments in the wrapper's closure
+            cells = dict(zip(wrapped.__code__.co_freevars, (c.cell_contents for c in wrapped.__closure__)))
+            func = cells.get("non_optional_func")
+            if func is not None and func.__name__ == name:
+                found.append((fid, repr(cells.get("args"))))
+        if len(found) > 1:
+            found = [f for f in found if item in f[1]]
+        if len(found) != 1:
+            raise RuntimeError(f"expected one stored fragment for {name} / {key}, found {len(found)}")
+        return found[0][0]
+
+
+def _widget(at, kind, prefix):
+    for w in getattr(at, kind):
+        if w.key and w.key.startswith(prefix):
+            return w
+    return None
+
+
+def _apply(widget, kind, value):
+    return widget.input(value) if kind == "text_input" else widget.set_value(value)
+
+
+def _commands_since(recorder, mark):
+    return recorder.commands[mark:]
+
+
+def measure(recorder, token, page, setup, kind, key_prefix, value, timeout, fragment=None):
+    """
+    Commands for one widget change on `page`: a whole-script rerun, or with `fragment`
+    set, a rerun of just that fragment. Returns (commands, seconds).
+    """
+    at = FragmentAppTest(APP_PATH, default_timeout=timeout)
+    at.session_state["session_token"] = token
+    at.session_state["effective_role"] = "superadmin"
+    at.run()
+    at.sidebar.selectbox[0].set_value(page).run()
+    for s_kind, s_key, s_value in setup:
+        _apply(getattr(at, s_kind)(key=s_key), s_kind, s_value).run()
+    widget = _widget(at, kind, key_prefix)
+    if widget is None:
+        raise RuntimeError(f"{page}: no {kind} with key prefix {key_prefix!r}")
+    if fragment:
+        at.fragment_id = at.fragment_for(fragment, widget.key)
+    mark = len(recorder.commands)
+    t0 = time.perf_counter()
+    _apply(widget, kind, value).run()
+    elapsed = time.perf_counter() - t0
+    for exc in at.exception:
+        print(f"  ! {page} ({fragment or 'full'}): {exc.value}")
+    return _commands_since(recorder, mark), elapsed
+
+
+def interactions(sample_user):
+    """(label, page, setup actions, widget kind, key prefix, new value, fragment function)."""
+    return [
+        ("rank lookup", "📊 Dashboard", [], "text_input", "dash_rank_email", sample_user["email"],
+         "user_rank_lookup"),
+        ("assign: user search", "📝 Tasks", [], "text_input", "user_search_existing_outside", "user1",
+         "assign_task_panel"),
+        ("email: scope change", "📝 Tasks", [], "radio", "scope_", "track", "task_email_panel"),
+        ("email: template change", "📝 Tasks", [], "selectbox", "tmpl_", "reminder", "task_email_panel"),
+        ("review: edit points", "📄 Submissions", [("radio", "submissions_mode", "📋 Browse all")],
+         "number_input", "points_", 7, "submission_review_controls"),
+        ("admin card: role select", "🛡️ Superadmin", [], "selectbox", "role_sel_", "superadmin",
+         "admin_card"),
+    ]
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--uri", default=os.getenv("AUDIT_MONGO_URI", "mongodb://localhost:27017"))
+    ap.add_argument("--db", default="innoverse_fragment_bench")
+    ap.add_argument("--users", type=int, default=3000)
+    ap.add_argument("--tasks", type=int, default=60)
+    ap.add_argument("--submissions", type=int, default=8000)
+    ap.add_argument("--forums", type=int, default=30)
+    ap.add_argument("--timeout", type=float, default=60.0, help="seconds per AppTest run")
+    ap.add_argument("--verbose", action="store_true", help="print the commands each side issued")
+    args = ap.parse_args(argv)
+
+    recorder = CommandRecorder(args.db)
+    monitoring.register(recorder)      # before app.py creates its clients
+
+    db = pymongo.MongoClient(args.uri)[args.db]
+    print(f"Seeding {args.db} …")
+    token, _, sample_user = seed(db, args.users, args.tasks, args.submissions, args.forums)
+    os.environ.update({
+        "MONGO_URI": args.uri,
+        "DATABASE_NAME": args.db,
+        "GMAIL_ADDRESS": os.getenv("GMAIL_ADDRESS", "bench@example.com"),
+        "GMAIL_APP_PASSWORD": os.getenv("GMAIL_APP_PASSWORD", "unused"),
+    })
+    sys.path.insert(0, HERE)
+
+    rows = []
+    for label, page, setup, kind, prefix, value, fragment in interactions(sample_user):
+        # First pass warms the per-process caches; second pass is measured
+        measure(recorder, token, page, setup, kind, prefix, value, args.timeout)
+        full_cmds, full_s = measure(recorder, token, page, setup, kind, prefix, value, args.timeout)
+        measure(recorder, token, page, setup, kind, prefix, value, args.timeout, fragment)
+        frag_cmds, frag_s = measure(recorder, token, page, setup, kind, prefix, value, args.timeout, fragment)
+        rows.append((label, len(full_cmds), len(frag_cmds), full_s, frag_s))
+        if args.verbose:
+            for side, cmds in (("full", full_cmds), ("frag", frag_cmds)):
+                counts = Counter(f"{name} {cmd.get(name)}" for name, cmd in cmds)
+                print(f"  {label} [{side}]: " + ", ".join(f"{k}×{n}" for k, n in counts.most_common()))
+
+    print(f"\n{'interaction':<26}{'full':>8}{'frag':>8}{'saved':>8}{'full ms':>10}{'frag ms':>10}")
+    for label, full_n, frag_n, full_s, frag_s in rows:
+        saved = f"{100 * (full_n - frag_n) / full_n:.0f}%" if full_n else "-"
+        print(f"{label:<26}{full_n:>8}{frag_n:>8}{saved:>8}{full_s * 1000:>10.0f}{frag_s * 1000:>10.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+Timing and correctness check for the per-track funnel (app.track_funnels).
+
+Seeds a database with query_audit.seed (100k users by default), then runs the
+funnel aggregation cold a few times and reports the wall time of each run. The
+result is checked against the same funnel counted in Python from the raw
+collections: registered, assigned, submitted and approved users per track.
+
+    python bench_funnels.py
+    python bench_funnels.py --uri mongodb://localhost:27017 --users 100000 --submissions 300000 --budget 5
+
+Exits 1 if the counts differ or the slowest run exceeds --budget seconds.
+"""
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+
+import pymongo
+
+from query_audit import HERE, seed
+
+
+def expected_funnel(db) -> dict:
+    """(track, stage) → users, counted in Python."""
+    track = {u["_id"]: (u.get("profile") or {}).get("coding_track") or "unknown"
+             for u in db.users.find({}, {"profile.coding_track": 1})}
+    assigned = {a["user_id"] for a in db.task_assignments.find({}, {"user_id": 1})}
+    submitted, approved = set(), set()
+    for s in db.submissions.find({}, {"user_id": 1, "status": 1}):
+        submitted.add(s["user_id"])
+        if s.get("status") == "approved":
+            approved.add(s["user_id"])
+    counts = Counter()
+    for uid, t in track.items():
+        counts[(t, "registered")] += 1
+        counts[(t, "assigned")] += uid in assigned
+        counts[(t, "submitted")] += uid in submitted
+        counts[(t, "approved")] += uid in approved
+    return counts
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--uri", default=os.getenv("AUDIT_MONGO_URI", "mongodb://localhost:27017"))
+    ap.add_argument("--db", default="innoverse_funnel_bench")
+    ap.add_argument("--users", type=int, default=100_000)
+    ap.add_argument("--tasks", type=int, default=60)
+    ap.add_argument("--submissions", type=int, default=200_000)
+    ap.add_argument("--runs", type=int, default=3)
+    ap.add_argument("--budget", type=float, default=5.0, help="seconds the slowest run may take")
+    args = ap.parse_args(argv)
+
+    db = pymongo.MongoClient(args.uri)[args.db]
+    print(f"Seeding {args.db} with {args.users:,} users and {args.submissions:,} submissions …")
+    seed(db, args.users, args.tasks, args.submissions, 1)     # forums play no part here
+    os.environ.update({
+        "MONGO_URI": args.uri,
+        "DATABASE_NAME": args.db,
+        "GMAIL_ADDRESS": os.getenv("GMAIL_ADDRESS", "bench@example.com"),
+        "GMAIL_APP_PASSWORD": os.getenv("GMAIL_APP_PASSWORD", "unused"),
+    })
+    sys.path.insert(0, HERE)
+    import app
+    app.ensure_indexes()
+
+    times, funnel = [], None
+    for _ in range(args.runs):
+        app.track_funnels.clear()
+        t0 = time.perf_counter()
+        funnel = app.track_funnels(app._utc_day())
+        times.append(time.perf_counter() - t0)
+    print("runs: " + ", ".join(f"{t:.2f}s" for t in times))
+
+    failures = []
+    want = expected_funnel(db)
+    labels = {code: app.TRACKS.get(code, "Unknown") for code, _ in want}
+    got = {(r.track, r.stage): r.users for r in funnel.itertuples()}
+    for (code, stage), n in sorted(want.items()):
+        key = (labels[code], app.FUNNEL_STAGES[stage])
+        if got.get(key, 0) != n:
+            failures.append(f"{key}: expected {n}, got {got.get(key, 0)}")
+    print(f"{len(want) // len(app.FUNNEL_STAGES)} track(s), "
+          f"{sum(n for (_, s), n in want.items() if s == 'registered'):,} users counted")
+    if max(times) > args.budget:
+        failures.append(f"slowest run {max(times):.2f}s, over the {args.budget:g}s budget")
+
+    db.client.drop_database(args.db)
+    for f in failures:
+        print(f"FAIL {f}")
+    print(f"\n{len(failures)} failure(s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
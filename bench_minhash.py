@@ -0,0 +1,168 @@
+"""
+Benchmark for the MinHash/LSH near-duplicate index in app.py.
+
+Generates a synthetic corpus (default 100k submissions spread over 100 tasks)
+with planted copies: a fraction of submissions are another student's text
+with some words swapped, inserted or dropped. It then measures
+
+  * signing throughput: shingle_hashes + minhash_signature + lsh_bands
+  * candidate generation per task: band buckets, the same grouping the
+    $group over submission_signatures does, against all n·(n-1)/2 pairs
+  * recall / precision against the planted pairs, using exact Jaccard on the
+    shingle sets as ground truth
+  * brute force on one task (exact Jaccard over every pair), extrapolated
+    to the whole corpus
+
+Everything runs in memory, so no MongoDB is needed.
+
+    python bench_minhash.py
+    python bench_minhash.py --submissions 20000 --tasks 20 --dup-rate 0.05 --threshold 0.7
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_corpus(n: int, n_tasks: int, dup_rate: float, seed: int):
+    """Returns (docs, planted): docs are (task, user, text); planted holds (original, copy) indexes."""
+    rnd = random.Random(seed)
+    vocab = [f"w{i}" for i in range(20000)]
+    cum = list(itertools.accumulate(1 / (i + 1) for i in range(len(vocab))))   # Zipf-ish word frequencies
+    docs, planted = [], []
+    by_task = defaultdict(list)
+    for i in range(n):
+        task = rnd.randrange(n_tasks)
+        if by_task[task] and rnd.random() < dup_rate:
+            src = rnd.choice(by_task[task])
+            words = docs[src][2].split()
+            edits = rnd.uniform(0.0, 0.15)                    # fraction of words touched
+            for _ in range(int(len(words) * edits)):
+                j = rnd.randrange(len(words))
+                op = rnd.random()
+                if op < 0.5:
+                    words[j] = rnd.choice(vocab)
+                elif op < 0.75:
+                    words.insert(j, rnd.choice(vocab))
+                elif len(words) > 5:
+                    del words[j]
+            planted.append((src, i))
+            text = " ".join(words)
+        else:
+            text = " ".join(rnd.choices(vocab, cum_weights=cum, k=rnd.randint(40, 300)))
+        docs.append((task, i, text))
+        by_task[task].append(i)
+    return docs, planted
+
+
+def jaccard(a: np.ndarray, b: np.ndarray) -> float:
+    if not len(a) and not len(b):
+        return 1.0
+    inter = len(np.intersect1d(a, b, assume_unique=True))
+    return inter / (len(a) + len(b) - inter)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--submissions", type=int, default=100_000)
+    ap.add_argument("--tasks", type=int, default=100)
+    ap.add_argument("--dup-rate", type=float, default=0.02, help="fraction of submissions that are copies")
+    ap.add_argument("--threshold", type=float, default=None, help="defaults to app.SIMILARITY_THRESHOLD")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args(argv)
+
+    os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")   # app.py connects lazily
+    sys.path.insert(0, HERE)
+    import app
+    threshold = args.threshold if args.threshold is not None else app.SIMILARITY_THRESHOLD
+
+    t0 = time.perf_counter()
+    docs, planted = make_corpus(args.submissions, args.tasks, args.dup_rate, args.seed)
+    print(f"Corpus: {len(docs)} submissions, {args.tasks} tasks, {len(planted)} planted copies "
+          f"({time.perf_counter() - t0:.1f}s to generate)")
+
+    # --- signing ---
+    t0 = time.perf_counter()
+    shingles = [app.shingle_hashes(text) for _, _, text in docs]
+    t_shingle = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    sigs = [app.minhash_signature(s) for s in shingles]
+    t_minhash = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    bands = [app.lsh_bands(s) if s is not None else [] for s in sigs]
+    t_bands = time.perf_counter() - t0
+    total = t_shingle + t_minhash + t_bands
+    print(f"\nSigning ({app.SIMILARITY_PARAMS})")
+    print(f"  shingles   {t_shingle:7.2f}s")
+    print(f"  minhash    {t_minhash:7.2f}s")
+    print(f"  bands      {t_bands:7.2f}s")
+    print(f"  total      {total:7.2f}s  ({len(docs) / total:,.0f} submissions/s, "
+          f"{1e6 * total / len(docs):.0f} µs each)")
+
+    # --- LSH candidates per task, as the $group over (task_id, bands) ---
+    t0 = time.perf_counter()
+    buckets = defaultdict(list)
+    for i, (task, _, _) in enumerate(docs):
+        for b in bands[i]:
+            buckets[(task, b)].append(i)
+    candidates = set()
+    for ids in buckets.values():
+        if len(ids) < 2:
+            continue
+        if len(ids) > app.SIMILARITY_MAX_BUCKET:
+            candidates.update((ids[0], o) for o in ids[1:])
+        else:
+            candidates.update((a, b) for k, a in enumerate(ids) for b in ids[k + 1:])
+    t_candidates = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    found = {(a, b) for a, b in candidates
+             if np.count_nonzero(sigs[a] == sigs[b]) / app.SIMILARITY_PERMUTATIONS >= threshold}
+    t_verify = time.perf_counter() - t0
+    per_task = defaultdict(int)
+    for task, _, _ in docs:
+        per_task[task] += 1
+    all_pairs = sum(n * (n - 1) // 2 for n in per_task.values())
+    print(f"\nCandidates (per task, threshold {threshold})")
+    print(f"  all pairs         {all_pairs:>14,}")
+    print(f"  LSH candidates    {len(candidates):>14,}  ({100 * len(candidates) / max(all_pairs, 1):.4f}% of pairs)")
+    print(f"  bucket + verify   {t_candidates:7.2f}s + {t_verify:.2f}s")
+
+    # --- quality against exact Jaccard ---
+    truth = {(min(a, b), max(a, b)) for a, b in planted if jaccard(shingles[a], shingles[b]) >= threshold}
+    hits = {(min(a, b), max(a, b)) for a, b in found}
+    recall = len(truth & hits) / len(truth) if truth else 1.0
+    checked = list(hits - truth)
+    false_pos = sum(1 for a, b in checked if jaccard(shingles[a], shingles[b]) < threshold - 0.1)
+    print(f"\nQuality (ground truth: planted pairs with exact Jaccard >= {threshold})")
+    print(f"  planted above threshold  {len(truth):>8,}")
+    print(f"  recall                   {recall:>8.1%}")
+    print(f"  reported pairs           {len(hits):>8,}  ({false_pos} below {threshold - 0.1:.2f} exact Jaccard)")
+
+    # --- brute force on the largest task, extrapolated ---
+    task, n = max(per_task.items(), key=lambda kv: kv[1])
+    ids = [i for i, d in enumerate(docs) if d[0] == task]
+    sample = ids[:min(len(ids), 600)]
+    sets = [set(shingles[i].tolist()) for i in sample]
+    t0 = time.perf_counter()
+    for k, a in enumerate(sets):
+        for b in sets[k + 1:]:
+            _ = len(a & b) / (len(a | b) or 1)
+    t_sample = time.perf_counter() - t0
+    sample_pairs = len(sample) * (len(sample) - 1) // 2
+    est = t_sample / sample_pairs * all_pairs
+    lsh = total + t_candidates + t_verify
+    print(f"\nBrute force (exact Jaccard, {sample_pairs:,} pairs from task {task})")
+    print(f"  {1e6 * t_sample / sample_pairs:.1f} µs/pair → ~{est:,.0f}s for all {all_pairs:,} pairs "
+          f"vs {lsh:.1f}s for LSH end to end ({est / lsh:,.0f}×)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+Memory/CPU benchmark for the raw-BSON row views in app.py.
+
+Builds synthetic submission documents (long submission text, status history,
+link-check results) and encodes them to BSON, as they would arrive in cursor
+batches. Each page read path is then run three ways:
+
+  * dict      – every field decoded into a dict, as the pages used to do
+  * dict+proj – the same, but only over the fields the page's projection returns
+  * rows      – RawBSONDocument wrapped in the page's RowView (projection applied)
+
+and reports build time, the time to read the fields the page renders, and the
+memory still held by the page's list (tracemalloc) afterwards.
+
+Everything runs in memory, so no MongoDB is needed.
+
+    python bench_rawbson.py
+    python bench_rawbson.py --submissions 50000 --text-kb 8
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import bson
+from bson import ObjectId
+from bson.raw_bson import RawBSONDocument
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_submissions(n: int, text_kb: float, seed: int) -> list[dict]:
+    rnd = random.Random(seed)
+    words = [f"word{i}" for i in range(5000)]
+    tasks = [ObjectId() for _ in range(50)]
+    now = datetime(2025, 1, 1)
+    docs = []
+    for _ in range(n):
+        text = " ".join(rnd.choices(words, k=int(rnd.uniform(0.5, 1.5) * text_kb * 1024 / 8)))
+        submitted = now - timedelta(minutes=rnd.randrange(200_000))
+        status = rnd.choice(["pending", "approved", "rejected"])
+        docs.append({
+            "_id": ObjectId(),
+            "user_id": ObjectId(),
+            "task_id": rnd.choice(tasks),
+            "status": status,
+            "points": rnd.randrange(0, 100),
+            "submitted_at": submitted,
+            "submission_url": f"https://github.com/student{rnd.randrange(10**6)}/project",
+            "submission_text": text,
+            "status_history": [{"from": "pending", "to": status, "by": "reviewer", "at": submitted}
+                               for _ in range(rnd.randrange(0, 4))],
+            "link_check": {"status": "ok", "code": 200, "checked_at": submitted, "final_url": None},
+            "reviewed_by": "reviewer",
+            "claimed_by": None,
+            "updated_at": submitted,
+        })
+    return docs
+
+
+def project(doc: dict, fields: dict) -> dict:
+    """The server's projection: field paths up to one level deep, and {"out": {"f": "$f"}} objects."""
+    out = {} if fields.get("_id", 1) == 0 else {"_id": doc["_id"]}
+    for path, keep in fields.items():
+        if isinstance(keep, dict):
+            out[path] = {k: doc[v[1:]] for k, v in keep.items() if v[1:] in doc}
+            continue
+        if not keep or path == "_id":
+            continue
+        head, _, rest = path.partition(".")
+        if head not in doc:
+            continue
+        if rest:
+            if rest in (doc[head] or {}):
+                out.setdefault(head, {})[rest] = doc[head][rest]
+        else:
+            out[head] = doc[head]
+    return out
+
+
+def batch(docs: list[bytes]) -> tuple[bytes, list[tuple[int, int]]]:
+    """One buffer with every document, like a cursor batch, and each document's offsets."""
+    offsets, pos = [], 0
+    for d in docs:
+        offsets.append((pos, pos + len(d)))
+        pos += len(d)
+    return b"".join(docs), offsets
+
+
+def measure(build, read, repeat: int = 3):
+    """(best build seconds, best read seconds, bytes held by the built list)."""
+    t_build = t_read = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        rows = build()
+        t_build = min(t_build, time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        read(rows)
+        t_read = min(t_read, time.perf_counter() - t0)
+        del rows
+    # memory separately: tracemalloc slows every allocation down
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    rows = build()
+    read(rows)
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    del rows
+    return t_build, t_read, held
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--submissions", type=int, default=20_000)
+    ap.add_argument("--text-kb", type=float, default=4.0, help="average submission_text size")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args(argv)
+
+    os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")   # app.py connects lazily
+    sys.path.insert(0, HERE)
+    import app
+
+    docs = make_submissions(args.submissions, args.text_kb, args.seed)
+
+    def browse_read(rows):
+        # what the Browse expander header and body render; the text only for the first page of 20
+        for i, s in enumerate(rows):
+            _ = (s["_id"], s["user_id"], s["task_id"], s["status"], s.get("points", 0),
+                 s.get("submitted_at"), s.get("submission_url"), s.get("link_check"))
+            if i < 20:
+                _ = s.get("submission_text")
+
+    def analytics_read(rows):
+        for s in rows:
+            _ = (s["task_id"], s["status"])
+
+    scenarios = [
+        ("submissions browse", app.SubmissionRow, browse_read),
+        ("task performance", app.SubmissionStatusRow, analytics_read),
+    ]
+    # each document is sliced out of the batch buffer, as the cursor does, so its bytes count
+    full, full_at = batch([bson.encode(d) for d in docs])
+    print(f"{len(docs)} submissions, {len(full) / len(docs) / 1024:.1f} KiB BSON each on average\n")
+    print(f"{'page':<20}{'mode':<11}{'build ms':>10}{'read ms':>10}{'held MiB':>10}")
+    for label, row_cls, read in scenarios:
+        plain = {k: v for k, v in row_cls.projection().items() if not isinstance(v, dict)} \
+            if not row_cls.LAZY else {name: 1 for name in row_cls.FIELDS + row_cls.LAZY}
+        proj, proj_at = batch([bson.encode(project(d, plain)) for d in docs])
+        rows, rows_at = batch([bson.encode(project(d, row_cls.projection())) for d in docs])
+        results = {
+            "dict": measure(lambda: [bson.decode(full[s:e]) for s, e in full_at], read),
+            "dict+proj": measure(lambda: [bson.decode(proj[s:e]) for s, e in proj_at], read),
+            "rows": measure(lambda: [row_cls(RawBSONDocument(rows[s:e])) for s, e in rows_at], read),
+        }
+        for mode, (t_build, t_read, held) in results.items():
+            print(f"{label:<20}{mode:<11}{t_build * 1000:>10.0f}{t_read * 1000:>10.0f}{held / 2**20:>10.1f}")
+        base, after = results["dict"], results["rows"]
+        print(f"{'':<20}{'vs dict':<11}{100 * (1 - after[0] / base[0]):>9.0f}%"
+              f"{100 * (1 - after[1] / base[1]):>9.0f}%{100 * (1 - after[2] / base[2]):>9.0f}%\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
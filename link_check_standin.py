@@ -0,0 +1,184 @@
+"""
+Local stand-in for the submission link checker in app.py.
+
+Starts a throwaway HTTP server with one route per outcome the checker has to
+tell apart (ok, redirect, 404, private, slow, HEAD-rejecting, 500), then runs
+app.check_urls against it and checks
+
+  * every URL gets the expected status, and the Host header names the host
+    the URL gave, not the address the checker connected to
+  * no more than LINK_CHECK_PER_HOST requests to one host were in flight at once
+  * a slow host times out without holding up the rest of the batch
+  * internal addresses are refused: a redirect to the metadata address, and,
+    once 127.0.0.0/8 is no longer allowed, the stand-in itself, ::1 and a
+    private address, all without a request being sent
+
+The stand-in runs on 127.0.0.1, which the checker only reaches because this
+script sets LINK_CHECK_ALLOWED_NETWORKS. No MongoDB or network access is needed.
+
+    python link_check_standin.py
+    python link_check_standin.py --copies 40 --timeout 1.5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """Routes keyed by the first path segment; /<route>/<n> lets one route appear many times."""
+    client_timeout = 1.0
+    slow_seconds = 3.0
+    latency = 0.05
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+    requests = 0
+    expected_host = ""
+
+    def _route(self):
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.requests += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        route = self.path.strip("/").split("/")[0]
+        # the checker gives up on /slow after client_timeout, so that is all the slot it holds
+        time.sleep(cls.client_timeout - cls.latency if route == "slow" else cls.latency)
+        # release before replying: once the reply is out the checker may start the next request
+        with cls.lock:
+            cls.in_flight -= 1
+        if route == "ok":
+            return self._reply(200)
+        if route == "redirect":
+            return self._reply(302, {"Location": "/ok/moved"})
+        if route == "to-internal":
+            return self._reply(302, {"Location": "http://169.254.169.254/latest/meta-data/"})
+        if route == "host-header":
+            return self._reply(200 if self.headers.get("Host") == cls.expected_host else 400)
+        if route == "private":
+            return self._reply(403)
+        if route == "error":
+            return self._reply(500)
+        if route == "head-405":
+            return self._reply(405 if self.command == "HEAD" else 200)
+        if route == "slow":
+            time.sleep(cls.slow_seconds - cls.client_timeout)
+            return self._reply(200)
+        return self._reply(404)
+
+    def _reply(self, code, headers=None):
+        body = b"" if self.command == "HEAD" else f"{code}\n".encode()
+        self.send_response(code)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    do_GET = do_HEAD = _route
+
+    def log_message(self, *args):
+        pass
+
+
+EXPECTED = {
+    "ok": "ok",
+    "redirect": "redirect",
+    "missing": "broken",
+    "private": "private",
+    "error": "broken",
+    "head-405": "ok",
+    "slow": "timeout",
+    "to-internal": "blocked",
+    "host-header": "ok",
+}
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--copies", type=int, default=10, help="URLs per route")
+    ap.add_argument("--timeout", type=float, default=1.0, help="checker timeout in seconds")
+    args = ap.parse_args(argv)
+
+    # app.py connects lazily, so a placeholder URI is enough to import it
+    os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+    os.environ.setdefault("GMAIL_ADDRESS", "standin@example.com")
+    os.environ.setdefault("GMAIL_APP_PASSWORD", "unused")
+    os.environ["LINK_CHECK_ALLOWED_NETWORKS"] = "127.0.0.0/8"     # the stand-in, and nothing else
+    sys.path.insert(0, HERE)
+    import app
+
+    StandinHandler.client_timeout = args.timeout
+    StandinHandler.slow_seconds = args.timeout * 3
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandinHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # a dotted host name, since the checker rejects bare hosts like "localhost"
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    StandinHandler.expected_host = f"127.0.0.1:{server.server_address[1]}"
+
+    urls = {f"{base}/{route}/{i}": route for route in EXPECTED for i in range(args.copies)}
+    urls["not a url"] = None
+    checkable = [u for u in urls if app.normalize_submission_url(u)]
+
+    t0 = time.perf_counter()
+    results = asyncio.run(app.check_urls(checkable, timeout=args.timeout))
+    elapsed = time.perf_counter() - t0
+
+    # without the allowance the stand-in is just another internal address
+    app.LINK_CHECK_ALLOWED_NETWORKS = []
+    served = StandinHandler.requests
+    internal = [f"{base}/ok/internal", f"http://[::1]:{server.server_address[1]}/ok/internal",
+                "http://10.0.0.1/ok", "http://169.254.169.254/latest/meta-data/"]
+    refused = asyncio.run(app.check_urls(internal, timeout=args.timeout))
+    server.shutdown()
+
+    failures = []
+    print(f"{'internal URL':<48}{'got':>10}")
+    for u in internal:
+        print(f"{u:<48}{refused[u]['status']:>10}")
+        if refused[u]["status"] != "blocked":
+            failures.append(f"{u}: expected blocked, got {refused[u]['status']}")
+    if StandinHandler.requests != served:
+        failures.append(f"{StandinHandler.requests - served} request(s) reached the stand-in after it was disallowed")
+    print()
+    if app.normalize_submission_url("not a url") is not None:
+        failures.append("'not a url' was accepted as a URL")
+    print(f"{'route':<12}{'expected':>10}{'got':>22}{'max ms':>10}")
+    for route, want in EXPECTED.items():
+        got = [results[u] for u, r in urls.items() if r == route]
+        statuses = sorted({g["status"] for g in got})
+        slowest = max(g["elapsed_ms"] for g in got)
+        print(f"{route:<12}{want:>10}{','.join(statuses):>22}{slowest:>10.0f}")
+        if statuses != [want]:
+            failures.append(f"{route}: expected {want}, got {statuses}")
+    redirected = [results[u] for u, r in urls.items() if r == "redirect"]
+    if any(not (g["final_url"] or "").endswith("/ok/moved") for g in redirected):
+        failures.append("redirect: final_url was not recorded")
+
+    print(f"\n{len(checkable)} URLs in {elapsed:.2f}s; {StandinHandler.requests} requests, "
+          f"max {StandinHandler.max_in_flight} in flight (per-host limit {app.LINK_CHECK_PER_HOST})")
+    if StandinHandler.max_in_flight > app.LINK_CHECK_PER_HOST:
+        failures.append(f"per-host limit exceeded: {StandinHandler.max_in_flight} > {app.LINK_CHECK_PER_HOST}")
+    # serial checking would take copies × slow routes × timeout on its own
+    budget = (len(checkable) / app.LINK_CHECK_PER_HOST) * StandinHandler.latency * 2 + args.timeout * args.copies
+    if elapsed > budget:
+        failures.append(f"batch took {elapsed:.1f}s, over the {budget:.1f}s budget")
+
+    for f in failures:
+        print(f"FAIL {f}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
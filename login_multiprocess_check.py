@@ -0,0 +1,184 @@
+"""
+Multi-process login check: two app replicas sharing one MongoDB.
+
+Starts the stand-in OIDC issuer from oidc_standin.py and two replica
+processes. Each replica drives app.py through Streamlit's AppTest, and every
+visit is a fresh browser session, as it would be behind a load balancer
+without sticky sessions. The login starts on one replica and the callback
+lands on the other. The check then covers
+
+  * the callback logs in, and the URL carries a restore ticket, never the
+    session token
+  * the ticket restores the session on the other replica, and is replaced
+  * a used ticket and a replayed ?code=&state= callback get no session,
+    on either replica
+  * an unknown state fails the CSRF check
+
+    python login_multiprocess_check.py
+    python login_multiprocess_check.py --uri mongodb://localhost:27017 --db innoverse_login_check
+"""
+import argparse
+import multiprocessing as mp
+import os
+import re
+import sys
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlparse
+
+import pymongo
+import requests
+
+from oidc_standin import StandinIssuer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(HERE, "app.py")
+REDIRECT_URI = "http://portal.invalid/"          # never fetched: the check carries code/state itself
+
+
+def visit(query_params: dict, timeout: float) -> dict:
+    """One fresh browser session: load app.py with these query parameters, report what it showed."""
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    for k, v in query_params.items():
+        at.query_params[k] = v
+    at.run()
+    state = at.session_state
+    params = {k: v[0] if isinstance(v, list) else v for k, v in at.query_params.items()}
+    links = [m for el in at.markdown for m in re.findall(r'href="([^"]+)"', el.value)]
+    return {
+        "authenticated": "authenticated" in state and bool(state["authenticated"]),
+        "session_token": state["session_token"] if "session_token" in state else None,
+        "query_params": params,
+        "login_links": links,
+        "errors": [e.value for e in at.error],
+        "warnings": [w.value for w in at.warning],
+        "exceptions": [e.value for e in at.exception],
+    }
+
+
+def _replica_loop(env: dict, inbox, outbox):
+    os.environ.update(env)
+    sys.path.insert(0, HERE)
+    for query_params, timeout in iter(inbox.get, None):
+        try:
+            outbox.put(visit(query_params, timeout))
+        except Exception as e:            # report, keep serving
+            outbox.put({"exceptions": [f"{type(e).__name__}: {e}"], "authenticated": False,
+                        "query_params": {}, "login_links": [], "errors": [], "warnings": []})
+
+
+class Replica:
+    """An app process of its own: separate caches, resources and background threads."""
+
+    def __init__(self, name: str, env: dict, timeout: float):
+        ctx = mp.get_context("spawn")
+        self.name = name
+        self.timeout = timeout
+        self._inbox, self._outbox = ctx.Queue(), ctx.Queue()
+        self._proc = ctx.Process(target=_replica_loop, args=(env, self._inbox, self._outbox),
+                                 name=f"replica-{name}", daemon=True)
+        self._proc.start()
+
+    def visit(self, **query_params) -> dict:
+        self._inbox.put((query_params, self.timeout))
+        return self._outbox.get(timeout=self.timeout * 3)
+
+    def stop(self):
+        self._inbox.put(None)
+        self._proc.join(10)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--uri", default=os.getenv("AUDIT_MONGO_URI", "mongodb://localhost:27017"))
+    ap.add_argument("--db", default="innoverse_login_check")
+    ap.add_argument("--timeout", type=float, default=60.0, help="seconds per AppTest run")
+    args = ap.parse_args(argv)
+
+    issuer = StandinIssuer().start()
+    client = pymongo.MongoClient(args.uri, serverSelectionTimeoutMS=5000)
+    client.drop_database(args.db)
+    client[args.db].admins.insert_one({
+        "username": "login-check", "email": issuer.email, "role": "admin",
+        "is_active": True, "created_at": datetime.now(timezone.utc),
+    })
+    env = {
+        "MONGO_URI": args.uri,
+        "DATABASE_NAME": args.db,
+        "OIDC_ISSUER": issuer.url,
+        "GOOGLE_CLIENT_ID": issuer.client_id,
+        "GOOGLE_CLIENT_SECRET": "standin-secret",
+        "OAUTH_REDIRECT_URI": REDIRECT_URI,
+        "AUTHLIB_INSECURE_TRANSPORT": "1",       # the stand-in issuer is plain http
+        "METRICS_PORT": "0",                     # two replicas on one host
+        "GMAIL_ADDRESS": os.getenv("GMAIL_ADDRESS", "login-check@example.com"),
+        "GMAIL_APP_PASSWORD": os.getenv("GMAIL_APP_PASSWORD", "unused"),
+    }
+    a, b = Replica("a", env, args.timeout), Replica("b", env, args.timeout)
+    failures = []
+
+    def check(ok: bool, label: str, result: dict | None = None):
+        print(f"{'ok  ' if ok else 'FAIL'} {label}")
+        if not ok:
+            failures.append(label)
+            if result:
+                print(f"       {({k: v for k, v in result.items() if v})}")
+        return ok
+
+    try:
+        # 1) login page on replica A: the state/nonce go to Mongo, the link to the issuer
+        page = a.visit()
+        links = [u for u in page["login_links"] if u.startswith(f"{issuer.url}/authorize")]
+        if not check(bool(links) and not page["exceptions"], "replica a renders the Google sign-in link", page):
+            return 1
+        auth = requests.get(links[0], allow_redirects=False, timeout=10)
+        callback = {k: v[0] for k, v in parse_qs(urlparse(auth.headers["Location"]).query).items()}
+
+        # 2) the callback lands on replica B
+        done = b.visit(**callback)
+        token = done.get("session_token")
+        check(done["authenticated"], "replica b completes the login started on replica a", done)
+        ticket = done["query_params"].get("rt")
+        check(bool(ticket), "the URL carries a restore ticket", done)
+        check(set(done["query_params"]) == {"rt"}, "code and state are cleared from the URL", done)
+        check(bool(token) and token not in done["query_params"].values(),
+              "the session token is not in the URL", done)
+        check(client[args.db].oauth_states.count_documents({"session_token": {"$exists": True}}) == 0,
+              "no session token is left in oauth_states")
+
+        # 3) a reload routed back to replica A restores from the ticket
+        restored = a.visit(rt=ticket)
+        check(restored["authenticated"] and restored.get("session_token") == token,
+              "replica a restores the session from the ticket", restored)
+        check(restored["authenticated"] and restored["query_params"].get("rt") not in (None, ticket),
+              "the ticket is replaced after use", restored)
+
+        # 4) replays get nothing, on either replica
+        for replica in (a, b):
+            again = replica.visit(rt=ticket)
+            check(not again["authenticated"] and "rt" not in again["query_params"],
+                  f"replica {replica.name} refuses the used ticket", again)
+            replay = replica.visit(**callback)
+            check(not replay["authenticated"] and not replay["query_params"],
+                  f"replica {replica.name} refuses the replayed callback", replay)
+            check(any("already used" in w for w in replay["warnings"]),
+                  f"replica {replica.name} says the sign-in link was already used", replay)
+            legacy = replica.visit(sid=token)
+            check(not legacy["authenticated"], f"replica {replica.name} ignores ?sid=", legacy)
+
+        # 5) an unknown state fails the CSRF check
+        forged = b.visit(code="forged", state="not-a-state")
+        check(not forged["authenticated"] and any("state" in e for e in forged["errors"]),
+              "an unknown state is rejected", forged)
+    finally:
+        a.stop()
+        b.stop()
+        issuer.stop()
+        client.drop_database(args.db)
+
+    print(f"\n{len(failures)} failure(s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,383 @@
+"""
+Load test for the portal's email paths against a local SMTP sink.
+
+Starts an in-process SMTP server that accepts AUTH PLAIN without TLS and can
+inject per-message latency, permanent recipient failures, transient 451s and
+421 throttling (token bucket on MAIL FROM). Seeds N recipients into a local
+MongoDB database, points app.py at the sink through SMTP_HOST / SMTP_PORT /
+SMTP_STARTTLS, and drives the real send paths for each recipient scope:
+
+    all, assigned   → send_bulk_emails_for_task (personalized, one message per user)
+    track           → send_batched_email (one message, BCC chunks)
+    single_user     → _build_email + send_email_smtp for one user at a time
+
+Reports messages/sec, recipients/sec, p50/p95/p99 per-message latency (one
+send_email_smtp call or one batched SMTP transaction, including retries),
+retries and peak Python memory per path. Nothing leaves the machine.
+
+    python mail_loadtest.py --recipients 2000
+    python mail_loadtest.py --latency-ms 40 --fail-rate 0.01 --transient-rate 0.02 --throttle 100
+    python mail_loadtest.py --save-baseline mail_baseline.json
+    python mail_loadtest.py --baseline mail_baseline.json --max-regression 0.15
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import smtplib
+import socketserver
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone, timedelta
+
+import pymongo
+from bson import ObjectId
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TRACKS = ["ai", "webdev", "dsa", "app"]
+PATHS = ["all", "assigned", "track", "single_user"]
+
+
+# --- SMTP sink ---
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency_ms: float, fail_rate: float, transient_rate: float, throttle: float,
+                 burst: int, seed: int = 7):
+        super().__init__(("127.0.0.1", 0), SinkHandler)
+        self.latency = latency_ms / 1000
+        self.fail_rate = fail_rate
+        self.transient_rate = transient_rate
+        self.rate = throttle
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._refill_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._rnd = random.Random(seed)
+        self.stats = {"connections": 0, "messages": 0, "recipients": 0, "refused": 0,
+                      "transient": 0, "throttled": 0}
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def count(self, key: str, n: int = 1):
+        with self._lock:
+            self.stats[key] += n
+
+    def roll(self, rate: float) -> bool:
+        with self._lock:
+            return self._rnd.random() < rate
+
+    def admit(self) -> bool:
+        """Token bucket over MAIL FROM; an empty bucket means 421 and a dropped connection."""
+        if not self.rate:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._refill_at) * self.rate)
+            self._refill_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line: str):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        sink = self.server
+        sink.count("connections")
+        self._reply("220 loadtest-sink ESMTP")
+        rcpts = []
+        while True:
+            raw = self.rfile.readline(65537)
+            if not raw:
+                return
+            verb = raw.decode("ascii", "replace").strip()[:4].upper()
+            if verb in ("EHLO", "HELO"):
+                self.wfile.write(b"250-loadtest-sink\r\n250-8BITMIME\r\n250-SIZE 36700160\r\n250 AUTH PLAIN\r\n")
+            elif verb == "AUTH":
+                self._reply("235 2.7.0 Authentication successful")
+            elif verb == "MAIL":
+                if not sink.admit():
+                    sink.count("throttled")
+                    self._reply("421 4.7.0 Too many messages, try again later")
+                    return
+                rcpts = []
+                self._reply("250 2.1.0 OK")
+            elif verb == "RCPT":
+                if sink.roll(sink.fail_rate):
+                    sink.count("refused")
+                    self._reply("550 5.1.1 No such user")
+                else:
+                    rcpts.append(raw)
+                    self._reply("250 2.1.5 OK")
+            elif verb == "DATA":
+                if not rcpts:
+                    self._reply("503 5.5.1 No valid recipients")
+                    continue
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                while True:
+                    line = self.rfile.readline(1 << 20)
+                    if not line or line == b".\r\n":
+                        break
+                if sink.latency:
+                    time.sleep(sink.latency * random.uniform(0.5, 1.5))
+                if sink.roll(sink.transient_rate):
+                    sink.count("transient")
+                    self._reply("451 4.3.0 Temporary failure, try again")
+                else:
+                    sink.count("messages")
+                    sink.count("recipients", len(rcpts))
+                    self._reply("250 2.0.0 Queued")
+                rcpts = []
+            elif verb == "RSET":
+                rcpts = []
+                self._reply("250 2.0.0 OK")
+            elif verb == "NOOP":
+                self._reply("250 2.0.0 OK")
+            elif verb == "QUIT":
+                self._reply("221 2.0.0 Bye")
+                return
+            else:
+                self._reply("502 5.5.2 Command not recognized")
+
+
+# --- Data ---
+def seed(db, n_users: int, assigned_fraction: float):
+    """Fresh users across tracks, one task, and a share of users assigned to it."""
+    rnd = random.Random(42)
+    now = datetime.now(timezone.utc)
+    for name in ("users", "tasks", "task_assignments"):
+        db.drop_collection(name)
+    users = [{
+        "_id": ObjectId(),
+        "name": f"Load User {i}",
+        "email": f"load{i}@example.test",
+        "profile": {"coding_track": rnd.choice(TRACKS)},
+        "created_at": now,
+    } for i in range(n_users)]
+    if users:
+        db.users.insert_many(users)
+    task = {"_id": ObjectId(), "title": "Load Test Task", "description": "Measure the mail path " * 8,
+            "due_date": now + timedelta(days=7), "points": 100, "is_active": True, "type": "individual",
+            "track": TRACKS[0], "requirements": [], "created_at": now, "updated_at": now}
+    db.tasks.insert_one(task)
+    assigned = rnd.sample(users, int(len(users) * assigned_fraction))
+    if assigned:
+        db.task_assignments.insert_many([{"task_id": task["_id"], "user_id": u["_id"], "assigned_at": now,
+                                          "status": "assigned", "assignment_type": "existing"} for u in assigned])
+    return task, users
+
+
+# --- Measurement ---
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))]
+
+
+class LatencyProbe:
+    """Times send_email_smtp calls and batched SMTP transactions while a path runs."""
+
+    def __init__(self, app):
+        self.app = app
+        self.samples = []
+        self._in_call = threading.local()
+        self._orig_send = app.send_email_smtp
+        self._orig_sendmail = smtplib.SMTP.sendmail
+
+    def install(self):
+        probe = self
+
+        def send_email_smtp(msg, **kwargs):
+            probe._in_call.active = True
+            t0 = time.perf_counter()
+            try:
+                return probe._orig_send(msg, **kwargs)
+            finally:
+                probe.samples.append(time.perf_counter() - t0)
+                probe._in_call.active = False
+
+        def sendmail(smtp, *args, **kwargs):
+            if getattr(probe._in_call, "active", False):
+                return probe._orig_sendmail(smtp, *args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return probe._orig_sendmail(smtp, *args, **kwargs)
+            finally:
+                probe.samples.append(time.perf_counter() - t0)
+
+        self.app.send_email_smtp = send_email_smtp
+        smtplib.SMTP.sendmail = sendmail
+
+    def uninstall(self):
+        self.app.send_email_smtp = self._orig_send
+        smtplib.SMTP.sendmail = self._orig_sendmail
+
+
+def drive(app, path: str, task: dict, users: list[dict]) -> tuple[int, int]:
+    """Run one recipient scope through the same calls the task email panel makes."""
+    if path in ("all", "assigned"):
+        sent, failed, _ = app.send_bulk_emails_for_task(task, "new_update", path)
+    elif path == "track":
+        recips = app.gather_recipients_for_task(task["_id"], "track", track=task["track"])
+        subject, html = app.render_task_email("new_update", task, None)
+        sent, failed, _ = app.send_batched_email(subject, html, [u["email"] for u in recips])
+    else:
+        from_addr, from_name = app.get_sender_identity()
+        sent = failed = 0
+        for u in users:
+            udoc = app.gather_recipients_for_task(task["_id"], "single_user", user_id=u["_id"])[0]
+            subject, html = app.render_task_email("new_update", task, udoc)
+            try:
+                app.send_email_smtp(app._build_email(subject, html, udoc["email"], from_addr, from_name))
+                sent += 1
+            except Exception:
+                failed += 1
+            time.sleep(app.SMTP_SEND_DELAY)
+    return sent, failed
+
+
+def run_path(app, sink: SMTPSink, path: str, task: dict, single_users: list[dict]) -> dict:
+    probe = LatencyProbe(app)
+    probe.install()
+    before = sink.snapshot()
+    retries_before = app.METRICS.value("portal_smtp_retries_total")
+    tracemalloc.reset_peak()
+    t0 = time.perf_counter()
+    try:
+        sent, failed = drive(app, path, task, single_users)
+    finally:
+        elapsed = time.perf_counter() - t0
+        probe.uninstall()
+    after = sink.snapshot()
+    delta = {k: after[k] - before[k] for k in after}
+    ms = [s * 1000 for s in probe.samples]
+    return {
+        "sent": sent,
+        "failed": failed,
+        "seconds": round(elapsed, 3),
+        "messages": delta["messages"],
+        "recipients": delta["recipients"],
+        "msgs_per_s": round(delta["messages"] / elapsed, 2) if elapsed else 0.0,
+        "rcpts_per_s": round(delta["recipients"] / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(ms, 50), 2),
+        "p95_ms": round(percentile(ms, 95), 2),
+        "p99_ms": round(percentile(ms, 99), 2),
+        "retries": app.METRICS.value("portal_smtp_retries_total") - retries_before,
+        "throttled": delta["throttled"],
+        "transient": delta["transient"],
+        "refused": delta["refused"],
+        "connections": delta["connections"],
+        "peak_kb": round(tracemalloc.get_traced_memory()[1] / 1024, 1),
+    }
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> list[str]:
+    """Throughput drops or p95 rises beyond max_regression, per path."""
+    problems = []
+    for path, cur in results.items():
+        base = baseline.get(path)
+        if not base:
+            continue
+        if base["rcpts_per_s"] and cur["rcpts_per_s"] < base["rcpts_per_s"] * (1 - max_regression):
+            problems.append(f"{path}: recipients/s {base['rcpts_per_s']} → {cur['rcpts_per_s']}")
+        if base["p95_ms"] and cur["p95_ms"] > base["p95_ms"] * (1 + max_regression):
+            problems.append(f"{path}: p95 {base['p95_ms']} ms → {cur['p95_ms']} ms")
+    return problems
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--uri", default=os.getenv("AUDIT_MONGO_URI", "mongodb://localhost:27017"))
+    ap.add_argument("--db", default="innoverse_mail_loadtest")
+    ap.add_argument("--recipients", type=int, default=500, help="users to seed")
+    ap.add_argument("--assigned-fraction", type=float, default=0.3)
+    ap.add_argument("--single-users", type=int, default=50, help="sends for the single_user path")
+    ap.add_argument("--paths", default=",".join(PATHS))
+    ap.add_argument("--latency-ms", type=float, default=5.0, help="mean sink delay per message")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="share of RCPTs refused with 550")
+    ap.add_argument("--transient-rate", type=float, default=0.0, help="share of messages answered 451")
+    ap.add_argument("--throttle", type=float, default=0.0, help="messages/sec before 421 (0 = off)")
+    ap.add_argument("--burst", type=int, default=20, help="token bucket size for --throttle")
+    ap.add_argument("--send-delay", default=None, help="override SMTP_SEND_DELAY (app default 0.2s)")
+    ap.add_argument("--retry-base", default="0.1", help="SMTP_RETRY_BASE for the run")
+    ap.add_argument("--baseline", help="JSON from --save-baseline to compare against")
+    ap.add_argument("--save-baseline", help="write this run's results as a baseline")
+    ap.add_argument("--max-regression", type=float, default=0.2)
+    args = ap.parse_args(argv)
+
+    sink = SMTPSink(args.latency_ms, args.fail_rate, args.transient_rate, args.throttle, args.burst)
+    threading.Thread(target=sink.serve_forever, daemon=True).start()
+
+    db = pymongo.MongoClient(args.uri)[args.db]
+    print(f"Seeding {args.recipients} recipients into {args.db} …")
+    task, users = seed(db, args.recipients, args.assigned_fraction)
+
+    env = {
+        "MONGO_URI": args.uri,
+        "DATABASE_NAME": args.db,
+        "GMAIL_ADDRESS": "loadtest@example.test",
+        "GMAIL_APP_PASSWORD": "unused",
+        "SMTP_HOST": "127.0.0.1",
+        "SMTP_PORT": str(sink.port),
+        "SMTP_STARTTLS": "0",
+        "SMTP_RETRY_BASE": args.retry_base,
+    }
+    if args.send_delay is not None:
+        env["SMTP_SEND_DELAY"] = args.send_delay
+    os.environ.update(env)
+    sys.path.insert(0, HERE)
+    import app   # reads the SMTP_* settings at import; app.METRICS is the registry it counts into
+
+    tracemalloc.start()
+    single_users = users[:args.single_users]
+    results = {}
+    for path in [p.strip() for p in args.paths.split(",") if p.strip()]:
+        print(f"Driving {path} …")
+        results[path] = run_path(app, sink, path, task, single_users)
+    tracemalloc.stop()
+
+    cols = ["sent", "failed", "seconds", "msgs_per_s", "rcpts_per_s", "p50_ms", "p95_ms", "p99_ms",
+            "retries", "throttled", "peak_kb"]
+    print(f"\n{'path':<12}" + "".join(f"{c:>12}" for c in cols))
+    for path, r in results.items():
+        print(f"{path:<12}" + "".join(f"{r[c]:>12}" for c in cols))
+    print(f"\nsink: {sink.snapshot()}  max RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    sink.shutdown()
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as fh:
+            json.dump({"settings": vars(args), "results": results}, fh, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)["results"]
+        problems = compare(results, baseline, args.max_regression)
+        print(f"\nvs {args.baseline}:")
+        for path, r in results.items():
+            base = baseline.get(path)
+            if base:
+                print(f"  {path:<12} rcpts/s {base['rcpts_per_s']} → {r['rcpts_per_s']}   "
+                      f"p95 {base['p95_ms']} → {r['p95_ms']} ms   retries {base['retries']} → {r['retries']}")
+        for p in problems:
+            print(f"REGRESSION {p}")
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
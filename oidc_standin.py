@@ -0,0 +1,258 @@
+"""
+Local stand-in for Google's OpenID Connect endpoints, with checks for app.OIDCKeyCache.
+
+StandinIssuer serves discovery metadata, a JWKS document, an authorization
+endpoint and a token endpoint from a throwaway HTTP server, and signs ID tokens
+with RSA keys it can rotate. Run directly, it checks that OIDCKeyCache
+
+  * verifies a token signed with the published key
+  * follows key rotation: a key published ahead of use is picked up when the
+    JWKS max-age runs out; a key switched without notice (unknown kid) costs
+    one forced refetch, at most once per OIDC_MIN_REFRESH_SECONDS however many
+    such tokens arrive
+  * rejects a bad signature, a tampered payload, the wrong aud, the wrong
+    nonce, the wrong issuer and an expired token
+
+login_multiprocess_check.py uses the same issuer for the whole login flow.
+No MongoDB or network access is needed.
+
+    python oidc_standin.py
+"""
+import argparse
+import base64
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from authlib.jose import JsonWebKey, jwt
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class StandinIssuer:
+    """Discovery, JWKS, /authorize and /token on 127.0.0.1; codes are single use."""
+
+    def __init__(self, client_id: str = "standin-client", email: str = "admin@example.com",
+                 max_age: int = 3600):
+        self.client_id = client_id
+        self.email = email
+        self.max_age = max_age
+        self.jwks_fetches = 0
+        self._codes = {}
+        self._lock = threading.Lock()
+        self._kids = 0
+        self.signing_key = self.new_key()
+        self.published = [self.signing_key]
+        issuer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                issuer._get(self)
+
+            def do_POST(self):
+                issuer._post(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True, name="oidc-standin").start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    # --- keys ---
+    def new_key(self, kid: str | None = None):
+        self._kids += 1
+        return JsonWebKey.generate_key("RSA", 2048, is_private=True,
+                                       options={"kid": kid or f"standin-{self._kids}"})
+
+    def publish_ahead(self):
+        """Google's rotation: the next key appears in the JWKS before anything is signed with it."""
+        nxt = self.new_key()
+        self.published = [self.signing_key, nxt]
+        return nxt
+
+    def switch_to(self, key, retire_others: bool = True):
+        self.signing_key = key
+        if retire_others:
+            self.published = [key]
+
+    def id_token(self, nonce: str | None, key=None, **overrides) -> str:
+        key = key or self.signing_key
+        now = int(time.time())
+        claims = {
+            "iss": self.url, "aud": self.client_id, "sub": "standin-sub", "email": self.email,
+            "email_verified": True, "nonce": nonce, "iat": now, "exp": now + 3600,
+        }
+        claims.update(overrides)
+        claims = {k: v for k, v in claims.items() if v is not None}
+        header = {"alg": "RS256", "kid": key.as_dict()["kid"]}
+        return jwt.encode(header, claims, key).decode()
+
+    # --- HTTP ---
+    def _send(self, req, code: int, body: dict | None = None, headers: dict | None = None):
+        data = json.dumps(body).encode() if body is not None else b""
+        req.send_response(code)
+        for k, v in (headers or {}).items():
+            req.send_header(k, v)
+        if body is not None:
+            req.send_header("Content-Type", "application/json")
+        req.send_header("Content-Length", str(len(data)))
+        req.end_headers()
+        req.wfile.write(data)
+
+    def _get(self, req):
+        url = urlparse(req.path)
+        if url.path == "/.well-known/openid-configuration":
+            return self._send(req, 200, {
+                "issuer": self.url,
+                "authorization_endpoint": f"{self.url}/authorize",
+                "token_endpoint": f"{self.url}/token",
+                "jwks_uri": f"{self.url}/jwks",
+                "id_token_signing_alg_values_supported": ["RS256"],
+            })
+        if url.path == "/jwks":
+            with self._lock:
+                self.jwks_fetches += 1
+            keys = [{**k.as_dict(is_private=False), "alg": "RS256", "use": "sig"} for k in self.published]
+            return self._send(req, 200, {"keys": keys}, {"Cache-Control": f"public, max-age={self.max_age}"})
+        if url.path == "/authorize":
+            q = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if q.get("client_id") != self.client_id or not q.get("redirect_uri"):
+                return self._send(req, 400, {"error": "invalid_request"})
+            code = secrets.token_urlsafe(16)
+            with self._lock:
+                self._codes[code] = {"nonce": q.get("nonce"), "redirect_uri": q["redirect_uri"]}
+            location = f"{q['redirect_uri']}?{urlencode({'code': code, 'state': q.get('state', '')})}"
+            return self._send(req, 302, headers={"Location": location})
+        return self._send(req, 404, {"error": "not_found"})
+
+    def _post(self, req):
+        if urlparse(req.path).path != "/token":
+            return self._send(req, 404, {"error": "not_found"})
+        length = int(req.headers.get("Content-Length") or 0)
+        form = {k: v[0] for k, v in parse_qs(req.rfile.read(length).decode()).items()}
+        with self._lock:
+            grant = self._codes.pop(form.get("code"), None)
+        if not grant or form.get("redirect_uri") != grant["redirect_uri"] \
+                or form.get("client_id", self.client_id) != self.client_id:
+            return self._send(req, 400, {"error": "invalid_grant"})
+        return self._send(req, 200, {
+            "access_token": secrets.token_urlsafe(16),
+            "token_type": "Bearer",
+            "expires_in": 3600,
+            "id_token": self.id_token(grant["nonce"]),
+        })
+
+
+def _tamper(token: str) -> str:
+    """Same header and signature, different payload (email swapped)."""
+    header, payload, signature = token.split(".")
+    claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    claims["email"] = "attacker@example.com"
+    forged = base64.urlsafe_b64encode(json.dumps(claims).encode()).rstrip(b"=").decode()
+    return f"{header}.{forged}.{signature}"
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--floor", type=float, default=1.0,
+                    help="OIDC_MIN_REFRESH_SECONDS for the run (seconds between forced refetches)")
+    args = ap.parse_args(argv)
+
+    # app.py connects lazily, so a placeholder URI is enough to import it
+    os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+    sys.path.insert(0, HERE)
+    import app
+    app.OIDC_MIN_REFRESH_SECONDS = args.floor
+
+    issuer = StandinIssuer().start()
+    client_id, nonce = issuer.client_id, "n-" + secrets.token_urlsafe(8)
+    failures = []
+
+    def accepts(label: str, cache, token: str, aud: str = client_id, want_nonce: str = nonce):
+        try:
+            claims = cache.verify_id_token(token, aud, want_nonce)
+            ok = claims.get("email") == issuer.email
+        except Exception as e:
+            ok = False
+            label += f" ({type(e).__name__}: {e})"
+        print(f"{'ok  ' if ok else 'FAIL'} accepts {label}")
+        if not ok:
+            failures.append(label)
+
+    def rejects(label: str, cache, token: str, aud: str = client_id, want_nonce: str = nonce):
+        try:
+            cache.verify_id_token(token, aud, want_nonce)
+        except Exception as e:
+            print(f"ok   rejects {label} ({type(e).__name__})")
+            return
+        print(f"FAIL accepted {label}")
+        failures.append(label)
+
+    # --- signature and claims ---
+    cache = app.OIDCKeyCache(issuer.url)
+    good = issuer.id_token(nonce)
+    accepts("a token signed with the published key", cache, good)
+    impostor = issuer.new_key(kid=issuer.signing_key.as_dict()["kid"])   # same kid, different key
+    rejects("a bad signature (unpublished key, published kid)", cache, issuer.id_token(nonce, key=impostor))
+    rejects("a tampered payload", cache, _tamper(good))
+    rejects("the wrong aud", cache, issuer.id_token(nonce, aud="someone-else"))
+    rejects("the wrong nonce", cache, good, want_nonce="n-other")
+    rejects("a token with no nonce", cache, issuer.id_token(None))
+    rejects("the wrong issuer", cache, issuer.id_token(nonce, iss="https://issuer.example.com"))
+    rejects("an expired token", cache, issuer.id_token(nonce, exp=int(time.time()) - 600))
+
+    # --- rotation announced ahead (Google publishes the next key before using it) ---
+    issuer.max_age = 1
+    cache = app.OIDCKeyCache(issuer.url)
+    accepts("a token before rotation", cache, issuer.id_token(nonce))
+    nxt = issuer.publish_ahead()
+    time.sleep(1.1)                                  # max-age runs out: next use refetches
+    issuer.switch_to(nxt)
+    accepts("a token from the key published ahead", cache, issuer.id_token(nonce))
+
+    # --- rotation without notice: unknown kid forces one refetch, rate limited ---
+    issuer.max_age = 3600
+    cache = app.OIDCKeyCache(issuer.url)
+    accepts("a token before the abrupt switch", cache, issuer.id_token(nonce))
+    fetches = issuer.jwks_fetches
+    issuer.switch_to(issuer.new_key())
+    rejects("an unknown kid inside the refetch floor", cache, issuer.id_token(nonce))
+    for _ in range(19):
+        try:
+            cache.verify_id_token(issuer.id_token(nonce), client_id, nonce)
+            failures.append("an unknown kid was accepted inside the floor")
+        except Exception:
+            pass
+    print(f"{'ok  ' if issuer.jwks_fetches == fetches else 'FAIL'} "
+          f"20 unknown-kid tokens inside the floor caused {issuer.jwks_fetches - fetches} JWKS fetch(es)")
+    if issuer.jwks_fetches != fetches:
+        failures.append("unknown kids refetched inside the floor")
+    time.sleep(args.floor + 0.1)
+    accepts("the switched key once the floor has passed", cache, issuer.id_token(nonce))
+    refetched = issuer.jwks_fetches - fetches
+    print(f"{'ok  ' if refetched == 1 else 'FAIL'} abrupt rotation cost {refetched} JWKS fetch(es)")
+    if refetched != 1:
+        failures.append(f"abrupt rotation cost {refetched} JWKS fetches, expected 1")
+
+    issuer.stop()
+    for f in failures:
+        print(f"FAIL {f}")
+    print(f"\n{len(failures)} failure(s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
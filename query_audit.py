@@ -0,0 +1,386 @@
+"""
+Query-plan auditor for the admin portal.
+
+Seeds a local MongoDB database, drives every page of app.py through Streamlit's
+AppTest while a pymongo CommandListener records each command the app sends,
+collapses them into query shapes and runs explain("executionStats") on one
+instance of each shape. Shapes that scan a collection, sort in memory or examine
+far more documents than they return are flagged; flagged shapes not listed in
+query_audit_allow.json fail the run.
+
+    python query_audit.py                      # seed + audit, exit 1 on new unindexed shapes
+    python query_audit.py --list               # just list the shapes the app issues
+    python query_audit.py --uri mongodb://localhost:27017 --users 5000 --max-ratio 10
+"""
+import argparse
+import json
+import os
+import random
+import sys
+from datetime import datetime, timezone, timedelta
+
+import pymongo
+from bson import ObjectId
+from pymongo import monitoring
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(HERE, "app.py")
+ALLOW_PATH = os.path.join(HERE, "query_audit_allow.json")
+
+AUDITED_COMMANDS = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"}
+# Driver/session fields that explain() rejects or that don't affect the plan
+DRIVER_FIELDS = {"lsid", "$db", "$clusterTime", "$readPreference", "txnNumber", "writeConcern",
+                 "readConcern", "ordered", "bypassDocumentValidation", "comment", "maxTimeMS",
+                 "apiVersion", "apiStrict", "apiDeprecationErrors"}
+TRACKS = ["ai", "webdev", "dsa", "app"]
+
+
+# --- Recording ---
+class CommandRecorder(monitoring.CommandListener):
+    def __init__(self, database_name: str):
+        self.database_name = database_name
+        self.commands = []
+
+    def started(self, event):
+        if event.database_name != self.database_name or event.command_name not in AUDITED_COMMANDS:
+            return
+        cmd = {k: v for k, v in event.command.items() if k not in DRIVER_FIELDS}
+        pipeline = cmd.get("pipeline") or []
+        if pipeline and "$changeStream" in pipeline[0]:
+            return
+        self.commands.append((event.command_name, cmd))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def _shape(value):
+    """Replace literal values with their type so queries differing only in values collapse."""
+    if isinstance(value, dict):
+        return {k: _shape(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        if value and all(not isinstance(v, (dict, list)) for v in value):
+            return [f"<{type(value[0]).__name__}>..."]
+        return [_shape(v) for v in value]
+    if value is None:
+        return None
+    return f"<{type(value).__name__}>"
+
+def _sort_shape(sort):
+    # sort/projection values are part of the shape, not literals
+    return dict(sort) if sort else None
+
+def shape_of(command_name: str, cmd: dict) -> str:
+    coll = cmd.get(command_name)
+    if command_name == "find":
+        s = f"{coll}.find {json.dumps(_shape(cmd.get('filter', {})), sort_keys=True)}"
+        if cmd.get("sort"):
+            s += f" sort {json.dumps(_sort_shape(cmd['sort']))}"
+        return s
+    if command_name == "aggregate":
+        stages = []
+        for stage in cmd.get("pipeline", []):
+            (name, body), = stage.items()
+            if name == "$match":
+                stages.append(f"$match {json.dumps(_shape(body), sort_keys=True)}")
+            elif name == "$sort":
+                stages.append(f"$sort {json.dumps(body)}")
+            elif name == "$lookup":
+                stages.append(f"$lookup {body.get('from')}")
+            elif name == "$unionWith":
+                stages.append(f"$unionWith {body.get('coll') if isinstance(body, dict) else body}")
+            else:
+                stages.append(name)
+        return f"{coll}.aggregate [{', '.join(stages)}]"
+    if command_name == "count":
+        return f"{coll}.count {json.dumps(_shape(cmd.get('query', {})), sort_keys=True)}"
+    if command_name == "distinct":
+        return f"{coll}.distinct {cmd.get('key')} {json.dumps(_shape(cmd.get('query', {})), sort_keys=True)}"
+    if command_name == "findAndModify":
+        s = f"{coll}.findAndModify {json.dumps(_shape(cmd.get('query', {})), sort_keys=True)}"
+        if cmd.get("sort"):
+            s += f" sort {json.dumps(_sort_shape(cmd['sort']))}"
+        return s
+    if command_name == "update":
+        q = cmd["updates"][0].get("q", {}) if cmd.get("updates") else {}
+        return f"{coll}.update {json.dumps(_shape(q), sort_keys=True)}"
+    if command_name == "delete":
+        q = cmd["deletes"][0].get("q", {}) if cmd.get("deletes") else {}
+        return f"{coll}.delete {json.dumps(_shape(q), sort_keys=True)}"
+    return f"{coll}.{command_name}"
+
+
+# --- Plan analysis ---
+def _walk(node):
+    if isinstance(node, dict):
+        yield node
+        for v in node.values():
+            yield from _walk(v)
+    elif isinstance(node, list):
+        for v in node:
+            yield from _walk(v)
+
+def analyze_explain(explain: dict, max_ratio: float, min_examined: int) -> dict:
+    """Summarize an explain("executionStats") document and list the problems found."""
+    stages, problems = set(), []
+    examined, returned, keys = 0, None, 0
+    winning = [n[k] for n in _walk(explain) for k in ("winningPlan", "executionStages") if k in n]
+    for plan in winning:
+        for n in _walk(plan):
+            if "stage" in n:
+                stages.add(n["stage"])
+    for n in _walk(explain):
+        if "totalDocsExamined" in n:
+            examined = max(examined, n["totalDocsExamined"])
+            keys = max(keys, n.get("totalKeysExamined", 0))
+            if returned is None:
+                returned = n.get("nReturned", 0)
+        if n.get("collectionScans"):      # $lookup sub-pipelines
+            problems.append("COLLSCAN in $lookup")
+        if n.get("strategy") in ("NestedLoopJoin", "HashJoin"):   # pushed-down $lookup without an index
+            problems.append(f"unindexed $lookup ({n['strategy']})")
+    returned = returned or 0
+
+    if "COLLSCAN" in stages:
+        problems.append("COLLSCAN")
+    if "SORT" in stages:
+        problems.append("in-memory SORT")
+    ratio = examined / max(returned, 1)
+    if examined >= min_examined and ratio > max_ratio:
+        problems.append(f"examined/returned {ratio:.0f}")
+    return {
+        "stages": sorted(stages),
+        "docs_examined": examined,
+        "keys_examined": keys,
+        "returned": returned,
+        "problems": problems,
+    }
+
+def explain_command(db, command_name: str, cmd: dict) -> dict:
+    cmd = dict(cmd)
+    if command_name == "aggregate":
+        cmd.setdefault("cursor", {})
+        # $merge/$out can't be explained with executionStats; audit the read side
+        cmd["pipeline"] = [s for s in cmd["pipeline"] if not ({"$merge", "$out"} & set(s))]
+    if command_name in ("update", "delete"):
+        key = "updates" if command_name == "update" else "deletes"
+        cmd[key] = cmd[key][:1]
+    return db.command({"explain": cmd, "verbosity": "executionStats"})
+
+
+# --- Seeding ---
+def seed(db, n_users: int, n_tasks: int, n_subs: int, n_forums: int):
+    """Replace the audit database with realistic-looking synthetic data."""
+    rnd = random.Random(42)
+    now = datetime.now(timezone.utc)
+    for name in db.list_collection_names():
+        if not name.startswith("system."):
+            db.drop_collection(name)
+
+    admin_id = ObjectId()
+    db.admins.insert_one({"_id": admin_id, "username": "audit", "email": "audit@example.com",
+                          "role": "superadmin", "is_active": True, "login_count": 1, "created_at": now})
+    token = "audit-session-token"
+    db.admin_sessions.insert_one({"token": token, "admin_id": admin_id, "username": "audit", "created_at": now,
+                                  "expires_at": now.timestamp() + 86400,
+                                  "expires_on": now + timedelta(days=1)})
+
+    users = [{
+        "_id": ObjectId(),
+        "name": f"User {i}",
+        "email": f"user{i}@example.com",
+        "profile": {"coding_track": rnd.choice(TRACKS), "bio": "x" * rnd.randint(0, 400)},
+        "stats": {"points": rnd.randint(0, 50) * 10, "tasks_completed": rnd.randint(0, 12)},
+        "is_active": rnd.random() > 0.1,
+        "created_at": now - timedelta(days=rnd.randint(0, 365), minutes=rnd.randint(0, 1440)),
+    } for i in range(n_users)]
+    db.users.insert_many(users)
+
+    tasks = [{
+        "_id": ObjectId(),
+        "title": f"Task {i}",
+        "description": "Build something",
+        "due_date": now + timedelta(days=rnd.randint(-60, 60)),
+        "points": rnd.choice([50, 100, 150]),
+        "is_active": rnd.random() > 0.3,
+        "type": "individual",
+        "difficulty": rnd.choice(["beginner", "intermediate", "advanced"]),
+        "track": rnd.choice(TRACKS),
+        "requirements": [],
+        "created_at": now - timedelta(days=rnd.randint(0, 200)),
+        "updated_at": now,
+    } for i in range(n_tasks)]
+    db.tasks.insert_many(tasks)
+
+    subs = []
+    for i in range(n_subs):
+        status = rnd.choice(["pending", "approved", "approved", "rejected"])
+        subs.append({
+            "user_id": rnd.choice(users)["_id"],
+            "task_id": rnd.choice(tasks)["_id"],
+            "submission_url": f"https://github.com/user/repo{i}",
+            "submission_text": "lorem ipsum " * rnd.randint(5, 200),
+            "status": status,
+            "points": str(rnd.choice([0, 50, 100])) if status == "approved" else 0,
+            "submitted_at": now - timedelta(days=rnd.randint(0, 300), minutes=rnd.randint(0, 1440)),
+        })
+    db.submissions.insert_many(subs)
+
+    db.task_assignments.insert_many([{
+        "task_id": rnd.choice(tasks)["_id"],
+        "user_id": rnd.choice(users)["_id"],
+        "assigned_by": "audit",
+        "assigned_at": now - timedelta(days=rnd.randint(0, 200)),
+        "status": "assigned",
+        "assignment_type": "existing",
+    } for _ in range(n_subs // 2)])
+
+    forums = [{"_id": str(ObjectId()), "title": f"Forum {i}", "description": "d",
+               "creator": {"name": "Admin", "email": "admin@innoverse.com"},
+               "created_at": (now - timedelta(days=i)).isoformat()} for i in range(n_forums)]
+    db.forums.insert_many(forums)
+    comments = []
+    for f in forums:
+        for j in range(rnd.randint(0, 40)):
+            u = rnd.choice(users)
+            comments.append({"forum_id": f["_id"], "content": "comment " * 20,
+                             "user": {"id": str(u["_id"]), "full_name": u["name"], "email": u["email"]},
+                             "created_at": (now - timedelta(minutes=j)).isoformat()})
+    if comments:
+        db.forum_comments.insert_many(comments)
+    return token, tasks[0]["_id"], users[1]
+
+
+# --- Driving the app ---
+EVERY_OPTION = "<every option>"   # action value: step through all of a widget's options in turn
+
+def scenarios(first_task_id, sample_user):
+    tid = str(first_task_id)
+    return [
+        ("📊 Dashboard", []),
+        ("📊 Dashboard", [("text_input", "dash_rank_email", sample_user["email"])]),
+        ("👥 Users", []),
+        ("👥 Users", [("selectbox", "user_grid_sort", EVERY_OPTION)]),
+        ("📝 Tasks", [("text_input", "user_search_existing_outside", "user1")]),
+        ("📝 Tasks", [("radio", f"scope_{tid}", "single_user"), ("text_input", f"user_search_{tid}", "user1")]),
+        ("📄 Submissions", []),
+        ("📄 Submissions", [("radio", "submissions_mode", "📋 Browse all")]),
+        ("💬 Forums", []),
+        ("📈 Analytics", []),
+        ("📈 Analytics", [("radio", "analytics_source", "snapshot")]),
+        ("🗄️ Archive", []),
+        ("🗄️ Archive", [("selectbox", "archive_coll", "forum_comments")]),
+        ("🛡️ Superadmin", []),
+    ]
+
+def drive_app(session_token: str, steps, timeout: float):
+    from streamlit.testing.v1 import AppTest
+
+    for page, actions in steps:
+        at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        at.session_state["session_token"] = session_token
+        at.session_state["effective_role"] = "superadmin"
+        at.run()
+        nav = [s for s in at.sidebar.selectbox if s.label == "Navigate to:"]
+        if not nav:
+            print(f"  ! could not reach navigation for {page}: {[e.value for e in at.exception]}")
+            continue
+        nav[0].set_value(page).run()
+        for kind, key, value in actions:
+            try:
+                widget = getattr(at, kind)(key=key)
+            except KeyError:
+                print(f"  ! {page}: widget {kind}:{key} not found")
+                continue
+            for v in (widget.options if value == EVERY_OPTION else [value]):
+                widget = getattr(at, kind)(key=key)
+                (widget.input(v) if kind == "text_input" else widget.set_value(v)).run()
+        for exc in at.exception:
+            print(f"  ! {page}: {exc.value}")
+
+
+def load_allowlist(path: str) -> list[dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path) as fh:
+        return json.load(fh)
+
+def allowed(shape: str, allowlist: list[dict]) -> dict | None:
+    """Entries accept a shape exactly ("shape") or by leading text ("prefix")."""
+    for entry in allowlist:
+        if shape == entry.get("shape") or ("prefix" in entry and shape.startswith(entry["prefix"])):
+            return entry
+    return None
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--uri", default=os.getenv("AUDIT_MONGO_URI", "mongodb://localhost:27017"))
+    ap.add_argument("--db", default="innoverse_query_audit")
+    ap.add_argument("--users", type=int, default=3000)
+    ap.add_argument("--tasks", type=int, default=60)
+    ap.add_argument("--submissions", type=int, default=8000)
+    ap.add_argument("--forums", type=int, default=30)
+    ap.add_argument("--max-ratio", type=float, default=10.0, help="max docsExamined / nReturned")
+    ap.add_argument("--min-examined", type=int, default=200, help="ignore ratios below this many docs")
+    ap.add_argument("--allow", default=ALLOW_PATH, help="JSON allowlist of accepted shapes")
+    ap.add_argument("--timeout", type=float, default=60.0, help="seconds per AppTest run")
+    ap.add_argument("--list", action="store_true", help="only list the shapes, don't explain")
+    args = ap.parse_args(argv)
+
+    recorder = CommandRecorder(args.db)
+    monitoring.register(recorder)      # before app.py creates its clients
+
+    db = pymongo.MongoClient(args.uri)[args.db]
+    print(f"Seeding {args.db} …")
+    token, first_task_id, sample_user = seed(db, args.users, args.tasks, args.submissions, args.forums)
+
+    os.environ.update({
+        "MONGO_URI": args.uri,
+        "DATABASE_NAME": args.db,
+        "GMAIL_ADDRESS": os.getenv("GMAIL_ADDRESS", "audit@example.com"),
+        "GMAIL_APP_PASSWORD": os.getenv("GMAIL_APP_PASSWORD", "unused"),
+        "CACHE_FALLBACK_TTL": "1",
+    })
+    print("Driving app pages …")
+    drive_app(token, scenarios(first_task_id, sample_user), args.timeout)
+
+    shapes = {}
+    for command_name, cmd in recorder.commands:
+        shapes.setdefault(shape_of(command_name, cmd), (command_name, cmd))
+    print(f"\n{len(recorder.commands)} commands, {len(shapes)} distinct shapes\n")
+    if args.list:
+        for s in sorted(shapes):
+            print(s)
+        return 0
+
+    allowlist = load_allowlist(args.allow)
+    failures = 0
+    for s in sorted(shapes):
+        command_name, cmd = shapes[s]
+        try:
+            result = analyze_explain(explain_command(db, command_name, cmd), args.max_ratio, args.min_examined)
+        except pymongo.errors.OperationFailure as e:
+            print(f"?    {s}\n       explain failed: {e}")
+            continue
+        summary = (f"stages={','.join(result['stages'])} examined={result['docs_examined']} "
+                   f"keys={result['keys_examined']} returned={result['returned']}")
+        if not result["problems"]:
+            print(f"ok   {s}\n       {summary}")
+            continue
+        entry = allowed(s, allowlist)
+        if entry:
+            print(f"allow {s}\n       {summary} [{'; '.join(result['problems'])}] — {entry.get('reason', '')}")
+        else:
+            failures += 1
+            print(f"FAIL {s}\n       {summary} [{'; '.join(result['problems'])}]")
+
+    print(f"\n{failures} unindexed shape(s) not in {os.path.basename(args.allow)}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
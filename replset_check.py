@@ -0,0 +1,111 @@
+"""
+Connection-profile check against a local single-host replica set.
+
+    mongod --replSet rs0 --dbpath /tmp/rs0 --port 27017 &
+    mongosh --quiet --eval 'rs.initiate()'
+    python replset_check.py --uri "mongodb://localhost:27017/?replicaSet=rs0"
+
+Imports app.py and, for every profile in CONNECTION_PROFILES, issues a find
+under that profile while a pymongo CommandListener records what goes on the
+wire: the read preference and read concern must be the profile's. It then
+checks that
+
+  * a w=majority write through "interactive" is read back at once through
+    "interactive" and through "analytics" (on one host, secondaryPreferred
+    lands on the primary, so both profiles are exercised for real)
+  * every page that writes, or shows what an admin just changed, declares
+    the "interactive" profile
+
+Exits 1 on any failure.
+"""
+import argparse
+import os
+import sys
+
+import pymongo
+from bson import ObjectId
+from pymongo import monitoring
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Pages where an admin's own edits must show up on the next rerun (primary reads)
+READ_YOUR_WRITES_PAGES = ["users_management", "tasks_management", "submissions_management",
+                          "forums_management", "archive_page", "superadmin_page"]
+
+
+class CommandRecorder(monitoring.CommandListener):
+    def __init__(self, database_name: str):
+        self.database_name = database_name
+        self.commands = []
+
+    def started(self, event):
+        if event.database_name == self.database_name and event.command_name == "find":
+            self.commands.append(event.command)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--uri", default=os.getenv("AUDIT_MONGO_URI", "mongodb://localhost:27017/?replicaSet=rs0"))
+    ap.add_argument("--db", default="innoverse_replset_check")
+    args = ap.parse_args(argv)
+
+    recorder = CommandRecorder(args.db)
+    monitoring.register(recorder)      # before app.py creates its clients
+
+    probe = pymongo.MongoClient(args.uri, serverSelectionTimeoutMS=5000)
+    hello = probe.admin.command("hello")
+    if not hello.get("setName"):
+        print("Not a replica set member; start mongod with --replSet rs0 and run rs.initiate().")
+        return 1
+    print(f"Replica set {hello['setName']} ({len(hello.get('hosts', []))} host(s))")
+    probe.drop_database(args.db)
+
+    os.environ.update({"MONGO_URI": args.uri, "DATABASE_NAME": args.db})
+    sys.path.insert(0, HERE)
+    import app
+
+    failures = []
+
+    def check(ok: bool, label: str):
+        print(f"{'ok  ' if ok else 'FAIL'} {label}")
+        if not ok:
+            failures.append(label)
+
+    for name, opts in app.CONNECTION_PROFILES.items():
+        client = app.mongo_clients[name]
+        check(client.topology_description.topology_type_name == "ReplicaSetWithPrimary",
+              f"{name}: replica-set topology ({client.topology_description.topology_type_name})")
+        recorder.commands.clear()
+        app.uses_profile(name)(lambda: app.db.profile_probe.find_one({}))()
+        sent = recorder.commands[-1] if recorder.commands else {}
+        mode = sent.get("$readPreference", {"mode": "primary"}).get("mode")
+        level = sent.get("readConcern", {}).get("level", "local")
+        check(mode == opts["readPreference"], f"{name}: read preference {mode}")
+        check(level == opts["readConcernLevel"], f"{name}: read concern {level}")
+        if "maxStalenessSeconds" in opts:
+            staleness = sent.get("$readPreference", {}).get("maxStalenessSeconds")
+            check(staleness == opts["maxStalenessSeconds"], f"{name}: maxStalenessSeconds {staleness}")
+
+    marker = ObjectId()
+    app.uses_profile("interactive")(lambda: app.db.profile_probe.insert_one({"_id": marker}))()
+    for name in app.CONNECTION_PROFILES:
+        seen = app.uses_profile(name)(lambda: app.db.profile_probe.find_one({"_id": marker}))()
+        check(seen is not None, f"{name}: reads the interactive write back immediately")
+
+    for page in READ_YOUR_WRITES_PAGES:
+        profile = getattr(getattr(app, page), "mongo_profile", app.DEFAULT_PROFILE)
+        check(profile == "interactive", f"page {page} uses the {profile} profile")
+
+    probe.drop_database(args.db)
+    print(f"\n{len(failures)} failure(s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
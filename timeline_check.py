@@ -0,0 +1,113 @@
+"""
+User timeline check against the seeded data from query_audit.py.
+
+    python timeline_check.py
+    python timeline_check.py --uri mongodb://localhost:27017 --page-size 5
+
+Seeds a database with query_audit.seed, whose forum comments carry created_at
+as an ISO string (as the user portal writes them) while assignments and
+submissions carry dates. For the users with the most comments it pages
+through app.get_user_timeline and checks that
+
+  * every assignment, submission, comment and email of the user shows up
+    exactly once across the pages, comments included
+  * the events come newest first in (time, source, _id) order, also across
+    page boundaries and same-instant ties
+
+The expected list is read straight from the collections, independent of the
+app's merge. Exits 1 on any failure.
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timezone
+
+import pymongo
+
+from query_audit import HERE, seed
+
+
+def _when(value):
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if not isinstance(value, datetime):
+        return None
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def expected_timeline(app, db, user: dict) -> list[tuple]:
+    """Every event of `user`, newest first, as (time, source, _id)."""
+    events = []
+    for source, (coll, time_field, key, path, _) in app.TIMELINE_SOURCES.items():
+        value = user["_id"] if key == "user_id" else (user.get("email") or "")
+        if source == "email":
+            value = value.strip().lower()
+        for doc in db[coll].find({path: value}, {time_field: 1}):
+            ts = _when(doc.get(time_field))
+            if ts is not None:
+                events.append((ts, source, doc["_id"]))
+    return sorted(events, reverse=True)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--uri", default=os.getenv("AUDIT_MONGO_URI", "mongodb://localhost:27017"))
+    ap.add_argument("--db", default="innoverse_timeline_check")
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--tasks", type=int, default=20)
+    ap.add_argument("--submissions", type=int, default=1500)
+    ap.add_argument("--forums", type=int, default=30)
+    ap.add_argument("--page-size", type=int, default=4, help="small pages put cursors inside every source")
+    ap.add_argument("--check-users", type=int, default=5, help="users with the most comments to check")
+    args = ap.parse_args(argv)
+
+    db = pymongo.MongoClient(args.uri)[args.db]
+    print(f"Seeding {args.db} …")
+    seed(db, args.users, args.tasks, args.submissions, args.forums)
+    os.environ.update({
+        "MONGO_URI": args.uri,
+        "DATABASE_NAME": args.db,
+        "GMAIL_ADDRESS": os.getenv("GMAIL_ADDRESS", "timeline@example.com"),
+        "GMAIL_APP_PASSWORD": os.getenv("GMAIL_APP_PASSWORD", "unused"),
+    })
+    sys.path.insert(0, HERE)
+    import app
+
+    failures = []
+
+    def check(ok: bool, label: str):
+        print(f"{'ok  ' if ok else 'FAIL'} {label}")
+        if not ok:
+            failures.append(label)
+
+    top = list(db.forum_comments.aggregate([
+        {"$group": {"_id": "$user.email", "n": {"$sum": 1}}},
+        {"$sort": {"n": -1, "_id": 1}},
+        {"$limit": args.check_users},
+    ]))
+    check(bool(top) and isinstance(db.forum_comments.find_one()["created_at"], str),
+          "the seeded comments carry ISO-string created_at")
+    for row in top:
+        user = db.users.find_one({"email": row["_id"]})
+        want = expected_timeline(app, db, user)
+        got, before, pages = [], None, 0
+        while True:
+            items, before = app.get_user_timeline(user, before, limit=args.page_size)
+            got.extend(app._timeline_key(i) for i in items)
+            pages += 1
+            if before is None or pages > len(want) + 1:
+                break
+        sources = {s: sum(1 for e in want if e[1] == s) for s in app.TIMELINE_SOURCES}
+        label = f"{user['email']}: " + ", ".join(f"{n} {s}" for s, n in sources.items() if n)
+        check(sources["comment"] > 0 and sum(1 for e in got if e[1] == "comment") == sources["comment"],
+              f"{label}: every comment is on the timeline")
+        check(len(got) == len(set(got)), f"{label}: no event repeats across {pages} page(s)")
+        check(got == want, f"{label}: all {len(want)} events, newest first")
+
+    db.client.drop_database(args.db)
+    print(f"\n{len(failures)} failure(s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())